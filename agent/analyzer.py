@@ -1,12 +1,15 @@
-import requests
 import json
 import re
 import os
 import ast
+import time
 from agent.prompts import REASONING_PROMPT, JSON_CONVERSION_PROMPT
-from agent.context import get_code_snippet 
+from agent.context import get_code_snippet, parse_location
+from agent.fix_stream import FixStreamParser
+from agent.ollama_session import KEEP_ALIVE, OLLAMA_BASE_URL, format_timing, session
+from agent.tracing import debug, get_tracer, ollama_usage
 
-OLLAMA_URL = "http://localhost:11434/api/chat"
+OLLAMA_URL = f"{OLLAMA_BASE_URL}/api/chat"
 MODEL = "qwen2.5-coder:7b"
 
 def call_ollama(prompt: str, temp: float = 0.2) -> str:
@@ -14,6 +17,7 @@ def call_ollama(prompt: str, temp: float = 0.2) -> str:
         "model": MODEL,
         "messages": [{"role": "user", "content": prompt}],
         "stream": False,
+        "keep_alive": KEEP_ALIVE,
         "options": {
             "temperature": temp, 
             "num_predict": 512,
@@ -21,13 +25,61 @@ def call_ollama(prompt: str, temp: float = 0.2) -> str:
         }
     }
     try:
-        resp = requests.post(OLLAMA_URL, json=payload, timeout=300)
+        started = time.perf_counter()
+        resp = session.post(OLLAMA_URL, json=payload, timeout=300)
         resp.raise_for_status()
-        return resp.json()["message"]["content"]
+        data = resp.json()
+        wall = time.perf_counter() - started
+        print(f"   {format_timing(data, wall)}")
+        get_tracer().record("ollama chat", "llm", wall, **ollama_usage(data))
+        return data["message"]["content"]
     except Exception as e:
         print(f"💥 Ollama Error: {e}")
         return ""
 
+def stream_ollama_fixes(prompt: str, temp: float = 0.0) -> tuple[str, FixStreamParser]:
+    """
+    Like call_ollama, but streams the answer through FixStreamParser and closes the
+    connection (which stops the generation) as soon as the JSON is complete or hopeless.
+    Returns (text received so far, parser).
+    """
+    payload = {
+        "model": MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "stream": True,
+        "keep_alive": KEEP_ALIVE,
+        "options": {
+            "temperature": temp,
+            "num_predict": 512,
+            "stop": ["User:", "System:"]
+        }
+    }
+    fix_parser = FixStreamParser()
+    started = time.perf_counter()
+    meta = {}
+    try:
+        with session.post(OLLAMA_URL, json=payload, timeout=300, stream=True) as resp:
+            resp.raise_for_status()
+            for raw in resp.iter_lines():
+                if not raw:
+                    continue
+                data = json.loads(raw)
+                fix_parser.feed(data.get("message", {}).get("content", ""))
+                if data.get("done"):
+                    meta = data
+                    print(f"   {format_timing(data, time.perf_counter() - started)}")
+                    break
+                if fix_parser.finished:
+                    break
+    except Exception as e:
+        print(f"💥 Ollama Error: {e}")
+    wall = time.perf_counter() - started
+    get_tracer().record("ollama chat", "llm", wall, streamed=True, aborted=bool(fix_parser.abort_reason),
+                        fixes=len(fix_parser.fixes), **ollama_usage(meta))
+    if fix_parser.abort_reason:
+        print(f"   ✂️  Generation stopped after {wall:.1f}s: {fix_parser.abort_reason}")
+    return fix_parser.text, fix_parser
+
 def clean_code_string(code_str: str) -> str:
     """Removes hallucinated line numbers."""
     cleaned = re.sub(r'^\s*\d+\s*[:|]\s*', '', code_str, flags=re.MULTILINE)
@@ -42,9 +94,9 @@ def repair_json_string(text: str) -> str:
     return text
 
 def extract_json(text: str) -> dict:
-    print("\n--- [DEBUG] RAW AI OUTPUT START ---")
-    print(text)
-    print("--- [DEBUG] RAW AI OUTPUT END ---\n")
+    debug("\n--- [DEBUG] RAW AI OUTPUT START ---")
+    debug(text)
+    debug("--- [DEBUG] RAW AI OUTPUT END ---\n")
 
     match = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", text, re.DOTALL)
     if match: text = match.group(1)
@@ -61,14 +113,15 @@ def analyze_errors(error_lines: list[str], warning_lines: list[str] = None, root
     if not error_lines: return {"fixes": [], "reasoning": "No errors"}
         
     target_error = error_lines[0]
-    file_match = re.search(r"([^:\s]+):(\d+):", target_error)
-    real_filename = file_match.group(1) if file_match else ""
+    location = parse_location(target_error)
+    real_filename = location[0] if location else ""
     snippet = get_code_snippet(target_error, root_dir)
     
     print(f"🕵️  Step 1: Reasoning about: {target_error}")
     
     # PHASE 1: REASONING
-    reasoning_input = f"{REASONING_PROMPT}\n\nERROR: {target_error}\nCONTEXT:\n{snippet}"
+    # Static instructions first, then the code, then the error: the server reuses the cached prefix
+    reasoning_input = f"{REASONING_PROMPT}\n\nCONTEXT:\n{snippet}\nERROR: {target_error}"
     reasoning_output = call_ollama(reasoning_input, temp=0.3)
     if not reasoning_output: return {"fixes": [], "reasoning": "Model failed"}
 
@@ -76,9 +129,10 @@ def analyze_errors(error_lines: list[str], warning_lines: list[str] = None, root
     
     # PHASE 2: JSON
     json_input = f"{JSON_CONVERSION_PROMPT}\n\nCONTEXT:\n{snippet}\n\nPROPOSED FIX:\n{reasoning_output}"
-    json_output = call_ollama(json_input, temp=0.0)
-    
-    result = extract_json(json_output)
+    json_output, streamed = stream_ollama_fixes(json_input, temp=0.0)
+
+    # Fixes parsed while streaming; the whole-text repair path is the fallback
+    result = {"fixes": streamed.fixes} if streamed.done or streamed.fixes else extract_json(json_output)
     
     valid_fixes = []
     if result and "fixes" in result:
@@ -0,0 +1,351 @@
+import hashlib
+import json
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+# --- CONFIGURATION ---
+# Objects, compiler logs and the dependency manifest live here.
+# The folder is git-ignored so it never makes the workspace look dirty.
+CACHE_DIR = Path(".build_cache").resolve()
+DEPS_MANIFEST = "deps.json"
+
+
+@dataclass
+class TranslationUnit:
+    """One source file plus everything needed to compile it on its own."""
+    source: Path
+    flags: list[str] = field(default_factory=list)
+    compiler: str = "gcc"
+    directory: Path = field(default_factory=Path.cwd)
+
+
+@dataclass
+class BuildResult:
+    success: bool
+    logs: str
+    compiled: list[str] = field(default_factory=list)   # TUs that actually ran the compiler
+    cached: list[str] = field(default_factory=list)     # TUs replayed from the object cache
+    linked: bool = False
+    aborted: bool = False                                # Stopped early through BuildCancel
+
+
+class ObjectCache:
+    """
+    Content-addressed object cache.
+    The key of a TU is a hash of: compiler + flags + source bytes + bytes of every
+    header the last compile reported (via -MMD). Compiler output is cached next to the
+    object so warnings of an untouched file are replayed instead of silently vanishing.
+    """
+
+    def __init__(self, cache_dir: Path = CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.objects_dir = self.cache_dir / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._deps = self._load_manifest()
+
+    # --- Manifest (source -> headers + last stat fingerprint) ---
+    def _load_manifest(self) -> dict:
+        path = self.cache_dir / DEPS_MANIFEST
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def save(self):
+        path = self.cache_dir / DEPS_MANIFEST
+        tmp = path.with_suffix(".tmp")
+        with self._lock:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._deps, f, indent=1)
+        os.replace(tmp, path)
+
+    # --- Keys ---
+    @staticmethod
+    def _stat(path: str):
+        try:
+            st = os.stat(path)
+            return [st.st_mtime_ns, st.st_size]
+        except OSError:
+            return None
+
+    def _fingerprint(self, source: str, headers: list[str]) -> list:
+        return [self._stat(p) for p in [source] + headers]
+
+    def key_for(self, unit: TranslationUnit) -> str:
+        source = str(unit.source)
+        entry = self._deps.get(source, {})
+        headers = entry.get("headers", [])
+        flags_sig = [unit.compiler] + unit.flags
+
+        # Fast path: nothing we depend on was touched since the last build,
+        # so we can reuse the previous key without reading a single byte.
+        fingerprint = self._fingerprint(source, headers)
+        if entry.get("flags") == flags_sig and entry.get("fingerprint") == fingerprint and entry.get("key"):
+            return entry["key"]
+
+        h = hashlib.sha256()
+        h.update("\0".join(flags_sig).encode())
+        for path in [source] + headers:
+            h.update(b"\0" + path.encode() + b"\0")
+            try:
+                with open(path, "rb") as f:
+                    h.update(f.read())
+            except OSError:
+                h.update(b"<missing>")
+        key = h.hexdigest()
+
+        with self._lock:
+            self._deps[source] = {"headers": headers, "flags": flags_sig, "fingerprint": fingerprint, "key": key}
+        return key
+
+    def record(self, unit: TranslationUnit, headers: list[str]):
+        """Stores the header list reported by the compiler and re-keys the TU."""
+        source = str(unit.source)
+        with self._lock:
+            self._deps[source] = {"headers": headers}
+        return self.key_for(unit)
+
+    def headers_of(self, unit: TranslationUnit):
+        """Absolute paths of the headers the TU's last compile read, or None if it was never compiled."""
+        entry = self._deps.get(str(unit.source))
+        if entry is None:
+            return None
+        return [str((Path(unit.directory or ".") / h).resolve()) for h in entry.get("headers", [])]
+
+    # --- Artifacts ---
+    def object_path(self, key: str) -> Path:
+        return self.objects_dir / f"{key}.o"
+
+    def lookup(self, key: str):
+        """Returns (ok, log) for a cached compile, or None on a miss."""
+        log_path = self.objects_dir / f"{key}.log"
+        if not log_path.exists():
+            return None
+        log = log_path.read_text(encoding="utf-8", errors="ignore")
+        if (self.objects_dir / f"{key}.fail").exists():
+            return (False, log)
+        if self.object_path(key).exists():
+            return (True, log)
+        return None
+
+    def store(self, key: str, ok: bool, log: str):
+        (self.objects_dir / f"{key}.log").write_text(log, encoding="utf-8")
+        fail_marker = self.objects_dir / f"{key}.fail"
+        if ok:
+            fail_marker.unlink(missing_ok=True)
+        else:
+            fail_marker.touch()
+
+
+def parse_depfile(text: str) -> list[str]:
+    """Parses a GCC -MMD depfile ('obj: src hdr1 hdr2 \\') into the list of headers."""
+    body = text.replace("\\\n", " ")
+    if ":" in body:
+        # Skip the target (handles Windows drive letters like 'D:\...' in the target too)
+        body = body.split(": ", 1)[-1]
+    deps = []
+    token = ""
+    for part in body.split(" "):
+        # Paths with spaces are written as 'a\ b'
+        if part.endswith("\\"):
+            token += part[:-1] + " "
+            continue
+        token += part
+        if token.strip():
+            deps.append(token.strip())
+        token = ""
+    return deps[1:]  # First entry is the source itself
+
+
+class BuildCancel:
+    """
+    Lets a line callback stop the whole build early:
+    running compilers are killed and pending TUs are skipped.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._procs = set()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        self._event.set()
+        with self._lock:
+            for proc in self._procs:
+                try:
+                    proc.kill()
+                except OSError:
+                    pass
+
+    def register(self, proc: subprocess.Popen) -> bool:
+        """Tracks a running compiler. Returns False if the build was already cancelled."""
+        with self._lock:
+            if self.cancelled:
+                return False
+            self._procs.add(proc)
+            return True
+
+    def unregister(self, proc: subprocess.Popen):
+        with self._lock:
+            self._procs.discard(proc)
+
+
+def run_streaming(cmd: list[str], cwd: Path = None, on_line=None, cancel: BuildCancel = None) -> tuple[int, str]:
+    """
+    Runs a command and hands every output line to `on_line` as soon as it is printed.
+    Returns (returncode, full_output). returncode is None when the run was cancelled.
+    """
+    proc = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            text=True, errors="replace", bufsize=1)
+    if cancel is not None and not cancel.register(proc):
+        proc.kill()
+    lines = []
+    try:
+        for line in proc.stdout:
+            if cancel is not None and cancel.cancelled:
+                proc.kill()
+                break
+            lines.append(line)
+            if on_line is not None:
+                on_line(line)
+        proc.wait()
+    finally:
+        proc.stdout.close()
+        if cancel is not None:
+            cancel.unregister(proc)
+    if cancel is not None and cancel.cancelled:
+        return (None, "".join(lines))
+    return (proc.returncode, "".join(lines))
+
+
+def compile_unit(unit: TranslationUnit, cache: ObjectCache, on_line=None,
+                 cancel: BuildCancel = None) -> tuple[str, bool, str, bool]:
+    """
+    Compiles one TU into the cache (or replays it).
+    Returns (object_path, ok, compiler_output, was_cached).
+    ok is None when the build was cancelled before this TU finished; nothing is cached then.
+    """
+    if cancel is not None and cancel.cancelled:
+        return ("", None, "", False)
+
+    key = cache.key_for(unit)
+    hit = cache.lookup(key)
+    if hit is not None:
+        ok, log = hit
+        if on_line is not None:
+            for line in log.splitlines(keepends=True):
+                if cancel is not None and cancel.cancelled:
+                    break
+                on_line(line)
+        return (str(cache.object_path(key)), ok, log, True)
+
+    # Compile into a private temp name, then promote it under the final key.
+    # The final key can change if the compiler reports new headers.
+    tmp_obj = cache.objects_dir / f"tmp-{key}-{threading.get_ident()}.o"
+    depfile = tmp_obj.with_suffix(".d")
+    cmd = [unit.compiler, *unit.flags, "-c", str(unit.source), "-o", str(tmp_obj), "-MMD", "-MF", str(depfile)]
+    try:
+        returncode, log = run_streaming(cmd, unit.directory, on_line, cancel)
+        ok = None if returncode is None else returncode == 0
+    except Exception as e:
+        log = f"{unit.source}: error: failed to run compiler: {e}\n"
+        ok = False
+        if on_line is not None:
+            on_line(log)
+
+    if ok is None:
+        tmp_obj.unlink(missing_ok=True)
+        depfile.unlink(missing_ok=True)
+        return ("", None, log, False)
+
+    headers = []
+    if depfile.exists():
+        headers = parse_depfile(depfile.read_text(encoding="utf-8", errors="ignore"))
+        depfile.unlink(missing_ok=True)
+    key = cache.record(unit, headers) if headers else key
+
+    if ok and tmp_obj.exists():
+        os.replace(tmp_obj, cache.object_path(key))
+    else:
+        tmp_obj.unlink(missing_ok=True)
+    cache.store(key, ok, log)
+    return (str(cache.object_path(key)), ok, log, False)
+
+
+def link(objects: list[str], output: Path, compiler: str = "gcc", ldflags: list[str] = None,
+         cache: ObjectCache = None, directory: Path = None) -> tuple[bool, str, bool]:
+    """
+    Links the objects. Skipped when the exact same set of objects already produced `output`.
+    Returns (ok, linker_output, was_skipped).
+    """
+    ldflags = ldflags or []
+    stamp_key = hashlib.sha256("\0".join([compiler, *objects, *ldflags, str(output)]).encode()).hexdigest()
+    stamp = (cache.cache_dir if cache else CACHE_DIR) / "link.stamp"
+    if Path(output).exists() and stamp.exists() and stamp.read_text() == stamp_key:
+        return (True, "", True)
+
+    cmd = [compiler, *objects, *ldflags, "-o", str(output)]
+    try:
+        res = subprocess.run(cmd, capture_output=True, text=True, cwd=directory)
+    except Exception as e:
+        return (False, f"error: failed to run linker: {e}\n", False)
+    if res.returncode == 0:
+        stamp.write_text(stamp_key)
+    return (res.returncode == 0, res.stdout + res.stderr, False)
+
+
+def build_project(units: list[TranslationUnit], output: Path = None, ldflags: list[str] = None,
+                  jobs: int = None, cache: ObjectCache = None, on_line=None,
+                  cancel: BuildCancel = None) -> BuildResult:
+    """
+    Compiles every TU on a worker pool (only stale ones actually run the compiler),
+    then links once every object is fresh and error-free.
+    on_line (optional) receives compiler output lines as they are printed; it is called
+    from worker threads, so it must be thread-safe. It may call cancel.cancel() to stop early.
+    """
+    cache = cache or ObjectCache()
+    jobs = jobs or os.cpu_count() or 1
+
+    # Threads are enough here: the real work happens in the compiler subprocess.
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        results = list(pool.map(lambda u: compile_unit(u, cache, on_line, cancel), units))
+    cache.save()
+
+    result = BuildResult(success=True, logs="")
+    logs = []
+    objects = []
+    for unit, (obj, ok, log, was_cached) in zip(units, results):
+        if log:
+            logs.append(log)
+        if ok is None:
+            result.aborted = True
+            result.success = False
+            continue
+        (result.cached if was_cached else result.compiled).append(str(unit.source))
+        if ok:
+            objects.append(obj)
+        else:
+            result.success = False
+
+    if result.success and output is not None and units and not result.aborted:
+        ok, log, _ = link(objects, output, units[0].compiler, ldflags, cache, units[0].directory)
+        result.linked = ok
+        result.success = ok
+        if log:
+            logs.append(log)
+            if on_line is not None:
+                for line in log.splitlines(keepends=True):
+                    on_line(line)
+
+    result.logs = "\n".join(logs)
+    return result
@@ -0,0 +1,182 @@
+import json
+import os
+import re
+import shlex
+import subprocess
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from agent.build import TranslationUnit, CACHE_DIR
+from agent import source_tree
+
+# --- CONFIGURATION ---
+COMPILE_COMMANDS = "compile_commands.json"
+# Compiler arguments that are a TU: the project's sources, plus assembly (compiled, never indexed)
+SOURCE_EXTENSIONS = source_tree.SOURCE_EXTENSIONS + (".s", ".S")
+
+# gcc, cc, clang, g++, arm-none-eabi-gcc, gcc-13, gcc.exe ...
+COMPILER_RE = re.compile(r"^(?:.*[-/\\])?(?:gcc|cc|clang|g\+\+|c\+\+|clang\+\+)(?:-[\d.]+)?(?:\.exe)?$", re.IGNORECASE)
+
+# Flags that only make sense for one specific invocation (outputs, depfiles)
+_DROP_WITH_VALUE = {"-o", "-MF", "-MT", "-MQ"}
+_DROP = {"-c", "-MD", "-MMD", "-MP"}
+
+
+@dataclass
+class BuildDescription:
+    """Everything the build engine needs: the TUs and (optionally) how to link them."""
+    units: list[TranslationUnit]
+    output: Path = None
+    ldflags: list[str] = field(default_factory=list)
+    origin: str = ""
+
+
+def _is_link_flag(arg: str) -> bool:
+    return arg.startswith(("-l", "-L", "-Wl,")) or arg in ("-static", "-shared", "-pthread")
+
+
+def split_compiler_command(args: list[str], directory: Path) -> tuple[list[TranslationUnit], Path, list[str]]:
+    """
+    Splits one compiler invocation into per-source TUs.
+    'gcc -Wall a.c b.c -o app' becomes two TUs plus a link step producing 'app'.
+    Returns (units, link_output or None, ldflags).
+    """
+    compiler = args[0]
+    flags, sources, ldflags = [], [], []
+    output = None
+    compile_only = "-c" in args
+
+    i = 1
+    while i < len(args):
+        arg = args[i]
+        if arg in _DROP_WITH_VALUE:
+            if arg == "-o" and i + 1 < len(args):
+                output = args[i + 1]
+            i += 2
+            continue
+        if arg in _DROP:
+            i += 1
+            continue
+        if not arg.startswith("-") and arg.endswith(SOURCE_EXTENSIONS):
+            sources.append(arg)
+        elif not arg.startswith("-") and arg.endswith((".o", ".a")):
+            ldflags.append(arg)  # Prebuilt objects/archives only matter when linking
+        elif _is_link_flag(arg):
+            ldflags.append(arg)
+        else:
+            flags.append(arg)
+            # Flags like '-I dir' or '-include file' carry a separate value
+            if arg in ("-I", "-D", "-U", "-include", "-isystem", "-iquote", "-x") and i + 1 < len(args):
+                flags.append(args[i + 1])
+                i += 1
+        i += 1
+
+    units = []
+    for src in sources:
+        src_path = Path(src)
+        if not src_path.is_absolute():
+            src_path = (directory / src_path).resolve()
+        units.append(TranslationUnit(source=src_path, flags=flags, compiler=compiler, directory=directory))
+
+    link_output = None
+    if not compile_only and output:
+        link_output = Path(output) if Path(output).is_absolute() else (directory / output).resolve()
+    return units, link_output, ldflags
+
+
+def load_compile_commands(path: Path) -> BuildDescription:
+    """Reads a clang/CMake/Bear style compile_commands.json."""
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+
+    units = []
+    seen = set()
+    for entry in entries:
+        directory = Path(entry.get("directory", Path(path).parent))
+        if "arguments" in entry:
+            args = list(entry["arguments"])
+        else:
+            args = shlex.split(entry["command"], posix=(os.name != "nt"))
+        tus, _, _ = split_compiler_command(args, directory)
+        for tu in tus:
+            # One TU per source file, even if the database lists it several times
+            if str(tu.source) not in seen:
+                seen.add(str(tu.source))
+                units.append(tu)
+    return BuildDescription(units=units, origin=str(path))
+
+
+def _dry_run_commands(project_dir: Path, make_cmd: str) -> list[tuple[Path, list[str]]]:
+    """Runs 'make -n -B' and returns every compiler invocation with its working directory."""
+    res = subprocess.run([make_cmd, "-n", "-B"], cwd=project_dir, capture_output=True, text=True)
+    if res.returncode != 0:
+        print(f"⚠️  Makefile dry run failed: {res.stderr.strip()}")
+        return []
+
+    commands = []
+    cwd = project_dir
+    for line in res.stdout.splitlines():
+        # make -C / recursive make announces directory changes
+        entering = re.search(r"Entering directory ['`](.+)'", line)
+        if entering:
+            cwd = Path(entering.group(1))
+            continue
+        for part in re.split(r"\s*(?:&&|;)\s*", line.strip()):
+            try:
+                args = shlex.split(part, posix=(os.name != "nt"))
+            except ValueError:
+                continue
+            if not args:
+                continue
+            if args[0] == "cd" and len(args) > 1:
+                cwd = (cwd / args[1]).resolve()
+            elif COMPILER_RE.match(args[0]):
+                commands.append((cwd, args))
+    return commands
+
+
+def generate_compile_commands(project_dir: Path, make_cmd: str = "make") -> BuildDescription:
+    """
+    Derives a build description from the Makefile with a dry run, and writes the
+    equivalent compile_commands.json into the build cache for other tools to reuse.
+    """
+    units, ldflags = [], []
+    output = None
+    entries = []
+    for cwd, args in _dry_run_commands(project_dir, make_cmd):
+        tus, link_output, link_args = split_compiler_command(args, cwd)
+        for tu in tus:
+            units.append(tu)
+            entries.append({
+                "directory": str(cwd),
+                "arguments": [tu.compiler, *tu.flags, "-c", str(tu.source)],
+                "file": str(tu.source),
+            })
+        if link_output is not None:
+            output = link_output
+            ldflags = link_args
+
+    if entries:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        with open(CACHE_DIR / COMPILE_COMMANDS, "w", encoding="utf-8") as f:
+            json.dump(entries, f, indent=2)
+    return BuildDescription(units=units, output=output, ldflags=ldflags, origin=f"{project_dir / 'Makefile'} (dry run)")
+
+
+def load_build_description(project_dir: Path, make_cmd: str = "make") -> BuildDescription:
+    """
+    Priority: compile_commands.json in the project -> Makefile dry run.
+    Returns an empty description if neither exists.
+    """
+    project_dir = Path(project_dir)
+    db_path = project_dir / COMPILE_COMMANDS
+    if db_path.exists():
+        return load_compile_commands(db_path)
+
+    if (project_dir / "Makefile").exists() or (project_dir / "makefile").exists():
+        try:
+            return generate_compile_commands(project_dir, make_cmd)
+        except FileNotFoundError:
+            print(f"⚠️  '{make_cmd}' not found, cannot read the Makefile.")
+
+    return BuildDescription(units=[])
@@ -1,52 +1,181 @@
+import mmap
 import os
 import re
+import threading
+from array import array
+from functools import lru_cache
+
+from agent.tracing import get_tracer
+
+# --- CONFIGURATION ---
+MMAP_THRESHOLD = 4 * 1024 * 1024  # Files at least this big are memory-mapped instead of read
+HEAD_LINES = 5                    # Top-of-file lines every snippet starts with (includes)
+
+# Matches: "folder/file.c:10: error:"
+_LOCATION_RE = re.compile(r"([^:\s]+):(\d+):")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for code/English prompts (~4 characters per token)."""
+    return (len(text) + 3) // 4
+
+
+@lru_cache(maxsize=1024)
+def parse_location(issue: str):
+    """'folder/file.c:10: error: ...' -> ('folder/file.c', 10), or None. Cached: the loop asks often."""
+    match = _LOCATION_RE.search(issue)
+    if not match:
+        return None
+    return match.group(1), int(match.group(2))
+
+
+class SourceFile:
+    """
+    One file's content + the offset where each line starts, so any window of lines is
+    one slice (no readlines(), no re-reading). Large files are memory-mapped.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        st = os.stat(path)
+        self.stat_key = (st.st_mtime_ns, st.st_size)
+        self._mmap = None
+        with open(path, "rb") as f:
+            if st.st_size >= MMAP_THRESHOLD:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.data = self._mmap
+            else:
+                self.data = f.read()
+
+        starts = array("q", [0])
+        find = self.data.find
+        pos = find(b"\n")
+        while pos >= 0:
+            starts.append(pos + 1)
+            pos = find(b"\n", pos + 1)
+        if starts[-1] == len(self.data):
+            starts.pop()  # Trailing newline (or empty file): no empty last line, same as readlines()
+        self._starts = starts
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def lines(self, start: int, end: int) -> str:
+        """Same text as ''.join(readlines()[start:end]) (0-based, end excluded)."""
+        count = len(self._starts)
+        start, end = max(0, min(start, count)), max(0, min(end, count))
+        if start >= end:
+            return ""
+        stop = self._starts[end] if end < count else len(self.data)
+        return self.data[self._starts[start]:stop].decode("utf-8", errors="ignore").replace("\r\n", "\n")
+
+    def text(self) -> str:
+        return self.lines(0, len(self))
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+class SourceCache:
+    """Path -> SourceFile, re-read when mtime/size change or when the patcher invalidates it."""
+
+    def __init__(self):
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> SourceFile:
+        """Raises OSError like open() when the file cannot be read."""
+        key = os.path.abspath(path)
+        st = os.stat(key)
+        with self._lock:
+            cached = self._files.get(key)
+            if cached is not None and cached.stat_key == (st.st_mtime_ns, st.st_size):
+                get_tracer().count("source cache", hits=1)
+                return cached
+        source = SourceFile(key)
+        get_tracer().count("source cache", misses=1, bytes_read=st.st_size)
+        with self._lock:
+            old = self._files.get(key)
+            self._files[key] = source
+        if old is not None and old is not source:
+            old.close()
+        return source
+
+    def invalidate(self, path: str = None):
+        """Drops one file (e.g. right before it is patched), or every file when path is None."""
+        with self._lock:
+            if path is None:
+                dropped = list(self._files.values())
+                self._files.clear()
+            else:
+                dropped = [self._files.pop(os.path.abspath(path), None)]
+        for source in dropped:
+            if source is not None:
+                source.close()  # A mapped file cannot be rewritten on Windows
+
+
+_sources = SourceCache()
+
+def get_source(path: str) -> SourceFile:
+    """Process-wide cached, line-indexed view of a source file."""
+    return _sources.get(path)
+
+def invalidate_source(path: str = None):
+    _sources.invalidate(path)
+
 
 def get_code_snippet(error_line_str: str, root_dir: str) -> str:
     """
     Extracts code around the error AND the top of the file (for headers).
     """
     # 1. Parse filename and line number from error string
-    # Matches: "folder/file.c:10: error:"
-    match = re.search(r"([^:\s]+):(\d+):", error_line_str)
-    if not match:
+    location = parse_location(error_line_str)
+    if not location:
         return ""
-    
-    rel_path = match.group(1)
-    line_num = int(match.group(2))
-    
-    # 2. Find the file
+    rel_path, line_num = location
+
+    # 2. Find the file + the snippet: one window around the error
+    return get_multi_snippet(rel_path, [line_num], root_dir)
+
+
+def get_multi_snippet(rel_path: str, line_numbers: list[int], root_dir: str, radius: int = 5) -> str:
+    """
+    Like get_code_snippet, but for several lines of the same file in one read:
+    the top of the file plus one window per group of nearby lines (overlapping windows are merged).
+    """
     abs_path = os.path.join(root_dir, rel_path)
     if not os.path.exists(abs_path):
         return f"File not found: {abs_path}"
-    
+
     try:
-        with open(abs_path, "r", encoding="utf-8", errors="ignore") as f:
-            lines = f.readlines()
-            
-        total_lines = len(lines)
-        snippet = ""
-
-        # --- PART A: ALWAYS INCLUDE TOP OF FILE (For Headers) ---
-        # We include lines 1-5 so the AI can see existing includes
-        snippet += "--- [FILE START] ---\n"
-        head_end = min(5, total_lines)
-        for i in range(head_end):
-            # Format: "  1: #include <stdlib.h>"
-            snippet += f"{lines[i]}"
-            
-        # --- PART B: THE ERROR CONTEXT ---
+        source = get_source(abs_path)
+    except Exception as e:
+        return f"Error reading file: {e}"
+
+    total_lines = len(source)
+    # --- PART A: ALWAYS INCLUDE TOP OF FILE (For Headers) ---
+    head_end = min(HEAD_LINES, total_lines)
+    parts = ["--- [FILE START] ---\n", source.lines(0, head_end)]
+
+    # --- PART B: THE ERROR CONTEXT ---
+    # Merge the [line-radius, line+radius) windows that touch each other
+    windows = []
+    for line_num in sorted(set(line_numbers)):
+        start = max(head_end, line_num - radius)
+        end = min(total_lines, line_num + radius)
+        if windows and start <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], end)
+        elif start < end:
+            windows.append([start, end])
+
+    last_end = head_end
+    for start, end in windows:
         # If the error is far down, add a separator
-        start_line = max(head_end, line_num - 5)
-        end_line = min(total_lines, line_num + 5)
-        
-        if start_line > head_end:
-            snippet += "\n... [SKIPPED CODE] ...\n\n"
-            
-        for i in range(start_line, end_line):
-            # Note: i is 0-indexed, so line number is i+1
-            snippet += f"{lines[i]}"
-            
-        return snippet
+        if start > last_end:
+            parts.append("\n... [SKIPPED CODE] ...\n\n")
+        parts.append(source.lines(start, end))
+        last_end = end
 
-    except Exception as e:
-        return f"Error reading file: {e}"
\ No newline at end of file
+    return "".join(parts)
@@ -0,0 +1,115 @@
+import json
+
+# --- CONFIGURATION ---
+SKIPPED_MARKER = "[SKIPPED CODE]"
+MAX_PREAMBLE_CHARS = 400   # Prose / code fence allowed before the JSON object starts
+MAX_FIX_CHARS = 8000       # One fix object larger than this is the model rambling
+
+
+class FixStreamParser:
+    """
+    Incremental parser for the {"fixes": [{...}, {...}]} answer of the fix prompt.
+    feed() takes the text as it streams in and returns every CodeFix object that just
+    closed. As soon as the output cannot turn into a valid FixList (wrong structure,
+    unparsable fix, [SKIPPED CODE] placeholder, no JSON at all), abort_reason is set and
+    the caller should stop the generation. done is set when the top-level object closes.
+    """
+
+    def __init__(self, on_fix=None):
+        self.on_fix = on_fix       # Optional callback(fix) -> bool; False drops the fix
+        self.text = ""
+        self.fixes = []
+        self.done = False
+        self.abort_reason = ""
+        self._pos = 0
+        self._start = -1           # Offset of the top-level '{'
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._fix_start = -1
+
+    @property
+    def finished(self) -> bool:
+        return self.done or bool(self.abort_reason)
+
+    def _abort(self, reason: str):
+        self.abort_reason = reason
+        return []
+
+    def feed(self, chunk: str) -> list[dict]:
+        if self.finished:
+            return []
+        self.text += chunk
+        if self._start >= 0 and SKIPPED_MARKER in self.text[max(self._start, self._pos - len(SKIPPED_MARKER)):]:
+            return self._abort(f"output references a {SKIPPED_MARKER} placeholder")
+
+        new = []
+        text = self.text
+        while self._pos < len(text):
+            i, ch = self._pos, text[self._pos]
+            self._pos += 1
+            if self._start < 0:
+                if ch == "{":
+                    self._start = i
+                    self._stack.append("{")
+                    if SKIPPED_MARKER in text[i:]:
+                        return self._abort(f"output references a {SKIPPED_MARKER} placeholder")
+                elif i >= MAX_PREAMBLE_CHARS:
+                    return self._abort("no JSON object in the output")
+                continue
+            if self._fix_start >= 0 and i - self._fix_start > MAX_FIX_CHARS:
+                return self._abort("fix object is too long")
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if len(self._stack) == 2 and ch not in " \t\r\n,{]":
+                return self._abort("'fixes' must hold objects")
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._stack.append(ch)
+                depth = len(self._stack)
+                if depth == 2 and (ch != "[" or '"fixes"' not in text[self._start:i]):
+                    return self._abort("output is not a {\"fixes\": [...]} list")
+                if depth == 3:
+                    if ch != "{":
+                        return self._abort("'fixes' must hold objects")
+                    self._fix_start = i
+            elif ch in "}]":
+                if not self._stack or self._stack[-1] != ("{" if ch == "}" else "["):
+                    return self._abort(f"unbalanced '{ch}' in the output")
+                self._stack.pop()
+                depth = len(self._stack)
+                if depth == 2 and ch == "}":
+                    fix = self._close_fix(text[self._fix_start:i + 1])
+                    if fix is None:
+                        return new
+                    if fix:
+                        new.append(fix)
+                elif depth == 0:
+                    self.done = True
+                    return new
+        return new
+
+    def _close_fix(self, raw: str):
+        """Validates one finished fix object. Returns the fix, {} if dropped, or None on abort."""
+        self._fix_start = -1
+        try:
+            fix = json.loads(raw, strict=False)  # strict=False: raw newlines inside strings are fine
+        except ValueError:
+            self._abort("a fix object is not valid JSON")
+            return None
+        if not isinstance(fix.get("original_code"), str) or not isinstance(fix.get("replacement_code"), str):
+            self._abort("a fix object has no original_code / replacement_code")
+            return None
+        if self.on_fix is not None and not self.on_fix(fix):
+            return {}
+        self.fixes.append(fix)
+        return fix
@@ -1,48 +1,286 @@
+import difflib
 import os
+import re
+import shutil
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from agent.context import invalidate_source
+from agent.tracing import get_tracer
+
+# --- CONFIGURATION ---
+FUZZY_WINDOW = 40        # Lines around the diagnostic searched when the anchor is not exact
+FUZZY_RATIO = 0.85       # Minimum difflib similarity for a fuzzy anchor
+FUZZY_MAX_LINES = 2000   # Without a line hint, fuzzy matching only runs on files this small
+
+# C tokens: words/numbers, string and char literals, multi-character operators, single characters
+_TOKEN_RE = re.compile(r"""\w+|"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'"""
+                       r"|<<=|>>=|\.\.\.|->|\+\+|--|<<|>>|<=|>=|==|!=|&&|\|\||##|[-+*/%&|^]=|\S")
+# Two punctuation tokens that would read as one operator if written without a space
+_JOINING = {"<<", ">>", "->", "++", "--", "<=", ">=", "==", "!=", "&&", "||", "##", "..",
+            "+=", "-=", "*=", "/=", "%=", "&=", "|=", "^=", "<<=", ">>="}
+# The only tokens a fuzzy anchor may get wrong (a missing ';', an extra paren...)
+_SOFT = set(";,(){}[]")
+
+
+def _line_starts(content: str) -> list[int]:
+    starts = [0]
+    pos = content.find("\n")
+    while pos >= 0:
+        starts.append(pos + 1)
+        pos = content.find("\n", pos + 1)
+    return starts
+
+
+def _nearest(matches: list[tuple[int, int]], content: str, hint_lines: list[int]):
+    """The match closest to one of the hint lines; without hints the first one (the old behaviour)."""
+    if not matches:
+        return None
+    if len(matches) == 1 or not hint_lines:
+        return matches[0]
+    return min(matches, key=lambda m: min(abs(content.count("\n", 0, m[0]) + 1 - line) for line in hint_lines))
+
+
+def _is_word(token: str) -> bool:
+    return token[0].isalnum() or token[0] in "_\"'"
+
+
+def _significant(text: str) -> list[str]:
+    """The tokens of a piece of code a fuzzy anchor must reproduce: all but separators/brackets."""
+    return [tok for tok in _TOKEN_RE.findall(text) if tok not in _SOFT]
+
+
+def _token_pattern(original: str) -> re.Pattern:
+    """
+    Regex for the same C tokens with any whitespace between them, still split where two words
+    (or two operators, 'a - -b' is not 'a--b') would otherwise run together.
+    """
+    tokens = _TOKEN_RE.findall(original)
+    pattern = re.escape(tokens[0])
+    for prev, tok in zip(tokens, tokens[1:]):
+        word_gap = _is_word(prev) and _is_word(tok)
+        operator_gap = not _is_word(prev) and not _is_word(tok) and (prev[-1] + tok[0] in _JOINING
+                                                                       or prev + tok in _JOINING)
+        pattern += (r"\s+" if word_gap or operator_gap else r"\s*") + re.escape(tok)
+    return re.compile(pattern)
+
+
+def locate(content: str, original: str, hint_lines: list[int] = ()):
+    """
+    Finds where `original` sits in `content` (LF line endings). Tries, in order:
+      exact       every occurrence, the one nearest the diagnostic line wins
+      whitespace  same tokens, any indentation / spacing / line breaks between them
+      fuzzy       difflib-similar block of the same number of lines near the diagnostic, with
+                  exactly the same identifiers, literals and operators: only spacing and
+                  separators / brackets may differ ('counter_b' never lands on 'counter_a')
+    Returns (start, end, how) or None when the anchor is missing (or the fuzzy match is a tie).
+    """
+    if not original.strip():
+        return None
+
+    matches = []
+    pos = content.find(original)
+    while pos >= 0:
+        matches.append((pos, pos + len(original)))
+        pos = content.find(original, pos + 1)
+    found = _nearest(matches, content, hint_lines)
+    if found:
+        return (*found, "exact")
+
+    found = _nearest([m.span() for m in _token_pattern(original).finditer(content)], content, hint_lines)
+    if found:
+        return (*found, "whitespace")
+
+    return _fuzzy_locate(content, original, hint_lines)
+
+
+def _fuzzy_locate(content: str, original: str, hint_lines: list[int]):
+    starts = _line_starts(content)
+    total = len(starts)
+    if hint_lines:
+        first = max(0, min(hint_lines) - 1 - FUZZY_WINDOW)
+        last = min(total, max(hint_lines) + FUZZY_WINDOW)
+    elif total <= FUZZY_MAX_LINES:
+        first, last = 0, total
+    else:
+        return None
+
+    wanted = [line.strip() for line in original.strip("\n").split("\n")]
+    size = len(wanted)
+    target = "\n".join(wanted)
+    significant = _significant(target)
+    matcher = difflib.SequenceMatcher(autojunk=False)
+    matcher.set_seq2(target)
+    lines = content.split("\n")
+    best, best_ratio, tie = None, 0.0, False
+    for i in range(first, max(first, last - size + 1)):
+        candidate = "\n".join(line.strip() for line in lines[i:i + size])
+        matcher.set_seq1(candidate)
+        if matcher.real_quick_ratio() < FUZZY_RATIO or matcher.quick_ratio() < FUZZY_RATIO:
+            continue
+        if _significant(candidate) != significant:
+            continue
+        ratio = matcher.ratio()
+        if ratio > best_ratio:
+            best, best_ratio, tie = i, ratio, False
+        elif ratio == best_ratio:
+            tie = True
+    if best is None or best_ratio < FUZZY_RATIO or tie:
+        return None
+    start = starts[best]
+    end_line = best + size
+    end = starts[end_line] - 1 if end_line < total else len(content)
+    return (start, end, "fuzzy")
+
+
+def _write_atomic(path: Path, text: str):
+    """Writes through a temp file in the same directory + os.replace (never a half-written file)."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", errors="surrogateescape", newline="") as f:
+            f.write(text)
+        shutil.copymode(path, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+@dataclass
+class FilePatch:
+    """The result of patching one file in memory: written by write_patch(), undone by restore_patch()."""
+    path: Path
+    original: str        # Raw text as read (original line endings)
+    patched: str
+    fixes: list[dict]    # The fixes that landed, in file order
+    regions: list[tuple[int, int]] = field(default_factory=list)  # 1-based line range of each fix in `patched`
+
+
+def plan_patch(abs_path: Path, fixes: list[dict]) -> FilePatch:
+    """
+    Applies every fix of ONE file against a single in-memory copy (nothing is written).
+    Each fix may carry "lines" (diagnostic line numbers) to pick among several matches.
+    Overlapping fixes are skipped. CRLF files stay CRLF.
+    """
+    with open(abs_path, "r", encoding="utf-8", errors="surrogateescape", newline="") as f:
+        raw = f.read()
+    crlf = raw.count("\r\n") > raw.count("\n") // 2
+    content = raw.replace("\r\n", "\n")
+
+    # Locate every fix first, then drop the ones that overlap an earlier fix
+    spans = []
+    for fix in fixes:
+        original = fix.get("original_code", "").replace("\r\n", "\n")
+        found = locate(content, original, fix.get("lines") or ())
+        if found is None:
+            print(f"⚠️ Fix Failed: Could not find original code block in {abs_path.name}")
+            continue
+        start, end, how = found
+        if how != "exact":
+            print(f"   🎯 Anchor found by {how} match in {abs_path.name}")
+        if any(start < s_end and s_start < end for s_start, s_end, _, _ in spans):
+            print(f"⚠️ Skipping overlapping fix in {abs_path.name}")
+            continue
+        spans.append((start, end, fix.get("replacement_code", "").replace("\r\n", "\n"), fix))
+
+    # Splice back to front so earlier offsets stay valid
+    parts, cursor = [], len(content)
+    for start, end, replacement, _ in sorted(spans, key=lambda span: span[0], reverse=True):
+        parts.append(content[end:cursor])
+        parts.append(replacement)
+        cursor = start
+    parts.append(content[:cursor])
+    new_content = "".join(reversed(parts))
+    if crlf:
+        new_content = new_content.replace("\n", "\r\n")
+
+    regions, shift = [], 0
+    spans.sort(key=lambda span: span[0])
+    for start, end, replacement, _ in spans:
+        first = content.count("\n", 0, start) + 1 + shift
+        regions.append((first, first + replacement.count("\n")))
+        shift += replacement.count("\n") - content.count("\n", start, end)
+    return FilePatch(abs_path, raw, new_content if spans else raw, [span[3] for span in spans], regions)
+
+
+def write_patch(patch: FilePatch):
+    invalidate_source(patch.path)
+    with get_tracer().span("file patch", "io", fixes=len(patch.fixes), bytes=len(patch.patched)):
+        _write_atomic(patch.path, patch.patched)
+
+
+def restore_patch(patch: FilePatch):
+    """Puts the file back the way plan_patch() found it."""
+    invalidate_source(patch.path)
+    _write_atomic(patch.path, patch.original)
+
+
+def patch_file(abs_path: Path, fixes: list[dict]) -> int:
+    """plan_patch() + one atomic write. Returns the number of fixes applied."""
+    patch = plan_patch(abs_path, fixes)
+    if patch.fixes:
+        write_patch(patch)
+    return len(patch.fixes)
+
 
 def apply_fixes(fixes: list[dict], root_dir: str = ".") -> int:
     """
     Applies a list of fixes to the source code.
     Returns the number of successful fixes applied.
     """
-    applied_count = 0
-
+    resolved = []
     for fix in fixes:
-        # 1. Resolve path
         file_path = os.path.join(root_dir, fix["file"])
-        
         if not os.path.exists(file_path):
             print(f"❌ Fixer Error: File not found: {file_path}")
             continue
+        resolved.append({**fix, "file": file_path})
+    return apply_fix_batch(resolved)
 
-        try:
-            # 2. Read content
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read()
-
-            original = fix["original_code"]
-            replacement = fix["replacement_code"]
-
-            # 3. SAFETY CHECK: Verify exact match
-            # We use count=1 to ensure we don't accidentally replace multiple occurrences 
-            # if the code snippet is generic (like "return 0;").
-            if original not in content:
-                print(f"⚠️  Skipping fix for {fix['file']}: Original code not found or context mismatch.")
-                # Debug help: print what we were looking for vs what might be there
-                # print(f"   Wanted: {repr(original)}")
-                continue
 
-            # 4. Apply replacement
-            new_content = content.replace(original, replacement, 1)
+def plan_fix_batch(fixes: list[dict], path_map=None) -> list[FilePatch]:
+    """
+    Groups fixes per file and patches each file in memory. path_map (optional) redirects a
+    resolved path, e.g. into a sandbox copy. Files where no fix landed are left out.
+    """
+    by_file = {}
+    for fix in fixes:
+        abs_path = Path(fix["file"]).resolve()
+        if path_map is not None:
+            abs_path = path_map(abs_path)
+        by_file.setdefault(abs_path, []).append(fix)
 
-            # 5. Write back
-            with open(file_path, "w", encoding="utf-8") as f:
-                f.write(new_content)
+    patches = []
+    for abs_path, file_fixes in by_file.items():
+        try:
+            patch = plan_patch(abs_path, file_fixes)
+        except Exception as e:
+            print(f"❌ File Error: {e}")
+            continue
+        if patch.fixes:
+            patches.append(patch)
+    return patches
 
-            print(f"✅ Applied fix to {fix['file']}")
-            applied_count += 1
 
+def write_patches(patches: list[FilePatch]) -> int:
+    """Writes every planned file once. Returns the number of fixes applied."""
+    applied_count = 0
+    for patch in patches:
+        try:
+            write_patch(patch)
         except Exception as e:
-            print(f"❌ Failed to write {file_path}: {e}")
+            print(f"❌ File Error: {e}")
+            continue
+        print(f"✅ Applied {len(patch.fixes)} fix(es) to {patch.path.name}")
+        applied_count += len(patch.fixes)
+    return applied_count
+
 
-    return applied_count
\ No newline at end of file
+def apply_fix_batch(fixes: list[dict], path_map=None) -> int:
+    """
+    Applies LangChain-style fixes ({'file', 'original_code', 'replacement_code'}).
+    Fixes are grouped per file: each file is read once, overlapping fixes are skipped, then it
+    is written once. Returns the number of fixes applied.
+    """
+    return write_patches(plan_fix_batch(fixes, path_map))
@@ -1,12 +1,16 @@
 from langgraph.graph import StateGraph, END
 from agent.state import AgentState
+from agent.progress import MAX_STALLED_ROUNDS, open_issues
+from agent.tracing import traced_node
 from agent.nodes import (
     create_branch_node,
     run_build_node,
     get_context_node,
     generate_fix_node,
     apply_fix_node,
-    revert_node
+    revert_node,
+    reindex_node,
+    prefetch_targets
 )
 
 # --- 1. ROUTING LOGIC ---
@@ -22,6 +26,14 @@ def check_initial_build(state: AgentState):
     print("✅ Build passed with ZERO warnings. Code is perfect.")
     return "end"
 
+def check_preverify(state: AgentState):
+    """Routes the syntax pre-check: a patch that does not even parse never reaches the full build."""
+    if (state.get("preverify_rejected") and state.get("retry_count", 0) < 4
+            and open_issues(state.get("diagnostics", []), state.get("progress"))):
+        print("🔁 Patch rejected by the pre-verify check. Looping back to Agent...")
+        return "get_context"
+    return "verify"
+
 def check_verification(state: AgentState):
     """Routes the verification build (The Loop Engine)."""
     has_errors = len(state.get("error_lines", [])) > 0
@@ -29,32 +41,60 @@ def check_verification(state: AgentState):
     
     if not has_errors and not has_warnings:
         print("🎉 Code is perfect! Zero Errors, Zero Warnings.")
-        return "end"
+        return "reindex"
         
     if state.get("retry_count", 0) >= 4:
         print("🛑 Reached maximum AI retries (4). Stopping to prevent infinite loop.")
-        return "end"
+        # Keep the RAG index in sync with whatever compiled fine
+        return "reindex" if state.get("build_success") else "end"
         
+    # Progress-aware stops: the verify pass diffed the diagnostic sets (agent/progress.py)
+    progress = state.get("progress") or {}
+    if state.get("diagnostics") and not open_issues(state["diagnostics"], progress):
+        print("🧊 Only quarantined issues are left. Stopping.")
+        return "reindex" if state.get("build_success") else "end"
+
+    if progress.get("stalled_rounds", 0) >= MAX_STALLED_ROUNDS:
+        print(f"🛑 No diagnostic went away in {progress['stalled_rounds']} rounds. Stopping.")
+        return "reindex" if state.get("build_success") else "end"
+
     current_errors = len(state.get("error_lines", []))
-    if current_errors < 20:
-         print("🔄 Issue addressed, but compiler is still complaining. Looping back to Agent...")
-         return "get_context"
-    
-    return "revert"
+    baseline_errors = progress.get("baseline_errors")
+    if baseline_errors is None:
+        baseline_errors = current_errors   # Only truncated builds so far: nothing to compare with
+    if current_errors > baseline_errors:
+        print(f"📉 {current_errors} errors now vs {progress['baseline_errors']} at the start. Reverting.")
+        return "revert"
+
+    print("🔄 Issue addressed, but compiler is still complaining. Looping back to Agent...")
+    return "get_context"
+
+
+def prefetching(route):
+    """
+    Wraps a build router: when the next node is get_context, its context starts loading
+    right away; on any other route the streamed prefetches are dropped (nobody will use them).
+    """
+    def check(state: AgentState):
+        next_node = route(state)
+        prefetch_targets(state if next_node == "get_context" else {})
+        return next_node
+    return check
 
 
 # --- 2. BUILD THE GRAPH ---
 
 workflow = StateGraph(AgentState)
 
-# Register all our worker nodes
-workflow.add_node("setup", create_branch_node)
-workflow.add_node("build", run_build_node)
-workflow.add_node("get_context", get_context_node)
-workflow.add_node("generate", generate_fix_node)
-workflow.add_node("apply", apply_fix_node)
-workflow.add_node("verify", run_build_node) # We use the build node again to verify
-workflow.add_node("revert", revert_node)
+# Register all our worker nodes (each visit is timed, see agent/tracing.py)
+workflow.add_node("setup", traced_node("setup", create_branch_node))
+workflow.add_node("build", traced_node("build", run_build_node))
+workflow.add_node("get_context", traced_node("get_context", get_context_node))
+workflow.add_node("generate", traced_node("generate", generate_fix_node))
+workflow.add_node("apply", traced_node("apply", apply_fix_node))
+workflow.add_node("verify", traced_node("verify", run_build_node)) # We use the build node again to verify
+workflow.add_node("revert", traced_node("revert", revert_node))
+workflow.add_node("reindex", traced_node("reindex", reindex_node))
 
 # Step A: Start the pipeline
 workflow.set_entry_point("setup")
@@ -63,7 +103,7 @@ workflow.add_edge("setup", "build")
 # Step B: The Initial Build Routing (This is likely what went missing!)
 workflow.add_conditional_edges(
     "build",
-    check_initial_build,
+    prefetching(check_initial_build),
     {
         "end": END,
         "get_context": "get_context"
@@ -73,21 +113,32 @@ workflow.add_conditional_edges(
 # Step C: The AI Fix Pipeline
 workflow.add_edge("get_context", "generate")
 workflow.add_edge("generate", "apply")
-workflow.add_edge("apply", "verify")
+workflow.add_conditional_edges(
+    "apply",
+    check_preverify,
+    {
+        "get_context": "get_context",
+        "verify": "verify"
+    }
+)
 
 # Step D: The Loop/Verification Routing
 workflow.add_conditional_edges(
     "verify",
-    check_verification,
+    prefetching(check_verification),
     {
         "end": END,
         "revert": "revert",
-        "get_context": "get_context"
+        "get_context": "get_context",
+        "reindex": "reindex"
     }
 )
 
 # Step E: Failure Revert
 workflow.add_edge("revert", END)
 
+# Step F: Successful run -> refresh the RAG index for the files we patched
+workflow.add_edge("reindex", END)
+
 # Compile into an executable application
 app = workflow.compile()
\ No newline at end of file
@@ -0,0 +1,188 @@
+import re
+from collections import deque
+from pathlib import Path
+
+from agent.source_tree import SOURCE_EXTENSIONS, FileIndex
+
+# --- CONFIGURATION ---
+INDEX_PATH = Path(".build_cache").resolve() / "includes.json"
+
+# '#include "a.h"' / '#include <b.h>' (comments after the name are fine)
+_INCLUDE_RE = re.compile(r'^[ \t]*#[ \t]*include[ \t]*([<"])([^>"\n]+)[>"]', re.MULTILINE)
+_INCLUDE_FLAGS = ("-I", "-iquote", "-isystem", "-idirafter")
+
+
+def include_dirs_of(flags: list[str], directory: Path) -> tuple[list[Path], list[Path]]:
+    """
+    The search path a compiler command gives to #include.
+    Returns (quote_dirs, dirs): quote_dirs only apply to "..." includes, dirs to both.
+    """
+    quote_dirs, dirs = [], []
+    i = 0
+    while i < len(flags):
+        flag = flags[i]
+        for prefix in _INCLUDE_FLAGS:
+            if flag == prefix and i + 1 < len(flags):
+                value = flags[i + 1]
+                i += 1
+            elif flag.startswith(prefix) and flag != prefix:
+                value = flag[len(prefix):]
+            else:
+                continue
+            path = Path(value)
+            path = path if path.is_absolute() else Path(directory) / path
+            (quote_dirs if prefix == "-iquote" else dirs).append(path.resolve())
+            break
+        i += 1
+    return quote_dirs, dirs
+
+
+def scan_includes(text: str) -> list[list]:
+    """[[name, quoted, line], ...] for every #include directive of a file."""
+    return [[m.group(2).strip(), m.group(1) == '"', text.count("\n", 0, m.start()) + 1]
+            for m in _INCLUDE_RE.finditer(text)]
+
+
+class IncludeGraph(FileIndex):
+    """
+    Which project files include which, across a tree. Built from the #include directives
+    (no preprocessor: an include inside '#if 0' still counts) and resolved the way GCC
+    searches: the includer's directory for "...", then -iquote, then -I / -isystem.
+    Headers outside the tree (libc...) are not followed. Persisted and refreshed by
+    mtime/size like the symbol index.
+    """
+
+    def __init__(self, root: Path, quote_dirs: list[Path] = (), dirs: list[Path] = (), path: Path = INDEX_PATH):
+        super().__init__(root, path)   # files: rel path -> {"stat": [mtime_ns, size], "includes": [[name, quoted, line]]}
+        self.quote_dirs = [Path(d) for d in quote_dirs]
+        self.dirs = [Path(d) for d in dirs]
+        self.edges = {}     # rel path -> [rel paths it includes] (project files only)
+        self.reverse = {}   # rel path -> [rel paths that include it]
+
+    # --- Building ---
+    def refresh(self, paths: list = None) -> int:
+        """
+        Rescans new/changed files (or just `paths`), drops deleted ones, re-resolves the edges.
+        Returns files rescanned. A `paths` refresh re-resolves only those files' edges (all of
+        them when a file appeared or vanished) and is not saved: the next process sees the new
+        mtimes and rescans them anyway.
+        """
+        changes, removed = self._changes(paths)
+        for rel in removed:
+            del self.files[rel]
+
+        stale, added = [], False
+        for rel, p, stat_key in changes:
+            try:
+                with open(p, "r", encoding="utf-8", errors="ignore") as f:
+                    includes = scan_includes(f.read())
+            except OSError:
+                continue
+            added = added or rel not in self.files
+            self.files[rel] = {"stat": stat_key, "includes": includes}
+            stale.append(rel)
+
+        if paths is None or removed or added or not self.edges:
+            if stale or removed or not self.edges:
+                self._resolve()
+            if paths is None and (stale or removed):
+                self.save()
+        else:
+            for rel in stale:
+                self._resolve_file(rel)
+        return len(stale)
+
+    def _lookup(self, includer: str, name: str, quoted: bool):
+        """The rel path an #include resolves to, or None when it is outside the tree."""
+        search = [(self.root / includer).parent] + self.quote_dirs if quoted else []
+        for directory in search + self.dirs:
+            candidate = (directory / name).resolve()
+            try:
+                rel = candidate.relative_to(self.root).as_posix()
+            except ValueError:
+                if candidate.is_file():
+                    return None  # Found outside the project: GCC stops there too
+                continue
+            if rel in self.files:
+                return rel
+        return None
+
+    def _resolve(self):
+        edges, reverse = {}, {}
+        for rel, entry in self.files.items():
+            targets = []
+            for name, quoted, _ in entry["includes"]:
+                target = self._lookup(rel, name, quoted)
+                if target and target not in targets:
+                    targets.append(target)
+                    reverse.setdefault(target, []).append(rel)
+            edges[rel] = targets
+        self.edges, self.reverse = edges, reverse
+
+    def _resolve_file(self, rel: str):
+        """Re-resolves the edges of one file whose #includes may have changed."""
+        for target in self.edges.get(rel, []):
+            includers = self.reverse.get(target, [])
+            if rel in includers:
+                includers.remove(rel)
+        targets = []
+        for name, quoted, _ in self.files[rel]["includes"]:
+            target = self._lookup(rel, name, quoted)
+            if target and target not in targets:
+                targets.append(target)
+                self.reverse.setdefault(target, []).append(rel)
+        self.edges[rel] = targets
+
+    # --- Queries ---
+    def headers_of(self, path) -> list[str]:
+        """Every project header a file sees, directly or through other headers (nearest first)."""
+        start = self.rel(path)
+        seen, order = {start}, []
+        queue = deque([start])
+        while queue:
+            for target in self.edges.get(queue.popleft(), []):
+                if target not in seen:
+                    seen.add(target)
+                    order.append(target)
+                    queue.append(target)
+        return order
+
+    def dependents(self, path) -> list[str]:
+        """The source files (TUs) that must be rebuilt when this file changes."""
+        start = self.rel(path)
+        seen = {start}
+        queue = deque([start])
+        while queue:
+            for includer in self.reverse.get(queue.popleft(), []):
+                if includer not in seen:
+                    seen.add(includer)
+                    queue.append(includer)
+        return sorted(rel for rel in seen if rel.endswith(SOURCE_EXTENSIONS))
+
+    def declaring_headers(self, name: str, path, symbol_index) -> list[dict]:
+        """
+        The declarations/definitions of `name` that live in headers this file can see
+        (symbol index hits, nearest header first).
+        """
+        visible = self.headers_of(path)
+        rank = {rel: i for i, rel in enumerate(visible)}
+        hits = [hit for hit in symbol_index.by_name.get(name, []) if hit["file"] in rank]
+        return sorted(hits, key=lambda hit: rank[hit["file"]])
+
+
+_graphs = {}
+
+def get_include_graph(root: str, quote_dirs: list[Path] = (), dirs: list[Path] = (), paths: list = None) -> IncludeGraph:
+    """
+    Process-wide graph per tree and search path: loaded from disk and brought up to date by
+    mtime once, then only `paths` (the files the agent just patched or rolled back) are rescanned.
+    """
+    key = (str(Path(root).resolve()), tuple(map(str, quote_dirs)), tuple(map(str, dirs)))
+    graph = _graphs.get(key)
+    if graph is None:
+        graph = IncludeGraph(Path(root), quote_dirs, dirs).load()
+        graph.refresh()
+        _graphs[key] = graph
+    elif paths:
+        graph.refresh(paths)
+    return graph
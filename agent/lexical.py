@@ -0,0 +1,196 @@
+import gzip
+import json
+import math
+import os
+import re
+import threading
+
+from agent.vector_store import DB_PATH
+
+# --- CONFIGURATION ---
+# BM25 over the identifier tokens of the same chunks the vector store holds (same chunk ids)
+LEXICAL_PATH = os.path.join(DB_PATH, "lexical.json.gz")
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_IDENT_RE = re.compile(r"[A-Za-z_]\w+")
+_C_KEYWORDS = {
+    "auto", "break", "case", "char", "const", "continue", "default", "do", "double", "else",
+    "enum", "extern", "float", "for", "goto", "if", "inline", "int", "long", "register",
+    "restrict", "return", "short", "signed", "sizeof", "static", "struct", "switch", "typedef",
+    "union", "unsigned", "void", "volatile", "while", "include", "define", "ifdef", "ifndef",
+    "endif", "elif", "undef", "pragma", "NULL", "bool", "true", "false",
+}
+
+
+def tokenize(text: str) -> list[str]:
+    """Identifier tokens of a chunk or a query (C keywords and 1-char names dropped)."""
+    return [tok for tok in _IDENT_RE.findall(text) if tok not in _C_KEYWORDS]
+
+
+class LexicalIndex:
+    """
+    Inverted index: identifier -> chunks that use it, scored with BM25.
+    Persisted as one gzipped JSON file: a vocabulary plus, per file, its content hash and
+    per chunk [id, length, [term id, tf, term id, tf, ...]]. Chunk texts are not stored
+    here; callers resolve ids through the vector store.
+    """
+
+    def __init__(self, path: str = LEXICAL_PATH):
+        self.path = path
+        self.files = {}   # rel path -> {"hash": ..., "chunks": [[id, length, {term: tf}], ...]}
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._dirty = False
+
+    # --- Loading / saving ---
+    def _load(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                    data = json.load(f)
+                vocab = data["vocab"]
+                for rel, entry in data["files"].items():
+                    chunks = []
+                    for doc_id, length, flat in entry["chunks"]:
+                        chunks.append([doc_id, length, {vocab[flat[i]]: flat[i + 1] for i in range(0, len(flat), 2)}])
+                    self.files[rel] = {"hash": entry["hash"], "chunks": chunks}
+            except Exception:
+                self.files = {}
+            self._reindex()
+            self._loaded = True
+
+    def flush(self):
+        self._load()
+        with self._lock:
+            if not self._dirty:
+                return
+            vocab, term_ids = [], {}
+            files = {}
+            for rel, entry in self.files.items():
+                chunks = []
+                for doc_id, length, terms in entry["chunks"]:
+                    flat = []
+                    for term, tf in terms.items():
+                        if term not in term_ids:
+                            term_ids[term] = len(vocab)
+                            vocab.append(term)
+                        flat.extend((term_ids[term], tf))
+                    chunks.append([doc_id, length, flat])
+                files[rel] = {"hash": entry["hash"], "chunks": chunks}
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with gzip.open(tmp, "wt", encoding="utf-8") as f:
+                json.dump({"vocab": vocab, "files": files}, f, separators=(",", ":"))
+            os.replace(tmp, self.path)
+            self._dirty = False
+
+    # --- Updating ---
+    def reset(self):
+        with self._lock:
+            self.files = {}
+            self._reindex()
+            self._loaded = True
+            self._dirty = True
+
+    def indexed_files(self) -> set[str]:
+        self._load()
+        with self._lock:
+            return set(self.files)
+
+    def file_hash(self, rel: str):
+        self._load()
+        return self.files.get(rel, {}).get("hash")
+
+    def update_file(self, rel: str, digest: str, ids: list[str], chunks: list[str]):
+        """(Re)indexes one file from the chunks chunk_file produced and their ids."""
+        self._load()
+        entry_chunks = []
+        for doc_id, chunk in zip(ids, chunks):
+            tokens = tokenize(chunk)
+            terms = {}
+            for tok in tokens:
+                terms[tok] = terms.get(tok, 0) + 1
+            entry_chunks.append([doc_id, len(tokens), terms])
+        with self._lock:
+            self.files[rel] = {"hash": digest, "chunks": entry_chunks}
+            self._dirty = True
+            self._stale = True
+
+    def remove_file(self, rel: str):
+        self._load()
+        with self._lock:
+            if self.files.pop(rel, None) is not None:
+                self._dirty = True
+                self._stale = True
+
+    def _reindex(self):
+        postings = {}
+        lengths = {}
+        for entry in self.files.values():
+            for doc_id, length, terms in entry["chunks"]:
+                lengths[doc_id] = length
+                for term, tf in terms.items():
+                    postings.setdefault(term, []).append((doc_id, tf))
+        self._postings = postings
+        self._lengths = lengths
+        self._avg_length = sum(lengths.values()) / len(lengths) if lengths else 0.0
+        self._stale = False
+
+    # --- Queries ---
+    def search(self, query: str, n_results: int = 3) -> tuple[list[tuple[str, float]], bool]:
+        """
+        BM25 top-k chunk ids for the identifiers of `query`.
+        Returns ([(chunk id, score), ...], confident) where confident means the lexical
+        ranking is clear enough to be used without the vector side.
+        """
+        self._load()
+        with self._lock:
+            if self._stale:
+                self._reindex()
+            postings, lengths, avg_length = self._postings, self._lengths, self._avg_length
+        query_terms = list(dict.fromkeys(tokenize(query)))
+        terms = [t for t in query_terms if t in postings]
+        if not terms:
+            return [], False
+
+        total = len(lengths)
+        scores, matched = {}, {}
+        for term in terms:
+            hits = postings[term]
+            idf = math.log(1 + (total - len(hits) + 0.5) / (len(hits) + 0.5))
+            for doc_id, tf in hits:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[doc_id] / max(avg_length, 1e-9))
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+                matched[doc_id] = matched.get(doc_id, 0) + 1
+
+        ranked = sorted(scores.items(), key=lambda item: -item[1])
+        # Trusted alone (no embedding call) when the query is made only of identifiers the
+        # code actually uses and the top chunk contains all of them
+        confident = len(terms) == len(query_terms) and matched[ranked[0][0]] == len(terms)
+        return ranked[:n_results], confident
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = 60) -> list[str]:
+    """Merges several ranked id lists: score(id) = sum of 1 / (k + rank) over the lists."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda doc_id: -scores[doc_id])
+
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_lexical_index() -> LexicalIndex:
+    """Process-wide lexical index (loaded lazily, once)."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = LexicalIndex()
+        return _index
@@ -2,9 +2,16 @@
 from langchain_ollama import ChatOllama
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.runnables import RunnableLambda
 from pydantic import BaseModel, Field
 from typing import List
 
+import time
+
+from agent.fix_stream import FixStreamParser
+from agent.ollama_session import KEEP_ALIVE, OLLAMA_BASE_URL, format_timing
+from agent.tracing import get_tracer, ollama_usage
+
 # 1. Define the exact structure we want using Pydantic
 # LangChain will automatically force Qwen to output this!
 class CodeFix(BaseModel):
@@ -16,22 +23,98 @@ class FixList(BaseModel):
     fixes: List[CodeFix]
 
 # 2. Initialize the model
+# keep_alive pins the model on the server between iterations (see agent/ollama_session.py)
+MODEL = "qwen2.5-coder:7b"
+
 llm = ChatOllama(
-    model="qwen2.5-coder:7b",
+    model=MODEL,
     temperature=0.0,
-    base_url="http://localhost:11434"
+    base_url=OLLAMA_BASE_URL,
+    keep_alive=KEEP_ALIVE
 )
 
 # 3. Setup the robust JSON parser
 parser = JsonOutputParser(pydantic_object=FixList)
 
 # 4. Create the LangChain Prompt
-# Notice how we inject parser.get_format_instructions() to auto-generate the JSON rules
+# Segments go from most static to most volatile, so the server can reuse its cached prefix:
+#   system (never changes) -> code context (stable while we work on a file) -> error (changes every call).
+# The format instructions are baked in once instead of being passed with every request.
 fix_prompt = ChatPromptTemplate.from_messages([
-    ("system", "You are a strict C compiler repair agent.\n{format_instructions}"),
-    ("user", "ERROR:\n{error_msg}\n\nCONTEXT:\n{code_context}\n\nGenerate the fix.")
-])
+    ("system", "You are a strict C compiler repair agent.\n"
+               "Generate the fix for the compiler error at the end of the message. "
+               "If several errors are listed, add one fix object per error.\n{format_instructions}"),
+    ("user", "CONTEXT:\n{code_context}\n\nERROR:\n{error_msg}")
+]).partial(format_instructions=parser.get_format_instructions())
+
+
+def _report_timing(message):
+    """Pass-through step that prints the call's time-to-first-token (from Ollama's own timings)."""
+    meta = getattr(message, "response_metadata", {})
+    line = format_timing(meta)
+    if line:
+        print(f"   {line}")
+        get_tracer().record("ollama chat", "llm", meta["total_duration"] / 1e9, **ollama_usage(meta))
+    return message
 
 # 5. Build the Chain
 # This replaces our entire call_ollama and extract_json functions
-fix_chain = fix_prompt | llm | parser
\ No newline at end of file
+fix_chain = fix_prompt | llm | RunnableLambda(_report_timing) | parser
+
+_models = {0.0: llm}
+_chains = {0.0: fix_chain}
+
+def _model(temperature: float) -> ChatOllama:
+    if temperature not in _models:
+        _models[temperature] = ChatOllama(model=MODEL, temperature=temperature, base_url=OLLAMA_BASE_URL,
+                                          keep_alive=KEEP_ALIVE)
+    return _models[temperature]
+
+def build_fix_chain(temperature: float):
+    """Same chain with a different sampling temperature (used to get diverse candidate fixes)."""
+    if temperature not in _chains:
+        _chains[temperature] = fix_prompt | _model(temperature) | RunnableLambda(_report_timing) | parser
+    return _chains[temperature]
+
+
+class StreamingFixChain:
+    """
+    Drop-in for fix_chain.invoke() that streams the answer: fixes are parsed as each
+    object closes (on_fix can check them against the file), and the generation is
+    cancelled as soon as the output is structurally invalid or uses [SKIPPED CODE].
+    """
+
+    def __init__(self, temperature: float = 0.0, on_fix=None):
+        self.stream_chain = fix_prompt | _model(temperature)
+        self.on_fix = on_fix
+
+    def invoke(self, inputs: dict) -> dict:
+        fix_parser = FixStreamParser(on_fix=self.on_fix)
+        started = time.perf_counter()
+        first_token = None
+        meta = {}
+        stream = self.stream_chain.stream(inputs)
+        try:
+            for chunk in stream:
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+                meta = chunk.response_metadata or meta
+                fix_parser.feed(chunk.content)
+                if fix_parser.finished:
+                    break
+        finally:
+            stream.close()  # Dropping the connection makes Ollama stop generating
+        wall = time.perf_counter() - started
+        get_tracer().record("ollama chat", "llm", wall, streamed=True, aborted=bool(fix_parser.abort_reason),
+                            fixes=len(fix_parser.fixes), **ollama_usage(meta))
+        if fix_parser.abort_reason:
+            print(f"   ✂️  Generation stopped after {wall:.1f}s: {fix_parser.abort_reason}")
+        elif meta:
+            print(f"   {format_timing(meta)}")
+        if first_token is not None:
+            print(f"   ⏱️ First token after {first_token:.2f}s, {len(fix_parser.fixes)} fix(es) streamed in {wall:.1f}s")
+        return {"fixes": fix_parser.fixes}
+
+
+def build_streaming_fix_chain(temperature: float, on_fix=None) -> StreamingFixChain:
+    return StreamingFixChain(temperature, on_fix)
@@ -0,0 +1,156 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from agent.confidence import is_confident
+
+# --- CONFIGURATION ---
+MEMORY_PATH = os.path.join(os.getcwd(), "Memory", "solutions.json")
+MAX_ENTRIES = 500  # Least recently used signatures are evicted beyond this
+
+_QUOTED_RE = re.compile(r"[‘'`\"]([^’'\"]+)[’'\"]")
+_NUMBER_RE = re.compile(r"\b\d+\b")
+_IDENT_RE = re.compile(r"^[A-Za-z_]\w*$")
+
+
+def normalize_signature(severity: str, message: str, option: str = "") -> tuple[str, list[str]]:
+    """
+    Abstracts a diagnostic so the same kind of problem gets the same key everywhere:
+      "unused variable 'count' [-Wunused-variable]" -> "warning|-Wunused-variable|unused variable '<ID0>'"
+    Returns (signature, identifiers) where identifiers fill the <IDn> slots, in order.
+    """
+    identifiers = []
+
+    def abstract(m):
+        value = m.group(1)
+        if value not in identifiers:
+            identifiers.append(value)
+        return f"'<ID{identifiers.index(value)}>'"
+
+    text = _QUOTED_RE.sub(abstract, message)
+    text = _NUMBER_RE.sub("<N>", text)
+    return f"{severity}|{option}|{text}", identifiers
+
+
+def _to_template(code: str, identifiers: list[str]) -> str:
+    """Replaces the diagnostic's identifiers in a fix with {{n}} placeholders."""
+    for i, ident in enumerate(identifiers):
+        if _IDENT_RE.match(ident):
+            code = re.sub(rf"\b{re.escape(ident)}\b", f"{{{{{i}}}}}", code)
+    return code
+
+
+def _from_template(code: str, identifiers: list[str]):
+    """Fills {{n}} placeholders back in. Returns None if the template needs more identifiers."""
+    def fill(m):
+        index = int(m.group(1))
+        if index >= len(identifiers):
+            raise KeyError(index)
+        return identifiers[index]
+    try:
+        return re.sub(r"\{\{(\d+)\}\}", fill, code)
+    except KeyError:
+        return None
+
+
+class FixMemory:
+    """
+    Persistent fix cache on top of Memory/solutions.json.
+    Entries are indexed by normalized signature (dict -> O(1) lookup) and kept in LRU order.
+    Older hand-written entries without a 'signature' are preserved untouched.
+    """
+
+    def __init__(self, path: str = MEMORY_PATH, max_entries: int = MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._legacy = []
+        self._entries = OrderedDict()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            data = []
+        # Oldest use first so OrderedDict order == LRU order
+        for entry in sorted(data, key=lambda e: e.get("last_used", e.get("timestamp", 0))):
+            if "signature" in entry:
+                self._entries[entry["signature"]] = entry
+            else:
+                self._legacy.append(entry)
+
+    def save(self):
+        with self._lock:
+            data = self._legacy + list(self._entries.values())
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def lookup(self, signature: str):
+        with self._lock:
+            entry = self._entries.get(signature)
+            if entry is not None:
+                self._entries.move_to_end(signature)
+                entry["last_used"] = int(time.time())
+            return entry
+
+    def replay(self, signature: str, identifiers: list[str]):
+        """
+        Returns concrete fixes for this diagnostic if a verified template is confident enough,
+        otherwise None (= ask the model).
+        """
+        entry = self.lookup(signature)
+        if entry is None or not entry.get("fix_template") or not is_confident(entry):
+            return None
+        fixes = []
+        for template in entry["fix_template"]:
+            original = _from_template(template["original_code"], identifiers)
+            replacement = _from_template(template["replacement_code"], identifiers)
+            if original is None or replacement is None:
+                return None
+            fixes.append({"original_code": original, "replacement_code": replacement})
+        return fixes
+
+    def record(self, signature: str, identifiers: list[str], raw_issue: str, fixes: list[dict], verified: bool):
+        """Stores the outcome of a fix attempt (verified = the targeted diagnostic disappeared)."""
+        template = [{
+            "original_code": _to_template(fix.get("original_code", ""), identifiers),
+            "replacement_code": _to_template(fix.get("replacement_code", ""), identifiers),
+        } for fix in fixes]
+
+        with self._lock:
+            entry = self._entries.pop(signature, None) or {
+                "signature": signature,
+                "error_signature": raw_issue,
+                "outcomes": {"verified": 0, "failed": 0},
+            }
+            outcomes = entry["outcomes"]
+            outcomes["verified" if verified else "failed"] += 1
+            # A template that just worked replaces the old one; failures never overwrite a good template
+            if verified:
+                entry["fix_template"] = template
+            # Laplace-smoothed success rate: needs 2 clean wins before is_confident() trusts it
+            entry["confidence"] = round((outcomes["verified"] + 1) / (outcomes["verified"] + outcomes["failed"] + 2), 3)
+            entry["timestamp"] = entry["last_used"] = int(time.time())
+            self._entries[signature] = entry
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        self.save()
+
+
+_memory = None
+
+def get_memory() -> FixMemory:
+    """Process-wide FixMemory (loaded on first use)."""
+    global _memory
+    if _memory is None:
+        _memory = FixMemory()
+    return _memory
@@ -1,24 +1,111 @@
 import os
+import re
 import subprocess
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import replace
 from pathlib import Path
 from typing import Dict, Any
 
 from agent.state import AgentState
 # IMPORT PARSER HERE
-from agent.llm import fix_chain, parser 
-from agent.rag import search_codebase 
-from agent.context import get_code_snippet 
+from agent.llm import fix_chain, build_fix_chain, build_streaming_fix_chain
+from agent.rag import search_codebase, read_chunk
+from agent.context import get_multi_snippet, estimate_tokens, get_source, invalidate_source, parse_location
+from agent.packer import ContextPiece, source_pieces, declaration_pieces, attempt_piece, pack_context, format_report
+from agent.build import TranslationUnit, BuildCancel, build_project
+from agent.build_db import BuildDescription, load_build_description
+from agent.memory import get_memory, normalize_signature
+from agent.include_graph import IncludeGraph, get_include_graph, include_dirs_of
+from agent.lexical import tokenize
+from agent.preverify import introduced_errors, syntax_check, unbalanced
+from agent.progress import count_failures, diag_key, diff_diagnostics, new_progress, quarantined_issues, record_round
+from agent.fixer import FilePatch, locate, plan_fix_batch, plan_patch, restore_patch, write_patch, write_patches
+from agent.rules import merge_fixes, rule_fixes
+from agent.speculative import generate_candidates, pick_candidate
+from agent.symbols import get_symbol_index, format_symbol_context
+from agent.tracing import get_tracer
+from parsers.gcc import parse_diagnostic_line, parse_log
 
 # --- CONFIGURATION ---
 GCC_PATH = r"D:\eaton-ut\GCC-140200-64\GCC-140200-64\bin\gcc.exe"
 if os.path.exists(GCC_PATH):
     os.environ["PATH"] += os.pathsep + str(Path(GCC_PATH).parent)
 
-TESTCODE_DIR = Path("testcode").resolve()
-# NOTE: We now build test.c AND math_utils.c together!
-# Added -I"{TESTCODE_DIR}" so GCC finds your local headers!
-BUILD_CMD = f'"{GCC_PATH}" "{TESTCODE_DIR / "test.c"}" "{TESTCODE_DIR / "math_utils.c"}" -I"{TESTCODE_DIR}" -o "{TESTCODE_DIR / "test_app"}" -Wall'
+COMPILER = GCC_PATH if os.path.exists(GCC_PATH) else "gcc"
+
+TESTCODE_DIR = Path(os.environ.get("AGENT_PROJECT_DIR", "testcode")).resolve()
+# The build is read from TESTCODE_DIR/compile_commands.json, or from a dry run of its Makefile.
+# Each file is compiled on its own (and cached), so a one-line patch only recompiles its own TU.
+# FALLBACK: if the project has neither, we build test.c AND math_utils.c together,
+# with -I"{TESTCODE_DIR}" so GCC finds your local headers!
+BUILD_SOURCES = [TESTCODE_DIR / "test.c", TESTCODE_DIR / "math_utils.c"]
+BUILD_FLAGS = [f"-I{TESTCODE_DIR}", "-Wall"]
+BUILD_OUTPUT = TESTCODE_DIR / "test_app"
+# Equivalent of make -j: how many compilers run at the same time
+BUILD_JOBS = int(os.environ.get("AGENT_BUILD_JOBS", os.cpu_count() or 1))
+
+# STREAMING: compiler output is parsed line by line while GCC is still running.
+# Context for the first diagnostics is gathered in the background before the build even ends.
+STREAM_BUILD = os.environ.get("AGENT_STREAM_BUILD", "1") != "0"
+# Stop the build after this many errors (0 = always run the full build).
+# The agent only works on the first issue, so the rest of a broken build is often wasted time.
+# Verify builds always run in full: they are the reference the next round is compared with.
+MAX_ERRORS = int(os.environ.get("AGENT_MAX_ERRORS", "0"))
+
+# BATCHING: fix every nearby diagnostic of the same file in ONE LLM call + ONE verify build,
+# instead of one issue per graph iteration.
+BATCH_MODE = os.environ.get("AGENT_BATCH", "0") == "1"
+BATCH_LINE_WINDOW = int(os.environ.get("AGENT_BATCH_WINDOW", "20"))      # Max distance (lines) to a group member
+BATCH_MAX_ISSUES = int(os.environ.get("AGENT_BATCH_MAX_ISSUES", "15"))
+BATCH_TOKEN_BUDGET = int(os.environ.get("AGENT_BATCH_TOKENS", "3000"))   # Issues + code context
+
+# PARALLEL FILES: issues in different files are independent, so their fix requests can run
+# at the same time. Match this to the server's OLLAMA_NUM_PARALLEL slots (1 = one request at a time).
+FIX_CONCURRENCY = int(os.environ.get("AGENT_FIX_CONCURRENCY", os.environ.get("OLLAMA_NUM_PARALLEL", "1")))
+
+# SPECULATIVE: ask for N candidate fixes (different temperatures), verify each one in its own
+# throwaway git worktree at the same time, and keep the first that strictly improves the build.
+# One parallel round instead of up to 4 sequential retries. (1 = off)
+SPECULATIVE_CANDIDATES = int(os.environ.get("AGENT_SPECULATIVE", "1"))
+
+# STREAMING LLM: fixes are parsed while the model is still typing; a malformed answer or one
+# that copies the [SKIPPED CODE] marker is cut off right away instead of running to num_predict.
+STREAM_LLM = os.environ.get("AGENT_STREAM_LLM", "1") != "0"
+
+# RULES: deterministic fixers for trivial diagnostics (unused variable/parameter, missing libc
+# #include, missing ';'). When any apply, the round fixes all of them without calling the model.
+RULE_FIXES = os.environ.get("AGENT_RULES", "1") != "0"
+
+# PRE-VERIFY: before the full verify build, patched files get a bracket balance check and their
+# TUs a 'gcc -fsyntax-only' (patched sources are fed over stdin, before anything is written).
+# A patch that breaks the syntax is dropped and the loop goes straight back to the model.
+PREVERIFY = os.environ.get("AGENT_PREVERIFY", "1") != "0"
+
+# PROMPT SIZE: every request's code context is packed into this many tokens (error window,
+# file head, enclosing function, RAG hits, related headers, previous failed attempts, in that order).
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("AGENT_CONTEXT_TOKENS", "2000"))
+MAX_DECLARATIONS = 8  # Header declarations offered to the packer per work item
+
+_context_pool = ThreadPoolExecutor(max_workers=max(2, FIX_CONCURRENCY))
+_prefetched_context = {}  # issue line -> Future[list[ContextPiece]] with its gathered context
+_applied_patches = {}     # path -> FilePatch written by the last apply_fix_node (undone on regression)
+
+_build_description = None
+
+def get_build_description() -> BuildDescription:
+    """Loads the project's build description once per process."""
+    global _build_description
+    if _build_description is None:
+        desc = load_build_description(TESTCODE_DIR)
+        if not desc.units:
+            units = [TranslationUnit(source=src, flags=BUILD_FLAGS, compiler=COMPILER, directory=TESTCODE_DIR)
+                     for src in BUILD_SOURCES]
+            desc = BuildDescription(units=units, output=BUILD_OUTPUT, origin="built-in defaults")
+        print(f"📋 Build description: {desc.origin} ({len(desc.units)} translation units)")
+        _build_description = desc
+    return _build_description
 
 # --- NODE 1: CHECK WORKSPACE ---
 def check_workspace_node(state: AgentState) -> Dict[str, Any]:
@@ -37,51 +124,377 @@ def create_branch_node(state: AgentState) -> Dict[str, Any]:
 # --- NODE 3: RUN BUILD ---
 def run_build_node(state: AgentState) -> Dict[str, Any]:
     print("🔨 Running build...")
-    res = subprocess.run(BUILD_CMD, capture_output=True, text=True, shell=True)
-    logs = res.stdout + "\n" + res.stderr
-    
-    errors = []
-    warnings = []
-    for line in logs.splitlines():
-        if ": error:" in line or ": fatal error:" in line:
-            errors.append(line.strip())
-        elif ": warning:" in line:
-            warnings.append(line.strip())
-            
-    success = (res.returncode == 0)
-    print(f"Build Success: {success} | Errors: {len(errors)}")
-    
+    verifying = bool(state.get("current_issue") and state.get("proposed_fixes"))
+    # A verify build is never cut short: its diagnostics are compared with the next one's
+    res, diagnostics = _build(STREAM_BUILD, cutoff=not verifying)
+    result = _build_result(res, diagnostics)
+
+    # VERIFY PASS: diff against the previous build, undo regressions, teach the fix memory
+    if verifying and state.get("build_aborted"):
+        # The build before stopped after MAX_ERRORS: TUs it never compiled would all look "new"
+        print("   ✂️  The previous build was cut short: this round is not compared with it")
+        progress = state.get("progress") or new_progress(diagnostics)
+        if progress.get("baseline_errors") is None:
+            progress = {**progress, "baseline_errors": len(result["error_lines"])}
+        result["progress"] = progress
+    elif verifying:
+        result.update(_settle_round(state, diagnostics))
+        _record_fix_outcome(state, result["diagnostics"])
+    elif not state.get("progress"):
+        result["progress"] = new_progress(diagnostics, complete=not res.aborted)
+    return result
+
+
+def _build(streaming: bool, cutoff: bool = True):
+    desc = get_build_description()
+    _drop_prefetched()
+
+    on_line, cancel = None, None
+    if streaming:
+        on_line, cancel = _make_stream_handler(desc.units, MAX_ERRORS if cutoff else 0)
+
+    with get_tracer().span("gcc build", "build", units=len(desc.units)) as span:
+        res = build_project(desc.units, output=desc.output, ldflags=desc.ldflags, jobs=BUILD_JOBS,
+                            on_line=on_line, cancel=cancel)
+        span.update(compiled=len(res.compiled), cached=len(res.cached))
+    if res.aborted:
+        print(f"   ✂️  Build cut short after {MAX_ERRORS} error(s)")
+    print(f"   ⚙️  Compiled {len(res.compiled)} / cached {len(res.cached)} translation units")
+
+    # Each TU's output is kept in one piece (no interleaving between parallel compilers).
+    # Structured diagnostics (notes attached, cascades collapsed into their root cause)
+    return res, list(parse_log(res.logs))
+
+
+def _build_result(res, diagnostics: list) -> Dict[str, Any]:
+    errors = [d.raw for d in diagnostics if d.severity == "error"]
+    warnings = [d.raw for d in diagnostics if d.severity == "warning"]
+    print(f"Build Success: {res.success} | Errors: {len(errors)}")
     return {
-        "build_success": success,
-        "build_logs": logs,
+        "build_success": res.success,
+        "build_logs": res.logs,
         "error_lines": errors,
-        "warning_lines": warnings
+        "warning_lines": warnings,
+        "diagnostics": diagnostics,
+        "build_aborted": res.aborted,   # Cut short after MAX_ERRORS: not every TU was compiled
     }
 
 
-# --- NODE 4: GATHER CONTEXT ---
-def get_context_node(state: AgentState) -> Dict[str, Any]:
+def _settle_round(state: AgentState, diagnostics: list) -> Dict[str, Any]:
     """
-    This node acts as the 'Information Gatherer' for the AI.
-    It decides WHAT to fix (prioritizing errors over warnings) and 
-    gathers the necessary code snippets (Local + RAG) so the AI can see the problem.
+    Compares the verify build with the build before it (by diag_key, so shifted lines don't
+    matter). A work item is blamed only for new errors inside / right around the regions its
+    own fixes patched (errors a root-cause fix merely uncovered elsewhere are not its fault).
+    If those are at least as many as the targets it fixed, just its fixes are taken out: the
+    file is re-patched with the other items' fixes, and the project is rebuilt. Targets that
+    are still there count as a failed attempt (and get quarantined after QUARANTINE_AFTER).
     """
-    
-    # --- 1. TRACKING RETRIES ---
-    # Variable: current_retries
-    # We read the current loop count from the state. If it's the first run, it defaults to 0.
-    # This prevents the agent from looping infinitely if it gets stuck.
-    current_retries = state.get("retry_count", 0)
+    before = state.get("diagnostics", [])
+    delta = diff_diagnostics(before, diagnostics)
+    fixed = {diag_key(d) for d in delta.fixed}
+
+    items, dropped = [], {}   # dropped: path -> fixes taken out of that file's patch
+    for item in state.get("work_items", []):
+        own = []   # This item's share of each patch: same file, only its fixes' regions
+        for patch in _applied_patches.values():
+            regions = [region for fix, region in zip(patch.fixes, patch.regions) if fix in item.get("fixes", [])]
+            if regions:
+                own.append(replace(patch, regions=regions))
+        targets = [_find_diagnostic(state, issue) for issue in item["issues"]]
+        done = sum(1 for t in targets if t is not None and diag_key(t) in fixed)
+        introduced = introduced_errors(delta.introduced, before, own)
+        if introduced and len(introduced) >= done:
+            print(f"↩️  Rolling back the fix(es) of {Path(item['file'] or own[0].path).name}: "
+                  f"they introduced {introduced[0].to_line()}")
+            for patch in own:
+                dropped.setdefault(str(patch.path), []).extend(f for f in patch.fixes if f in item["fixes"])
+            item = {**item, "rejected": [f"it introduced: {d.to_line()}" for d in introduced]}
+        items.append(item)
+
+    result = {"work_items": items}
+    if dropped:
+        for path, fixes in dropped.items():
+            patch = _applied_patches.pop(path)
+            restore_patch(patch)
+            keep = [fix for fix in patch.fixes if fix not in fixes]
+            if keep:
+                kept = plan_patch(patch.path, keep)
+                write_patch(kept)
+                _applied_patches[path] = kept
+        _refresh_indexes(list(dropped))
+        print("🔨 Rebuilding without the rolled back fix(es)...")
+        res, diagnostics = _build(False)
+        result.update(_build_result(res, diagnostics))
+        delta = diff_diagnostics(before, diagnostics)
+        fixed = {diag_key(d) for d in delta.fixed}
+
+    failed = [diag_key(t) for item in items for t in map(lambda i: _find_diagnostic(state, i), item["issues"])
+              if t is not None and diag_key(t) not in fixed]
+    progress = state.get("progress") or new_progress(before)
+    result["progress"] = record_round(progress, delta, failed, sum(map(len, dropped.values())))
+    return result
+
+
+def _find_diagnostic(state: AgentState, issue: str):
+    """Returns the structured Diagnostic behind an issue line (or None)."""
+    for diag in state.get("diagnostics", []):
+        if diag.raw == issue:
+            return diag
+    return None
+
+
+def _record_fix_outcome(state: AgentState, new_diagnostics: list):
+    """
+    Called on the verify build. An attempt counts as verified if its own diagnostic went away
+    (diag_key: same file, function and message, so another instance of the same kind of
+    warning elsewhere does not count against it) and the build did not gain errors.
+    Only single-issue work items are recorded (a batch has no single signature).
+    """
+    old_errors = len(state.get("error_lines", []))
+    new_errors = sum(1 for d in new_diagnostics if d.severity == "error")
+    fixed = {diag_key(d) for d in diff_diagnostics(state.get("diagnostics", []), new_diagnostics).fixed}
+    items = state.get("work_items") or [{
+        "issues": [state["current_issue"]], "fixes": state["proposed_fixes"], "source": state.get("fix_source", "llm")
+    }]
+
+    for item in items:
+        if len(item["issues"]) != 1 or not item.get("fixes") or item.get("source") == "rules":
+            continue  # Rule fixes are deterministic: nothing for the memory to learn
+        target = _find_diagnostic(state, item["issues"][0])
+        if target is None:
+            continue
+        signature, identifiers = normalize_signature(target.severity, target.message, target.option)
+        verified = diag_key(target) in fixed and new_errors <= old_errors
+        print(f"   🧠 Fix memory: attempt {'verified' if verified else 'failed'} ({item.get('source', 'llm')})")
+        get_memory().record(signature, identifiers, target.raw, item["fixes"], verified)
+
+
+def _make_stream_handler(units: list, max_errors: int = MAX_ERRORS):
+    """
+    Builds the thread-safe per-line callback for a streaming build.
+    It counts errors (for the early cutoff after max_errors, 0 = none) and starts gathering context early for the issue
+    get_context_node is most likely to pick: the first error (and warning) of the EARLIEST
+    translation unit, since the final log is in unit order, not in arrival order.
+    It's only a head start: prefetch_targets fixes it up once the log is parsed.
+    """
+    cancel = BuildCancel()
+    lock = threading.Lock()
+    seen = {"error": 0, "warning": 0}
+    best = {"error": len(units), "warning": len(units)}   # Unit index of the current prefetch
+    order = {}
+    for index, unit in enumerate(units):
+        order.setdefault(str(Path(unit.source).resolve()), index)
+        order.setdefault(Path(unit.source).name, index)
+
+    def on_line(line: str):
+        diag = parse_diagnostic_line(line)
+        if diag is None or diag.severity not in seen:
+            return
+        # Diagnostics in headers can't be placed: they may belong to any unit
+        unit = order.get(str(Path(diag.file).resolve()), order.get(Path(diag.file).name))
+        with lock:
+            seen[diag.severity] += 1
+            earlier = unit is not None and unit < best[diag.severity]
+            if earlier:
+                best[diag.severity] = unit
+            too_many = max_errors and diag.severity == "error" and seen["error"] >= max_errors
+        if earlier:
+            print(f"   ⚡ {diag.severity.capitalize()} arrived, gathering context early: {diag.raw}")
+            _prefetched_context[diag.raw] = _context_pool.submit(gather_context, diag.raw)
+        if too_many:
+            cancel.cancel()
 
+    return on_line, cancel
+
+
+def prefetch_targets(state: AgentState):
+    """
+    Called by the router once it knows the next node is get_context: drops the streamed
+    prefetches get_context_node won't use and starts gathering context for the targets it
+    will pick (see _select_targets), so the work happens while the graph moves on.
+    """
+    targets, _ = _select_targets(state)
+    _drop_prefetched(keep=targets)
+    for issue in targets:
+        if issue not in _prefetched_context:
+            _prefetched_context[issue] = _context_pool.submit(gather_context, issue)
+
+
+def _drop_prefetched(keep=()):
+    """Cancels the prefetches not in `keep` (the pool's threads would otherwise hold up the exit)."""
+    for issue in list(_prefetched_context):
+        if issue not in keep:
+            _prefetched_context.pop(issue).cancel()
+
+
+# GCC quotes identifiers as 'name' in the C locale and as ‘name’ in UTF-8 locales
+_MISSING_SYMBOL_RE = re.compile(r"(?:implicit declaration of function|undefined reference to)\s+[‘'`]([A-Za-z_]\w*)[’'`]")
+
+
+def gather_rag_context(target_issue: str):
+    """
+    Looks up the definition behind a 'missing function' style issue.
+    The exact symbol index answers first; the vector DB is only the fallback.
+    Returns a "rag" ContextPiece, or None for every other kind of issue.
+    """
+    # Example target_issue: "implicit declaration of function 'add_numbers'"
+    match = _MISSING_SYMBOL_RE.search(target_issue)
+    if not match:
+        return None
+    query = match.group(1)
+
+    # --- 1. EXACT LOOKUP ---
+    # Name -> definition + prototype + exporting header, straight from a dict.
+    try:
+        symbol_context = format_symbol_context(get_symbol_index(str(TESTCODE_DIR)), query)
+    except Exception as e:
+        print(f"⚠️ Symbol index unavailable: {e}")
+        symbol_context = ""
+    if symbol_context:
+        return ContextPiece("rag", symbol_context)
+
+    # --- 2. FALLBACK: VECTOR SEARCH ---
+    # We only ask for the top 1 most relevant result to save token space.
+    # Chunks are whole top-level definitions, so this is exactly the relevant one.
+    results = search_codebase(query, n_results=1)
+    if results:
+        code, start, end = read_chunk(results[0])
+        if start:
+            label = f"RAG SEARCH RESULT ({Path(results[0]['file']).name}:{start}-{end})"
+            return ContextPiece("rag", code, file=str(Path(results[0]["file"]).resolve()), start_line=start, label=label)
+        return ContextPiece("rag", code, label="RAG SEARCH RESULT")
+    return None
+
+
+def _local_pieces(rel_path: str, line_numbers: list[int], issue_text: str = "") -> list[ContextPiece]:
+    """Error windows, file head, enclosing functions and the header declarations they use."""
+    abs_path = os.path.join(str(Path.cwd()), rel_path)
+    if not os.path.exists(abs_path):
+        return [ContextPiece("error_window", f"File not found: {abs_path}", required=True)]
+    abs_path = str(Path(abs_path).resolve())
+    return source_pieces(abs_path, line_numbers) + _declaration_pieces(abs_path, line_numbers, issue_text)
+
+
+_include_dirs = None   # (build description, quote dirs, dirs): the search path of every TU, merged once
+
+def get_build_include_graph(paths: list = None) -> IncludeGraph:
+    """
+    The project's include graph, resolved with the -I/-iquote paths of every TU of the build.
+    paths: files the agent just rewrote, rescanned before answering.
+    """
+    global _include_dirs
+    desc = get_build_description()
+    if _include_dirs is None or _include_dirs[0] is not desc:
+        quote_dirs, dirs = [], []
+        for unit in desc.units:
+            unit_quote, unit_dirs = include_dirs_of(unit.flags, unit.directory)
+            quote_dirs += [d for d in unit_quote if d not in quote_dirs]
+            dirs += [d for d in unit_dirs if d not in dirs]
+        _include_dirs = (desc, quote_dirs, dirs)
+    _, quote_dirs, dirs = _include_dirs
+    return get_include_graph(str(TESTCODE_DIR), quote_dirs, dirs, paths)
+
+
+def _declaration_pieces(abs_path: str, line_numbers: list[int], issue_text: str) -> list[ContextPiece]:
+    """
+    The declarations, in headers this file really includes (directly or not), of the names
+    used on the error lines and quoted in the diagnostic.
+    """
+    try:
+        source = get_source(abs_path)
+        graph = get_build_include_graph()
+        index = get_symbol_index(str(TESTCODE_DIR))
+    except OSError:
+        return []
+    text = issue_text + "".join(source.lines(max(0, n - 1), n) for n in line_numbers)
+    hits = []
+    for name in dict.fromkeys(tokenize(text)):
+        hits += graph.declaring_headers(name, abs_path, index)[:1]  # The nearest header is enough
+        if len(hits) >= MAX_DECLARATIONS:
+            break
+    return declaration_pieces(hits, TESTCODE_DIR)
+
+
+def gather_context(target_issue: str) -> list[ContextPiece]:
+    """
+    Collects the candidate context pieces (local code + RAG result) for one compiler issue.
+    They are packed into the prompt budget later, by _make_work_item.
+    Safe to call from a background thread (the streaming build prefetches with it).
+    """
+    # --- 1. GATHERING LOCAL CONTEXT ---
+    # We pass the target_issue (which contains the filename and line number) to our scraper.
+    # It returns the lines around the error, the top of the file, the enclosing function
+    # and the header declarations of the names involved (through the include graph).
+    location = parse_location(target_issue)
+    pieces = _local_pieces(location[0], [location[1]], target_issue) if location else []
+
+    # --- 2. GATHERING RAG CONTEXT (PERIPHERAL VISION) ---
+    rag_piece = gather_rag_context(target_issue)
+    if rag_piece:
+        pieces.append(rag_piece)
+    return pieces
+
+
+def _select_batch(state: AgentState, target_issue: str) -> list:
+    """
+    Grows a group of diagnostics around the target issue: same file, same severity,
+    each one within BATCH_LINE_WINDOW lines of another member of the group.
+    Stops when the combined context would exceed BATCH_TOKEN_BUDGET.
+    """
+    target = _find_diagnostic(state, target_issue)
+    if target is None or target.line == 0:
+        return []
+
+    candidates = sorted(
+        (d for d in state.get("diagnostics", [])
+         if d.file == target.file and d.severity == target.severity and d.line > 0 and d is not target),
+        key=lambda d: abs(d.line - target.line)
+    )
+    group = [target]
+    for diag in candidates:
+        if len(group) >= BATCH_MAX_ISSUES:
+            break
+        if not any(abs(diag.line - member.line) <= BATCH_LINE_WINDOW for member in group):
+            continue
+        trial = group + [diag]
+        if _batch_tokens(trial) > BATCH_TOKEN_BUDGET:
+            break
+        group = trial
+    return sorted(group, key=lambda d: d.line)
+
+
+def _batch_context(group: list) -> list[ContextPiece]:
+    """Pieces covering every diagnostic of the group (+ RAG hits for missing symbols)."""
+    pieces = _local_pieces(group[0].file, [d.line for d in group], "\n".join(d.raw for d in group))
+    for diag in group:
+        rag_piece = gather_rag_context(diag.raw)
+        if rag_piece:
+            pieces.append(rag_piece)  # Repeated hits are dropped by the packer
+    return pieces
+
+
+def _batch_tokens(group: list) -> int:
+    issues = "\n".join(d.raw for d in group)
+    return estimate_tokens(issues) + estimate_tokens(get_multi_snippet(group[0].file, [d.line for d in group], str(Path.cwd())))
+
+
+# --- NODE 4: GATHER CONTEXT ---
+def _select_targets(state: AgentState) -> tuple[list[str], str]:
+    """
+    The issues get_context_node works on this round, in its priority order, and their kind
+    ("ERROR" / "WARNING"). Also used right after a build to prefetch exactly their context.
+    """
     # --- 2. READING COMPILER OUTPUT ---
     # Variables: errors, warnings
     # We extract the lists of strings that were generated by the GCC build node.
     # Example: errors = ["test.c:10: error: missing ';'"]
-    errors = state.get("error_lines", [])
-    warnings = state.get("warning_lines", [])
+    # Issues the agent already failed on QUARANTINE_AFTER times are left alone.
+    quarantined = quarantined_issues(state.get("diagnostics", []), state.get("progress"))
+    errors = [e for e in state.get("error_lines", []) if e not in quarantined]
+    warnings = [w for w in state.get("warning_lines", []) if w not in quarantined]
 
     # --- 3. TARGET SELECTION (THE PRIORITY QUEUE) ---
-    # The agent can only fix one thing at a time. We must pick a 'target_issue'.
+    # We must pick a 'target_issue': the one the agent fixes first.
     if errors:
         # Errors are fatal. If the 'errors' list is not empty, grab the very first one.
         target_issue = errors[0]
@@ -92,120 +505,436 @@ def get_context_node(state: AgentState) -> Dict[str, Any]:
         target_issue = warnings[0]
         issue_type = "WARNING"
     else:
+        return [], ""
+
+    # --- 4. BUILDING THE WORK ITEMS ---
+    # Variable: targets
+    # One work item = one LLM request (a single issue, or a batch of nearby issues in one file).
+    # With FIX_CONCURRENCY > 1 we also pick the first issue of OTHER files: those are independent,
+    # so the generate node can ask the model about all of them at the same time.
+    targets = [target_issue]
+    if FIX_CONCURRENCY > 1:
+        first = _find_diagnostic(state, target_issue)
+        taken_files = {first.file if first else ""}
+        for issue in (errors or warnings):
+            if len(targets) >= FIX_CONCURRENCY:
+                break
+            diag = _find_diagnostic(state, issue)
+            if diag is None or diag.line == 0 or diag.file in taken_files:
+                continue
+            taken_files.add(diag.file)
+            targets.append(issue)
+    return targets, issue_type
+
+
+def get_context_node(state: AgentState) -> Dict[str, Any]:
+    """
+    This node acts as the 'Information Gatherer' for the AI.
+    It decides WHAT to fix (prioritizing errors over warnings) and 
+    gathers the necessary code snippets (Local + RAG) so the AI can see the problem.
+    """
+    
+    # --- 1. TRACKING RETRIES ---
+    # Variable: current_retries
+    # We read the current loop count from the state. If it's the first run, it defaults to 0.
+    # This prevents the agent from looping infinitely if it gets stuck.
+    current_retries = state.get("retry_count", 0)
+
+    # --- 2-4. WHAT TO FIX (see _select_targets) ---
+    targets, issue_type = _select_targets(state)
+    if not targets:
         # Failsafe: If both lists are empty, there is nothing to fix. 
         # We return an empty update and keep the retry count exactly the same.
-        return {"code_context": "", "current_issue": "", "retry_count": current_retries}
+        return {"code_context": "", "current_issue": "", "work_items": [], "retry_count": current_retries}
 
-    # Print to the console so we know exactly what the agent is looking at
-    print(f"🕵️  Reasoning about {issue_type}: {target_issue}")
-    
-    # --- 4. GATHERING LOCAL CONTEXT ---
-    # Variable: local_context
-    # We pass the target_issue (which contains the filename and line number) to our scraper.
-    # It returns the exact line of code + 5 lines above and below it.
-    local_context = get_code_snippet(target_issue, str(Path.cwd()))
+    # --- 5. GATHERING CONTEXT (LOCAL + RAG) ---
+    # Every work item gathers its own snippet; this runs on the background pool.
+    items = list(_context_pool.map(lambda issue: _make_work_item(state, issue), targets))
+    for item in items:
+        if len(item["issues"]) > 1:
+            print(f"🕵️  Reasoning about a batch of {len(item['issues'])} {issue_type}S in {Path(item['file']).name}")
+        else:
+            # Print to the console so we know exactly what the agent is looking at
+            print(f"🕵️  Reasoning about {issue_type}: {item['issue']}")
     
-    # --- 5. GATHERING RAG CONTEXT (PERIPHERAL VISION) ---
-    # Variable: rag_context
-    # We start with an empty string. We only use RAG if the error implies a missing file or function.
-    rag_context = ""
-    
-    # Check if the GCC error text contains specific keywords related to missing definitions
-    if "implicit declaration" in target_issue or "undefined reference" in target_issue:
-        
-        # Example target_issue: "implicit declaration of function 'add_numbers'"
-        # We split the string by the single quote (') and grab the second item (index 1),
-        # which isolates the function name: "add_numbers".
-        query = target_issue.split("'")[1] if "'" in target_issue else ""
-        
-        if query:
-            # We import the search tool here to query the Vector Database
-            from agent.rag import search_codebase
-            
-            # Search the database for the isolated function name (e.g., "add_numbers")
-            # We only ask for the top 1 most relevant result to save token space.
-            results = search_codebase(query, n_results=1)
-            
-            if results:
-                # If we found the function in another file, format it nicely into the rag_context string.
-                rag_context = f"\n\n--- RAG SEARCH RESULT ---\n{results[0]['code']}\n"
-
-    # --- 6. COMBINING CONTEXTS ---
-    # Variable: full_context
-    # We merge the local code snippet and the RAG search result (if any).
-    # If no RAG search was triggered, it just adds an empty string.
-    # CRITICAL: This line is flush with the main function block, outside the RAG 'if' statement.
-    full_context = local_context + rag_context
-    
-    # --- 7. UPDATING THE STATE ---
+    # --- 6. UPDATING THE STATE ---
     # We return a dictionary. LangGraph will take these keys and overwrite 
     # the corresponding keys in the global AgentState.
     return {
-        "code_context": full_context,         # The combined code text for the LLM prompt
-        "current_issue": target_issue,        # The specific error/warning we are fixing
+        "code_context": items[0]["context"],  # The combined code text for the LLM prompt
+        "current_issue": items[0]["issue"],   # The specific error/warning we are fixing
+        "current_issues": [issue for item in items for issue in item["issues"]],  # Every issue in flight
+        "work_items": items,                  # One entry per LLM request
         "retry_count": current_retries + 1    # Increment the loop counter by 1
     }
+
+
+def _make_work_item(state: AgentState, target_issue: str) -> dict:
+    """Builds one LLM request: the issue text (or batch of issues) plus its code context."""
+    # BATCHING (OPTIONAL): pull in the neighbours of the target so one LLM call can fix all of them.
+    if BATCH_MODE:
+        group = _select_batch(state, target_issue)
+        if len(group) > 1:
+            unused = _prefetched_context.pop(target_issue, None)   # Batches gather their own context
+            if unused is not None:
+                unused.cancel()
+            raws = [d.raw for d in group]
+            item = {"issue": "\n".join(raws), "issues": raws, "file": group[0].file}
+            # The group was sized for BATCH_TOKEN_BUDGET: a single issue's budget would starve its last members
+            return _pack_item(state, item, _batch_context(group), max(BATCH_TOKEN_BUDGET, CONTEXT_TOKEN_BUDGET))
+
+    # If the router already started on this exact issue (see prefetch_targets), we just collect the result.
+    diag = _find_diagnostic(state, target_issue)
+    prefetched = _prefetched_context.pop(target_issue, None)
+    pieces = prefetched.result() if prefetched else gather_context(target_issue)
+    item = {"issue": target_issue, "issues": [target_issue], "file": diag.file if diag else ""}
+    return _pack_item(state, item, pieces)
+
+
+def _pack_item(state: AgentState, item: dict, pieces: list[ContextPiece], budget: int = CONTEXT_TOKEN_BUDGET) -> dict:
+    """Adds the failed attempts at these issues, then packs everything into `budget` tokens."""
+    pieces = pieces + _failed_attempts(state, item["issues"])
+    context, report = pack_context(pieces, budget)
+    print(f"   {format_report(report, budget)}")
+    return {**item, "context": context, "context_report": report}
+
+
+def _failed_attempts(state: AgentState, issues: list[str]) -> list[ContextPiece]:
+    """Fixes of the previous round whose issue survived the verify build."""
+    if not state.get("proposed_fixes"):
+        return []
+    still_there = set(state.get("error_lines", [])) | set(state.get("warning_lines", []))
+    return [attempt_piece(item["fixes"], item.get("rejected")) for item in state.get("work_items", [])
+            if item.get("fixes") and set(item["issues"]) & set(issues) & still_there]
+
+
 # --- NODE 5: GENERATE FIX (UPDATED!) ---
 def generate_fix_node(state: AgentState) -> Dict[str, Any]:
-    # LINE 1: Retrieve the exact issue (Error or Warning) we selected in the previous node.
-    issue_msg = state.get("current_issue", "")
-    
-    # LINE 2: Retrieve the code blocks (Local + RAG) we gathered.
-    context = state.get("code_context", "")
-    
+    # LINE 0: Fast path. Every diagnostic a rule can fix is fixed this round, without the model;
+    # whatever is left (the hard cases) goes to the model on the next round, with fresh line numbers.
+    if RULE_FIXES:
+        rule_items = _rule_work_items(state)
+        if rule_items:
+            fixes = [fix for item in rule_items for fix in item["fixes"]]
+            print(f"⚡ Rule-based fixers handled {len(rule_items)} diagnostic(s) without the LLM")
+            return {"proposed_fixes": fixes, "fix_source": "rules", "work_items": rule_items}
+
+    # LINE 1: Retrieve the work items (issue + gathered code) selected by the previous node.
+    # Older states only carry current_issue / code_context, so we rebuild a single item from those.
+    items = state.get("work_items") or [{
+        "issue": state.get("current_issue", ""),
+        "issues": [state.get("current_issue", "")],
+        "file": "",
+        "context": state.get("code_context", ""),
+    }]
+
+    # LINE 2: One item -> one blocking call. Several items (different files) -> fan out to the
+    # Ollama server, at most FIX_CONCURRENCY requests in flight, collected as they complete.
+    if len(items) == 1:
+        done = [_generate_for_item(state, items[0])]
+    else:
+        print(f"🤖 AI is generating fixes for {len(items)} files in parallel (max {FIX_CONCURRENCY} at once)...")
+        done = []
+        with ThreadPoolExecutor(max_workers=FIX_CONCURRENCY) as pool:
+            futures = [pool.submit(_generate_for_item, state, item) for item in items]
+            for future in as_completed(futures):
+                item = future.result()
+                print(f"   📬 {len(item['fixes'])} fix(es) ready for {Path(item['file']).name or 'issue'}")
+                done.append(item)
+
+    # LINE 3: Merge everything into one list for apply_fix_node.
+    fixes = [fix for item in done for fix in item["fixes"]]
+    fix_source = done[0]["source"] if len(done) == 1 else "parallel"
+    return {"proposed_fixes": fixes, "fix_source": fix_source, "work_items": done}
+
+
+def _rule_work_items(state: AgentState) -> list[dict]:
+    """
+    One work item per piece of code a deterministic rule edits. Rule fixes sharing an anchor
+    (two missing headers, two unused parameters of one function) become one merged fix.
+    """
+    by_anchor = {}   # (file, original_code) -> work item
+    root = str(Path.cwd())
+    # A diagnostic that survived last round's rule fix goes to the model instead of looping.
+    # Matched by diag_key: a shifted line or a rolled-back fix changes the raw line, not the key.
+    tried = {key for item in state.get("work_items", []) if item.get("source") == "rules"
+             for key in item.get("keys", [])}
+    quarantined = quarantined_issues(state.get("diagnostics", []), state.get("progress"))
+    for diag in state.get("diagnostics", []):
+        if diag.severity not in ("error", "warning") or diag.raw in quarantined or diag_key(diag) in tried:
+            continue
+        for fix in rule_fixes(diag, root) or []:
+            key = (fix["file"], fix["original_code"])
+            item = by_anchor.get(key)
+            if item is None:
+                by_anchor[key] = {"issue": diag.raw, "issues": [diag.raw], "keys": [diag_key(diag)],
+                                  "file": diag.file, "fixes": [fix], "source": "rules"}
+                continue
+            merged = merge_fixes(item["fixes"][0], fix)
+            if merged is None:
+                continue  # Conflicting edit of the same code: not 'tried', the next round gets it
+            item["fixes"] = [merged]
+            if diag.raw not in item["issues"]:
+                item["issues"].append(diag.raw)
+                item["keys"].append(diag_key(diag))
+    return list(by_anchor.values())
+
+
+def _generate_for_item(state: AgentState, item: dict) -> dict:
+    """Produces the fixes of one work item (fix memory first, then the model). Thread-safe."""
+    issue_msg = item["issue"]
+    context = item["context"]
+
+    # --- FIX MEMORY: replay a verified fix for this kind of diagnostic instead of asking the model ---
+    target = _find_diagnostic(state, issue_msg) if len(item["issues"]) == 1 else None
+    if target is not None:
+        signature, identifiers = normalize_signature(target.severity, target.message, target.option)
+        fixes = get_memory().replay(signature, identifiers)
+        if fixes and _anchors_present(target.file, fixes, [target.line], exact=True):
+            print("🧠 Known issue: replaying a verified fix from memory (no LLM call)")
+            for fix in fixes:
+                fix["file"] = target.file
+                fix["lines"] = [target.line]
+            return {**item, "fixes": fixes, "source": "memory"}
+
+    inputs = {
+        "error_msg": issue_msg, 
+        "code_context": context
+    }
+
+    if SPECULATIVE_CANDIDATES > 1:
+        print(f"🤖 AI is generating {SPECULATIVE_CANDIDATES} candidate fixes...")
+        chain_for = (lambda t: build_streaming_fix_chain(t, _anchor_check(item))) if STREAM_LLM else build_fix_chain
+        candidates = generate_candidates(chain_for, inputs, SPECULATIVE_CANDIDATES, FIX_CONCURRENCY)
+        for fixes in candidates:
+            _retarget_fixes(fixes, item)
+        baseline = [d for d in state.get("diagnostics", []) if d.severity in ("error", "warning")]
+        print(f"🧪 Verifying {len(candidates)} distinct candidate(s) in parallel sandboxes...")
+        fixes = pick_candidate(candidates, get_build_description(), baseline, BUILD_JOBS) or []
+        return {**item, "fixes": fixes, "source": "speculative"}
+
     print("🤖 AI is generating a fix...")
     try:
-        # LINE 3 to 7: Trigger the LangChain LLM pipeline. 
+        # Trigger the LangChain LLM pipeline. 
         # We inject 'issue_msg' into the "error_msg" variable inside the prompt template.
-        result = fix_chain.invoke({
-            "error_msg": issue_msg, 
-            "code_context": context,
-            "format_instructions": parser.get_format_instructions()
-        })
+        # Streaming: same result, but bad answers are aborted early.
+        chain = build_streaming_fix_chain(0.0, _anchor_check(item)) if STREAM_LLM else fix_chain
+        result = chain.invoke(inputs)
         
-        # LINE 8 & 9: Extract the JSON list and update the state.
+        # Extract the JSON list.
         fixes = result.get("fixes", [])
-        return {"proposed_fixes": fixes}
     except Exception as e:
         print(f"💥 AI Generation Failed: {e}")
-        return {"proposed_fixes": []}
+        fixes = []
+
+    _retarget_fixes(fixes, item)
+    return {**item, "fixes": fixes, "source": "llm"}
+
+
+def _issue_lines(item: dict) -> list[int]:
+    """Line numbers of the item's diagnostics: the patcher picks the anchor closest to them."""
+    return [loc[1] for loc in map(parse_location, item.get("issues", [])) if loc]
+
+
+def _fix_target(fix: dict, item: dict) -> str:
+    """
+    The file a fix edits: the item's own file when the model names no other one, else the
+    named path, or the header of that name the item's file includes (the prompt shows
+    HEADER pieces by bare name). '' when the named file cannot be found.
+    """
+    named = fix.get("file") or ""
+    if not named or Path(named).name == Path(item["file"]).name:
+        return item["file"]
+    for candidate in (Path(named), TESTCODE_DIR / named):
+        if candidate.is_file():
+            return str(candidate.resolve())
+    try:
+        graph = get_build_include_graph()
+    except OSError:
+        return ""
+    for rel in graph.headers_of(item["file"]):
+        if Path(rel).name == Path(named).name:
+            return str(graph.abs_path(rel))
+    return ""
+
+
+def _retarget_fixes(fixes: list[dict], item: dict):
+    """The model only sees bare file names; point its fixes at the real files (the item's, or a header)."""
+    if item.get("file"):
+        lines = _issue_lines(item)
+        for fix in fixes:
+            target = _fix_target(fix, item)
+            if target == item["file"]:
+                fix["file"] = target
+                fix["lines"] = lines
+            elif target:
+                fix["file"] = target
+
+
+def _anchor_check(item: dict):
+    """Streaming callback: keeps a fix only if the patcher can place its original_code in the file it names."""
+    if not item.get("file"):
+        return None
+    lines = _issue_lines(item)
+
+    def on_fix(fix: dict) -> bool:
+        target = _fix_target(fix, item)
+        if not target:
+            print(f"   ⚠️ Streamed fix dropped: {fix.get('file')} is not a file of the project")
+            return False
+        if _anchors_present(target, [fix], lines if target == item["file"] else ()):
+            return True
+        print(f"   ⚠️ Streamed fix dropped: its original_code is not in {Path(target).name}")
+        return False
+    return on_fix
+
+
+def _anchors_present(file_path: str, fixes: list[dict], lines: list[int] = (), exact: bool = False) -> bool:
+    """
+    A fix is only usable if every 'original_code' can be located (exactly or fuzzily) in the
+    current file. exact: verbatim only (memory replays were verified on exactly that code).
+    """
+    try:
+        content = get_source(str(Path(file_path).resolve())).text()
+    except OSError:
+        return False
+    if exact:
+        return all(fix.get("original_code", "").strip() and fix["original_code"] in content for fix in fixes)
+    return all(locate(content, fix.get("original_code", ""), lines) for fix in fixes)
 
 # --- NODE 6: APPLY FIX ---
 def apply_fix_node(state: AgentState) -> Dict[str, Any]:
     fixes = state.get("proposed_fixes", [])
     if not fixes:
         print("🤷 No fixes to apply.")
-        return {}
+        return {"preverify_rejected": False}
 
-    for fix in fixes:
-        # LangChain's parser returns a dict
-        file_path = fix['file']
-        original = fix['original_code']
-        replacement = fix['replacement_code']
-        
-        abs_path = Path(file_path).resolve()
-        
-        try:
-            with open(abs_path, "r", encoding="utf-8") as f:
-                content = f.read()
-            
-            # Normalize line endings just in case
-            content_norm = content.replace("\r\n", "\n")
-            original_norm = original.replace("\r\n", "\n")
-            
-            if original_norm in content_norm:
-                new_content = content_norm.replace(original_norm, replacement)
-                with open(abs_path, "w", encoding="utf-8") as f:
-                    f.write(new_content)
-                print(f"✅ Applied fix to {abs_path.name}")
-            else:
-                print(f"⚠️ Fix Failed: Could not find original code block in {abs_path.name}")
-                # Debug print to help you see what failed
-                # print(f"Looking for:\n{original_norm!r}")
-                
-        except Exception as e:
-            print(f"❌ File Error: {e}")
-            
+    # Group fixes per file: each file is patched in memory, checked, then written once.
+    patches = plan_fix_batch(fixes)
+    rejected = {}
+    if PREVERIFY and patches:
+        patches, rejected = _preverify(state, patches)
+    write_patches(patches)
+    written = [p.path for p in patches]
+    if patches and any(not _is_source(p.path) for p in patches) and PREVERIFY:
+        patches, header_rejected = _preverify_on_disk(state, patches)
+        rejected.update(header_rejected)
+    _refresh_indexes(written)
+
+    # Remember what we touched (the RAG index refreshes exactly these files at the end,
+    # and the verify pass can roll back one file's patch if it made things worse)
+    _applied_patches.clear()
+    _applied_patches.update((str(p.path), p) for p in patches)
+    patched = set(state.get("patched_files", []))
+    patched.update(str(p.path) for p in patches)
+    result = {"patched_files": sorted(patched), "preverify_rejected": bool(rejected) and not patches}
+    if rejected:
+        result["work_items"] = [_mark_rejected(item, rejected) for item in state.get("work_items", [])]
+    if result["preverify_rejected"] and state.get("progress"):
+        # No verify build this round: the rejected attempts are counted here
+        issues = {issue for item in result["work_items"] if item.get("rejected") for issue in item["issues"]}
+        failed = [diag_key(d) for d in state.get("diagnostics", []) if d.raw in issues]
+        result["progress"] = count_failures(state["progress"], failed)
+    return result
+
+
+def _refresh_indexes(paths: list):
+    """The agent rewrote these files (patch or rollback): rescan just them, never the whole tree."""
+    if paths:
+        get_symbol_index(str(TESTCODE_DIR), paths=[str(p) for p in paths])
+        get_build_include_graph(paths=[str(p) for p in paths])
+
+
+def _is_source(path: Path) -> bool:
+    return path.suffix.lower() in (".c", ".cc", ".cpp", ".cxx")
+
+
+def _units_for(paths: list[Path]) -> list[TranslationUnit]:
+    """The TUs that compile one of these files (for a header: every source that includes it)."""
+    graph = get_build_include_graph()
+    wanted = {(graph.root / rel).resolve() for p in paths for rel in graph.dependents(p)}
+    wanted.update(Path(p).resolve() for p in paths if _is_source(Path(p)))
+    return [unit for unit in get_build_description().units if Path(unit.source).resolve() in wanted]
+
+
+def _preverify(state: AgentState, patches: list[FilePatch]) -> tuple[list[FilePatch], dict]:
+    """
+    In-memory checks, nothing is written: brackets of every patched file, then
+    'gcc -fsyntax-only' of every patched source over stdin. Sources are only checked this way
+    when no header is patched in the same round (they would be compiled against the old one).
+    Returns (patches that passed, {path: reasons} of the rejected ones).
+    """
+    baseline = state.get("diagnostics", [])
+    passed, rejected = [], {}
+    for patch in patches:
+        before, after = unbalanced(patch.original), unbalanced(patch.patched)
+        if after > before:
+            print(f"🚫 Pre-verify: patch for {patch.path.name} unbalances brackets ({before} -> {after} problems)")
+            rejected[str(patch.path)] = ["the replacement leaves unbalanced brackets / quotes / comments"]
+        else:
+            passed.append(patch)
+
+    if any(not _is_source(p.path) for p in passed):
+        return passed, rejected
+
+    checked = []
+    for patch in passed:
+        errors = []
+        for unit in _units_for([patch.path]):
+            if Path(unit.source).resolve() == patch.path:
+                errors += introduced_errors(syntax_check(unit, patch.patched), baseline, [patch])
+        if errors:
+            print(f"🚫 Pre-verify: patch for {patch.path.name} does not compile: {errors[0].to_line()}")
+            rejected[str(patch.path)] = [d.to_line() for d in errors]
+        else:
+            checked.append(patch)
+    if checked:
+        print(f"   ⚡ Pre-verify: {len(checked)} patched file(s) pass the syntax check")
+    return checked, rejected
+
+
+def _preverify_on_disk(state: AgentState, patches: list[FilePatch]) -> tuple[list[FilePatch], dict]:
+    """
+    A header was patched: syntax-check every TU that reads one of the patched files, from disk.
+    If the patches introduced errors, every patch of the round is rolled back.
+    """
+    units = _units_for([p.path for p in patches])
+    errors = []
+    for unit in units:
+        errors += introduced_errors(syntax_check(unit), state.get("diagnostics", []), patches)
+    if not errors:
+        print(f"   ⚡ Pre-verify: {len(units)} dependent TU(s) pass the syntax check")
+        return patches, {}
+    print(f"🚫 Pre-verify: the patched header breaks the build ({errors[0].to_line()}), rolling back")
+    for patch in patches:
+        restore_patch(patch)
+    reasons = [d.to_line() for d in errors]
+    return [], {str(p.path): reasons for p in patches}
+
+
+def _mark_rejected(item: dict, rejected: dict) -> dict:
+    """Records on the work item why pre-verify threw its fixes away (shown to the model next round)."""
+    reasons = []
+    for fix in item.get("fixes", []):
+        reasons += rejected.get(str(Path(fix.get("file", "")).resolve()), [])
+    return {**item, "rejected": list(dict.fromkeys(reasons))} if reasons else item
+
+
+# --- NODE 8: REFRESH RAG INDEX ---
+def reindex_node(state: AgentState) -> Dict[str, Any]:
+    """
+    After a successful verify, re-embeds only the chunks the agent changed,
+    so the next RAG lookup doesn't serve stale code.
+    """
+    patched = state.get("patched_files", [])
+    if not patched:
+        return {}
+    print(f"🗄️ Refreshing RAG index for {len(patched)} patched file(s)...")
+    try:
+        from agent.rag import update_vector_db
+        update_vector_db(str(TESTCODE_DIR), paths=patched)
+    except Exception as e:
+        print(f"⚠️ RAG re-index skipped: {e}")
     return {}
 
 
@@ -214,5 +943,6 @@ def revert_node(state: AgentState) -> Dict[str, Any]:
     branch = state["branch_name"]
     print(f"🔙 Reverting branch {branch}...")
     subprocess.run(["git", "checkout", "main"], capture_output=True)
+    invalidate_source()  # The checkout rewrote the sources behind the cache's back
     subprocess.run(["git", "branch", "-D", branch], capture_output=True)
     return {"workspace_clean": True}
\ No newline at end of file
@@ -0,0 +1,70 @@
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- CONFIGURATION ---
+# Point it elsewhere with AGENT_OLLAMA_URL (the offline benchmark uses a local fake server, see bench/)
+OLLAMA_BASE_URL = os.environ.get("AGENT_OLLAMA_URL", "http://localhost:11434").rstrip("/")
+# How long the server keeps a model loaded after our last request ("30m", "1h", -1 = forever).
+# Without it Ollama unloads after 5 minutes, and a slow build can make us pay a full reload.
+# A bare number (seconds, -1) must reach Ollama as a JSON number: the string "-1" is rejected.
+KEEP_ALIVE = os.environ.get("AGENT_OLLAMA_KEEP_ALIVE", "30m").strip()
+if KEEP_ALIVE.lstrip("-").isdigit():
+    KEEP_ALIVE = int(KEEP_ALIVE)
+
+# One keep-alive HTTP session for the chat requests of the process
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=16))
+
+
+def preload_model(model: str, embedding: bool = False) -> float:
+    """
+    Loads `model` into the server's memory (an empty request) and pins it for KEEP_ALIVE.
+    Returns the seconds it took, or -1 on failure.
+    """
+    endpoint = "/api/embed" if embedding else "/api/generate"
+    payload = {"model": model, "keep_alive": KEEP_ALIVE}
+    if embedding:
+        payload["input"] = ""
+    started = time.perf_counter()
+    try:
+        resp = session.post(OLLAMA_BASE_URL + endpoint, json=payload, timeout=600)
+        resp.raise_for_status()
+    except Exception as e:
+        print(f"⚠️ Could not preload {model}: {e}")
+        return -1.0
+    return time.perf_counter() - started
+
+
+def start_preload(models: list[str], embed_models: list[str] = ()) -> threading.Thread:
+    """Warms the models on a background thread, so loading overlaps with the first build."""
+    def run():
+        for model in models:
+            elapsed = preload_model(model)
+            if elapsed >= 0:
+                print(f"🔥 {model} loaded and pinned for {KEEP_ALIVE} ({elapsed:.1f}s)")
+        for model in embed_models:
+            preload_model(model, embedding=True)
+
+    thread = threading.Thread(target=run, name="ollama-preload", daemon=True)
+    thread.start()
+    return thread
+
+
+def format_timing(meta: dict, wall: float = None) -> str:
+    """
+    One console line from the durations Ollama returns (nanoseconds).
+    Time-to-first-token = model load + prompt prefill; a reused prefix shows up as
+    fewer prompt tokens evaluated.
+    """
+    if not meta or "total_duration" not in meta:
+        return f"⏱️ LLM call took {wall:.1f}s" if wall is not None else ""
+    load = meta.get("load_duration", 0) / 1e9
+    prefill = meta.get("prompt_eval_duration", 0) / 1e9
+    decode = meta.get("eval_duration", 0) / 1e9
+    return (f"⏱️ LLM: TTFT {load + prefill:.2f}s (load {load:.2f}s, prefill {meta.get('prompt_eval_count', 0)} tok "
+            f"in {prefill:.2f}s), {meta.get('eval_count', 0)} tok generated in {decode:.2f}s, "
+            f"total {meta['total_duration'] / 1e9:.2f}s")
@@ -0,0 +1,204 @@
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from agent.context import estimate_tokens, get_source, HEAD_LINES
+from agent.symbols import top_level_spans
+
+# --- CONFIGURATION ---
+# Lower number = packed first. Pieces that do not fit the budget are left out (and reported).
+PRIORITIES = {
+    "error_window": 0,
+    "file_head": 1,
+    "function": 2,
+    "rag": 3,
+    "header": 4,
+    "attempt": 5,
+}
+MAX_FUNCTION_LINES = 80   # A longer enclosing function is left to the error window
+MAX_HEADER_LINES = 120   # A longer declaration block (a huge enum...) is cut down to its own line
+
+SKIPPED = "\n... [SKIPPED CODE] ...\n\n"
+
+
+@dataclass(slots=True)
+class ContextPiece:
+    kind: str                 # One of PRIORITIES
+    text: str
+    file: str = ""            # Absolute path when the text is lines of a file (lets us de-duplicate lines)
+    start_line: int = 0       # 1-based line of the first line of text
+    label: str = ""           # Heading shown above the piece
+    required: bool = False    # Packed even over budget (the error window itself)
+    lines: list = field(default_factory=list)
+
+    def __post_init__(self):
+        if self.file:
+            self.lines = [(self.start_line + i, line if line.endswith("\n") else line + "\n")
+                          for i, line in enumerate(self.text.splitlines(keepends=True))]
+
+
+# --- Piece builders ---
+def _file_piece(kind: str, path: str, source, start: int, end: int, label: str = "", required: bool = False):
+    """Lines start..end (0-based, end excluded) of a cached source file, or None if empty."""
+    text = source.lines(start, end)
+    if not text:
+        return None
+    return ContextPiece(kind, text, file=path, start_line=start + 1, label=label, required=required)
+
+
+def source_pieces(path: str, line_numbers: list[int], radius: int = 5) -> list[ContextPiece]:
+    """
+    The local pieces of one file: its head (includes), one window per error line and the
+    top-level function/struct each error sits in.
+    """
+    try:
+        source = get_source(path)
+    except OSError as e:
+        return [ContextPiece("error_window", f"Error reading file: {e}", required=True)]
+    total = len(source)
+    pieces = []
+    for line_num in sorted(set(line_numbers)):
+        piece = _file_piece("error_window", path, source, max(0, line_num - radius), min(total, line_num + radius),
+                            required=True)
+        if piece:
+            pieces.append(piece)
+    head = _file_piece("file_head", path, source, 0, min(HEAD_LINES, total))
+    if head:
+        pieces.append(head)
+
+    spans = top_level_spans(source.text())
+    for line_num in sorted(set(line_numbers)):
+        for start, end, has_body in spans:
+            if start <= line_num <= end:
+                if has_body and end - start < MAX_FUNCTION_LINES:
+                    piece = _file_piece("function", path, source, start - 1, end)
+                    if piece and piece not in pieces:
+                        pieces.append(piece)
+                break
+    return pieces
+
+
+def declaration_pieces(hits: list[dict], root) -> list[ContextPiece]:
+    """
+    The header lines behind symbol index hits ({"name", "file", "line"}, file relative to root):
+    the whole top-level block (struct, enum, macro, prototype) each one sits in.
+    """
+    pieces = []
+    for hit in hits:
+        path = os.path.join(str(root), hit["file"])
+        try:
+            source = get_source(path)
+        except OSError:
+            continue
+        start, end = hit["line"], hit["line"]
+        for span_start, span_end, _ in top_level_spans(source.text()):
+            if span_start <= hit["line"] <= span_end:
+                if span_end - span_start < MAX_HEADER_LINES:
+                    start, end = span_start, span_end
+                break
+        piece = _file_piece("header", path, source, start - 1, end,
+                            label=f"HEADER {Path(hit['file']).name} (declares {hit['name']})")
+        if piece:
+            pieces.append(piece)
+    return pieces
+
+
+def attempt_piece(fixes: list[dict], rejected: list[str] = None) -> ContextPiece:
+    """A fix that was applied for this issue and did not make it go away (or did not even compile)."""
+    parts = []
+    for fix in fixes:
+        parts.append(f"replaced:\n{fix.get('original_code', '')}\nwith:\n{fix.get('replacement_code', '')}\n")
+    if rejected:
+        parts.append("it was rejected because:\n" + "\n".join(rejected) + "\n")
+        return ContextPiece("attempt", "".join(parts), label="PREVIOUS ATTEMPT (broke the code, try something else)")
+    return ContextPiece("attempt", "".join(parts), label="PREVIOUS ATTEMPT (did NOT fix the issue, try something else)")
+
+
+# --- Packing ---
+def pack_context(pieces: list[ContextPiece], budget: int) -> tuple[str, list[dict]]:
+    """
+    Fills a token budget with the highest-priority pieces first. Lines already packed by
+    another piece of the same file are not repeated. Returns (prompt text, report) where the
+    report has one {"kind", "label", "tokens", "status"} per piece; status is included,
+    duplicate or over_budget.
+    """
+    ordered = sorted(pieces, key=lambda p: PRIORITIES.get(p.kind, len(PRIORITIES)))
+    covered = {}        # file -> line numbers already packed
+    seen_text = set()
+    chosen = []
+    report = []
+    used = 0
+
+    for piece in ordered:
+        if piece.file:
+            lines = covered.setdefault(piece.file, set())
+            new = [(n, line) for n, line in piece.lines if n not in lines]
+            cost = estimate_tokens("".join(line for _, line in new))
+        else:
+            new = None
+            cost = estimate_tokens(piece.label + piece.text)
+        entry = {"kind": piece.kind, "label": piece.label or Path(piece.file).name, "tokens": cost}
+        report.append(entry)
+
+        if (new is not None and not new) or (new is None and piece.text in seen_text):
+            entry["status"] = "duplicate"
+            continue
+        if used + cost > budget and not piece.required:
+            entry["status"] = "over_budget"
+            continue
+        entry["status"] = "included"
+        used += cost
+        if new is None:
+            seen_text.add(piece.text)
+        else:
+            lines.update(n for n, _ in new)
+        chosen.append(piece)
+
+    return _render(chosen, covered), report
+
+
+def _render(chosen: list[ContextPiece], covered: dict) -> str:
+    """Every file once, its packed lines in order (gaps marked), then the free-text pieces."""
+    parts = []
+    files = {}
+    for piece in chosen:
+        if piece.file:
+            files.setdefault(piece.file, []).append(piece)
+        elif piece.label:
+            parts.append(("text", f"\n\n--- {piece.label} ---\n{piece.text}\n"))
+        else:
+            parts.append(("text", piece.text))
+
+    rendered = []
+    for path, file_pieces in files.items():
+        lines = {}
+        for piece in file_pieces:
+            lines.update((n, line) for n, line in piece.lines if n in covered[path])
+        local = any(p.kind in ("error_window", "file_head") for p in file_pieces)
+        if any(p.kind == "file_head" for p in file_pieces):
+            out = ["--- [FILE START] ---\n"]
+        else:
+            label = next((p.label for p in file_pieces if p.label), f"FILE {Path(path).name}")
+            out = [f"\n\n--- {label} ---\n"]
+        previous = None
+        for n in sorted(lines):
+            if previous is not None and n > previous + 1:
+                out.append(SKIPPED)
+            out.append(lines[n])
+            previous = n
+        rendered.append((0 if local else 1, "".join(out)))
+
+    # The file with the error comes first, then the other files, then the free text
+    rendered.sort(key=lambda item: item[0])
+    return "".join(text for _, text in rendered) + "".join(text for _, text in parts)
+
+
+def format_report(report: list[dict], budget: int) -> str:
+    """One console line: what made it into the prompt and what was left out."""
+    used = sum(e["tokens"] for e in report if e["status"] == "included")
+    included = [e["kind"] for e in report if e["status"] == "included"]
+    dropped = [e["kind"] for e in report if e["status"] == "over_budget"]
+    line = f"📦 Context: ~{used}/{budget} tokens ({', '.join(dict.fromkeys(included))})"
+    if dropped:
+        line += f", left out: {', '.join(dropped)}"
+    return line
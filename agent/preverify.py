@@ -0,0 +1,104 @@
+import subprocess
+from pathlib import Path
+
+from agent.build import TranslationUnit
+from agent.tracing import get_tracer
+from parsers.gcc import parse_log
+
+# --- CONFIGURATION ---
+SYNTAX_TIMEOUT = 60   # Seconds for one 'gcc -fsyntax-only'
+REGION_SLACK = 2      # A new error this many lines around a patched region is blamed on the patch
+# Languages GCC is told on stdin ('-x'); other sources (assembly) are not pre-verified
+STDIN_LANGUAGE = {".c": "c", ".cc": "c++", ".cpp": "c++", ".cxx": "c++"}
+_PAIRS = {")": "(", "]": "[", "}": "{"}
+
+
+def unbalanced(text: str) -> int:
+    """
+    Counts bracket problems in C source: closers without an opener, openers never closed,
+    mismatched pairs, plus an unterminated comment / string / char literal.
+    Comments and literals are skipped, so a '}' inside "..." does not count.
+    """
+    problems = 0
+    stack = []
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        if ch == "/" and text.startswith("//", i):
+            end = text.find("\n", i)
+            i = n if end < 0 else end
+            continue
+        if ch == "/" and text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            if end < 0:
+                return problems + len(stack) + 1
+            i = end + 2
+            continue
+        if ch in "\"'":
+            j = i + 1
+            while j < n and text[j] != ch and text[j] != "\n":
+                j += 2 if text[j] == "\\" else 1
+            if j >= n or text[j] != ch:
+                problems += 1
+            i = j + 1
+            continue
+        if ch in "([{":
+            stack.append(ch)
+        elif ch in ")]}":
+            if not stack:
+                problems += 1
+            elif stack[-1] != _PAIRS[ch]:
+                problems += 1
+                stack.pop()
+            else:
+                stack.pop()
+        i += 1
+    return problems + len(stack)
+
+
+def syntax_check(unit: TranslationUnit, text: str = None) -> list:
+    """
+    'gcc -fsyntax-only' on one TU: no code generation, no object, no link.
+    With `text`, the patched source is fed over stdin (the file on disk is not touched) and
+    '<stdin>' is mapped back to the source path. Returns the parsed Diagnostics.
+    """
+    cmd = [unit.compiler, *unit.flags, "-fsyntax-only"]
+    if text is None:
+        cmd.append(str(unit.source))
+    else:
+        language = STDIN_LANGUAGE.get(Path(unit.source).suffix.lower())
+        if language is None:
+            return []
+        # Quoted #includes are searched next to the input file; for stdin that must be said explicitly
+        cmd += ["-iquote", str(Path(unit.source).parent), "-x", language, "-"]
+    try:
+        with get_tracer().span("gcc -fsyntax-only", "build", stdin=text is not None):
+            res = subprocess.run(cmd, cwd=unit.directory, input=text, capture_output=True, text=True,
+                                 errors="replace", timeout=SYNTAX_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        print(f"⚠️ Pre-verify skipped for {Path(unit.source).name}: {e}")
+        return []
+    output = res.stdout + res.stderr
+    if text is not None:
+        output = output.replace("<stdin>", str(unit.source))
+    return list(parse_log(output))
+
+
+def introduced_errors(diagnostics: list, baseline: list, patches: list) -> list:
+    """
+    Errors of a syntax check that the patches caused: errors inside (or right around) a
+    patched region that the previous build did not already report.
+    """
+    known = {(Path(d.file).name, d.message) for d in baseline if d.severity == "error"}
+    regions = {}
+    for patch in patches:
+        regions.setdefault(patch.path.name, []).extend(patch.regions)
+
+    introduced = []
+    for diag in diagnostics:
+        if diag.severity != "error" or (Path(diag.file).name, diag.message) in known:
+            continue
+        if any(first - REGION_SLACK <= diag.line <= last + REGION_SLACK
+               for first, last in regions.get(Path(diag.file).name, [])):
+            introduced.append(diag)
+    return introduced
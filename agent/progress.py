@@ -0,0 +1,99 @@
+import os
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+
+# --- CONFIGURATION ---
+# A diagnostic the agent failed to fix this many times is set aside for the rest of the run
+QUARANTINE_AFTER = int(os.environ.get("AGENT_QUARANTINE_AFTER", "2"))
+# Stop when this many verify rounds in a row fixed nothing (and set nothing aside)
+MAX_STALLED_ROUNDS = int(os.environ.get("AGENT_MAX_STALLED", "2"))
+
+
+def diag_key(diag) -> str:
+    """
+    Identity of a diagnostic across builds. Line and column are left out, so a diagnostic
+    keeps its key when a patch above it shifts the code.
+    """
+    return f"{Path(diag.file).name}|{diag.function}|{diag.severity}|{diag.option}|{diag.message}"
+
+
+@dataclass
+class RoundDelta:
+    """What one verify build changed, compared to the build before it."""
+    fixed: list = field(default_factory=list)        # Diagnostics of the old build that are gone
+    introduced: list = field(default_factory=list)   # Diagnostics of the new build that are new
+    remaining: list = field(default_factory=list)    # Diagnostics of the new build seen before
+
+
+def diff_diagnostics(before: list, after: list) -> RoundDelta:
+    """Multiset difference on diag_key: two identical warnings in one function count twice."""
+    delta = RoundDelta()
+    old = Counter(diag_key(d) for d in before)
+    for diag in after:
+        key = diag_key(diag)
+        if old[key] > 0:
+            old[key] -= 1
+            delta.remaining.append(diag)
+        else:
+            delta.introduced.append(diag)
+    new = Counter(diag_key(d) for d in after)
+    for diag in before:
+        key = diag_key(diag)
+        if new[key] > 0:
+            new[key] -= 1
+        else:
+            delta.fixed.append(diag)
+    return delta
+
+
+def new_progress(diagnostics: list, complete: bool = True) -> dict:
+    """
+    Loop-control record kept in the graph state (plain dict/lists, like the rest of it).
+    The error baseline only comes from a complete build (complete=False: set by the next one).
+    """
+    return {
+        "baseline_errors": sum(1 for d in diagnostics if d.severity == "error") if complete else None,
+        "attempts": {},        # diag_key -> failed attempts
+        "quarantined": [],     # diag_keys the agent gave up on
+        "stalled_rounds": 0,
+        "rounds": [],          # {"fixed", "introduced", "rolled_back"} per verify build
+    }
+
+
+def count_failures(progress: dict, keys: list[str]) -> dict:
+    """Adds one failed attempt to each key and quarantines the ones over QUARANTINE_AFTER."""
+    attempts = dict(progress.get("attempts", {}))
+    quarantined = list(progress.get("quarantined", []))
+    for key in keys:
+        attempts[key] = attempts.get(key, 0) + 1
+        if attempts[key] >= QUARANTINE_AFTER and key not in quarantined:
+            quarantined.append(key)
+            print(f"🧊 Quarantined after {attempts[key]} failed attempts: {key.split('|')[-1]}")
+    return {**progress, "attempts": attempts, "quarantined": quarantined}
+
+
+def record_round(progress: dict, delta: RoundDelta, failed_keys: list[str], rolled_back: int) -> dict:
+    """Books one verify build: failed attempts, stalled-round counter and a per-round summary (rolled_back: fixes)."""
+    quarantined = len(progress.get("quarantined", []))
+    progress = count_failures(progress, failed_keys)
+    # Setting an issue aside is a way forward too: the next round works on another one
+    moved_on = len(progress["quarantined"]) > quarantined
+    stalled = 0 if delta.fixed or moved_on else progress.get("stalled_rounds", 0) + 1
+    rounds = progress.get("rounds", []) + [{"fixed": len(delta.fixed), "introduced": len(delta.introduced),
+                                            "rolled_back": rolled_back}]
+    print(f"   📈 Progress: {len(delta.fixed)} fixed, {len(delta.introduced)} new, "
+          f"{len(delta.remaining)} remaining, {rolled_back} fix(es) rolled back")
+    return {**progress, "stalled_rounds": stalled, "rounds": rounds}
+
+
+def open_issues(diagnostics: list, progress: dict) -> list:
+    """The diagnostics still worth a model call (not quarantined)."""
+    quarantined = set((progress or {}).get("quarantined", []))
+    return [d for d in diagnostics if d.severity in ("error", "warning") and diag_key(d) not in quarantined]
+
+
+def quarantined_issues(diagnostics: list, progress: dict) -> set:
+    """Raw issue lines of the quarantined diagnostics."""
+    quarantined = set((progress or {}).get("quarantined", []))
+    return {d.raw for d in diagnostics if diag_key(d) in quarantined} if quarantined else set()
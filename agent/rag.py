@@ -1,131 +1,417 @@
+import hashlib
+import json
 import os
-import chromadb
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from agent.context import get_source
+from agent.ollama_session import KEEP_ALIVE, OLLAMA_BASE_URL
+from agent.lexical import get_lexical_index, reciprocal_rank_fusion
+from agent.source_tree import FILE_EXTENSIONS, iter_source_files
+from agent.symbols import top_level_spans
+from agent.tracing import get_tracer
+from agent.vector_store import DB_PATH, get_store
+
 # --- CONFIGURATION ---
-# We store the database in a local folder named 'rag_db'
-DB_PATH = os.path.join(os.getcwd(), "rag_db")
-OLLAMA_URL = "http://localhost:11434/api/embeddings"
+# The vectors live in the backend picked by agent/vector_store.py (numpy or chroma).
+# Each backend keeps its own manifest: relative path -> {hash, stat, chunk ids},
+# which lets us re-embed only what changed.
+OLLAMA_URL = f"{OLLAMA_BASE_URL}/api/embeddings"
+OLLAMA_EMBED_URL = f"{OLLAMA_BASE_URL}/api/embed"  # Batch endpoint: "input" takes a list of texts
 EMBED_MODEL = "nomic-embed-text"
 
+# Files we care about, and the folders never worth indexing: agent/source_tree.py
+
+# Chunking: one chunk per top-level definition, runs of small declarations grouped together
+CHUNKER_VERSION = 2   # Bumped whenever chunk_file changes: every file is then re-chunked once
+MAX_CHUNK_LINES = 80  # Longer definitions are split; declaration groups stop growing here
+
+EMBED_BATCH = 64      # Chunks per /api/embed request
+WRITE_BATCH = 1024    # Chunks per vector store upsert
+READ_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+# Hybrid retrieval: BM25 over identifiers first, embeddings only when it is not conclusive
+HYBRID_SEARCH = os.environ.get("AGENT_RAG_HYBRID", "1") != "0"
+FUSION_DEPTH = 10     # Candidates taken from each side before reciprocal-rank fusion
+
+# One keep-alive HTTP session (connection pool) for every Ollama request of the process
+_session = requests.Session()
+_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
 def get_embedding(text: str) -> list[float]:
     """
     Calls Ollama to convert text into a vector (list of numbers).
     """
     payload = {
         "model": EMBED_MODEL,
-        "prompt": text
+        "prompt": text,
+        "keep_alive": KEEP_ALIVE
     }
     try:
-        resp = requests.post(OLLAMA_URL, json=payload, timeout=30)
-        resp.raise_for_status()
+        with get_tracer().span("ollama embed", "llm", texts=1):
+            resp = _session.post(OLLAMA_URL, json=payload, timeout=30)
+            resp.raise_for_status()
         return resp.json()["embedding"]
     except Exception as e:
         print(f"⚠️ Failed to get embedding from Ollama: {e}")
         return []
 
-def chunk_file(filepath: str, chunk_size: int = 50) -> list[str]:
+def get_embeddings(texts: list[str]) -> list[list[float]]:
     """
-    Reads a file and splits it into manageable blocks of lines.
-    This helps the AI understand specific functions rather than huge files.
+    Embeds many texts in ONE request through Ollama's batch endpoint.
+    Returns [] on failure (the caller decides whether to retry smaller).
+    """
+    if not texts:
+        return []
+    payload = {
+        "model": EMBED_MODEL,
+        "input": texts,
+        "keep_alive": KEEP_ALIVE
+    }
+    try:
+        with get_tracer().span("ollama embed", "llm", texts=len(texts)) as span:
+            resp = _session.post(OLLAMA_EMBED_URL, json=payload, timeout=300)
+            resp.raise_for_status()
+            data = resp.json()
+            span["prompt_tokens"] = data.get("prompt_eval_count", 0)
+        embeddings = data["embeddings"]
+        return embeddings if len(embeddings) == len(texts) else []
+    except Exception as e:
+        print(f"⚠️ Failed to get batch embeddings from Ollama: {e}")
+        return []
+
+def chunk_file(filepath: str, max_lines: int = MAX_CHUNK_LINES) -> list[dict]:
+    """
+    Reads a file and splits it along its top-level C definitions, so one chunk is one
+    function / struct (or a group of small declarations), never half of two functions.
+    Each chunk: {"code", "start_line", "end_line"}; the code starts with a one-line
+    '// File: name' preamble. Falls back to fixed windows when the braces do not balance.
     """
     try:
         with open(filepath, "r", encoding="utf-8", errors="ignore") as f:
-            lines = f.readlines()
+            text = f.read()
     except Exception:
         return []
-    
+    lines = text.splitlines(keepends=True)
+    preamble = f"// File: {Path(filepath).name}\n"
+
+    spans = top_level_spans(text)
+    if not spans:
+        spans = [(i + 1, min(i + max_lines, len(lines)), True) for i in range(0, len(lines), max_lines)]
+
+    # Definitions stand alone; consecutive declarations/directives share a chunk
+    groups = []
+    for start, end, has_body in spans:
+        if not has_body and groups and not groups[-1][2] and end - groups[-1][0] < max_lines:
+            groups[-1][1] = end
+        else:
+            groups.append([start, end, has_body])
+
     chunks = []
-    # Split into chunks of `chunk_size` lines
-    for i in range(0, len(lines), chunk_size):
-        chunk = "".join(lines[i:i + chunk_size])
-        if chunk.strip():
-            chunks.append(chunk)
+    for start, end, _ in groups:
+        # Size cap: an oversized definition becomes several consecutive windows
+        for window in range(start, end + 1, max_lines):
+            last = min(end, window + max_lines - 1)
+            code = "".join(lines[window - 1:last])
+            if code.strip():
+                chunks.append({"code": preamble + code, "start_line": window, "end_line": last})
     return chunks
 
+def _chunk_ids(rel_path: str, chunks: list[dict]) -> list[str]:
+    """
+    Stable, path-qualified ids: 'dir/file.c#<content hash>'.
+    Unchanged chunks keep their id even if code above them moved, so they are never re-embedded.
+    """
+    ids, seen = [], {}
+    for chunk in chunks:
+        digest = hashlib.sha1(chunk["code"].encode("utf-8", errors="ignore")).hexdigest()[:16]
+        n = seen.get(digest, 0)
+        seen[digest] = n + 1
+        ids.append(f"{rel_path}#{digest}" + (f"-{n}" if n else ""))
+    return ids
+
+
+def _load_manifest(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _save_manifest(path: str, manifest: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+
+
+def update_vector_db(root_dir: str, paths: list[str] = None):
+    """
+    Incrementally syncs the database with the source tree, using the manifest
+    (relative path -> content hash -> chunk ids):
+      - untouched files (same mtime/size, or same hash) cost one stat / one read
+      - changed files only embed the chunks whose content is new, and drop the stale ones
+      - files that vanished lose all their chunks
+    paths (optional): only look at these files (e.g. the ones the agent just patched).
+    Pipeline: files read + hashed + chunked on a worker pool -> batched embeddings over a
+    keep-alive session -> large batched vector store upserts.
+    """
+    root = Path(root_dir).resolve()
+    store = get_store()
+    lexical = get_lexical_index()
+    manifest = _load_manifest(store.manifest_path)
+    if not manifest and paths is not None:
+        # Indexing only the patched files would leave an index of just those files (and wipe
+        # an older one): that takes a full scan
+        print("⚠️ No RAG manifest yet, skipping the incremental update. Run 'python -m agent.rag' to build the index.")
+        return
+    if not manifest:
+        # No manifest = index from an older version (ids like 'file.c_chunk_0'): start clean
+        store.reset()
+        lexical.reset()
+
+    if paths is None:
+        print(f"🔍 Scanning {root_dir} for source files...")
+        files = list(iter_source_files(str(root)))
+        current = {f.relative_to(root).as_posix() for f in files}
+        vanished = set(manifest) - current
+        for rel in lexical.indexed_files() - current - vanished:
+            lexical.remove_file(rel)
+    else:
+        files, vanished = [], set()
+        for path in paths:
+            path = Path(path).resolve()
+            try:
+                rel = path.relative_to(root).as_posix()
+            except ValueError:
+                continue  # Not part of the indexed tree
+            if path.exists() and path.name.endswith(FILE_EXTENSIONS):
+                files.append(path)
+            elif rel in manifest:
+                vanished.add(rel)
+    print(f"   📄 Checking {len(files)} files")
+
+    def inspect(file_path: Path):
+        """
+        Returns (rel_path, entry, chunks, changed): chunks is None if neither index needs them,
+        changed says whether the embeddings are out of date (otherwise only the lexical index is).
+        """
+        rel = file_path.relative_to(root).as_posix()
+        old = manifest.get(rel, {})
+        st = file_path.stat()
+        stat_key = [st.st_mtime_ns, st.st_size]
+        # Entries chunked by an older chunk_file are re-chunked even if the content is the same
+        current = old.get("chunker") == CHUNKER_VERSION
+        entry = old if current and old.get("stat") == stat_key else None
+        if entry is None:
+            with open(file_path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            if current and old.get("hash") == digest:
+                entry = {**old, "stat": stat_key}
+        if entry is not None:
+            if lexical.file_hash(rel) == entry.get("hash"):
+                return (rel, entry, None, False)
+            return (rel, entry, chunk_file(str(file_path)), False)
+        chunks = chunk_file(str(file_path))
+        entry = {"hash": digest, "stat": stat_key, "chunker": CHUNKER_VERSION, "chunks": _chunk_ids(rel, chunks)}
+        return (rel, entry, chunks, True)
+
+    stats = {"chunks": 0, "files": 0, "failed": 0, "deleted": 0}
+    started = time.perf_counter()
+    pending = []   # (id, chunk, file, rel) waiting for an embedding
+    ready = {"ids": [], "embeddings": [], "documents": [], "metadatas": []}  # waiting for the store
+    failed_files = set()
+    new_manifest = dict(manifest)
+    stale_ids = []
+
+    def embed(batch):
+        vectors = get_embeddings([chunk["code"] for _, chunk, _, _ in batch])
+        if not vectors:
+            stats["failed"] += len(batch)
+            failed_files.update(rel for _, _, _, rel in batch)
+            return
+        for (doc_id, chunk, file_path, _), vector in zip(batch, vectors):
+            ready["ids"].append(doc_id)
+            ready["embeddings"].append(vector)
+            ready["documents"].append(chunk["code"])
+            ready["metadatas"].append({"file": file_path, "start_line": chunk["start_line"], "end_line": chunk["end_line"]})
+
+    def write_ready():
+        if not ready["ids"]:
+            return
+        store.upsert(**ready)
+        stats["chunks"] += len(ready["ids"])
+        for values in ready.values():
+            values.clear()
+        elapsed = time.perf_counter() - started
+        print(f"   💾 {stats['chunks']} chunks embedded, {stats['files']}/{len(files)} files checked "
+              f"({stats['chunks'] / elapsed:.1f} chunks/s)")
+
+    # Reading/hashing/chunking runs ahead on the pool while this thread embeds and writes
+    with ThreadPoolExecutor(max_workers=READ_WORKERS) as pool:
+        for rel, entry, chunks, changed in pool.map(inspect, files):
+            stats["files"] += 1
+            new_manifest[rel] = entry
+            if chunks is None:
+                continue
+            # Tokenizing is cheap: the lexical side never waits for (or fails with) Ollama
+            ids = entry["chunks"] if changed else _chunk_ids(rel, chunks)
+            lexical.update_file(rel, entry["hash"], ids, [chunk["code"] for chunk in chunks])
+            if not changed:
+                continue
+            old_ids = set(manifest.get(rel, {}).get("chunks", []))
+            stale_ids.extend(old_ids - set(entry["chunks"]))
+            abs_path = str(root / rel)
+            pending.extend((doc_id, chunk, abs_path, rel)
+                           for doc_id, chunk in zip(entry["chunks"], chunks) if doc_id not in old_ids)
+            while len(pending) >= EMBED_BATCH:
+                embed(pending[:EMBED_BATCH])
+                del pending[:EMBED_BATCH]
+                if len(ready["ids"]) >= WRITE_BATCH:
+                    write_ready()
+
+    embed(pending)
+    write_ready()
+
+    # Files whose embeddings failed keep their old manifest entry, so the next run retries them
+    for rel in failed_files:
+        if rel in manifest:
+            new_manifest[rel] = manifest[rel]
+        else:
+            new_manifest.pop(rel, None)
+    for rel in vanished:
+        stale_ids.extend(manifest[rel].get("chunks", []))
+        new_manifest.pop(rel, None)
+        lexical.remove_file(rel)
+    stale_ids = [doc_id for doc_id in stale_ids if doc_id.split("#")[0] not in failed_files]
+    if stale_ids:
+        for i in range(0, len(stale_ids), WRITE_BATCH):
+            store.delete(ids=stale_ids[i:i + WRITE_BATCH])
+        stats["deleted"] = len(stale_ids)
+    store.flush()
+    lexical.flush()
+    _save_manifest(store.manifest_path, new_manifest)
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ Index up to date: {stats['chunks']} chunks embedded, {stats['deleted']} removed, "
+          f"{len(files)} files checked in {elapsed:.1f}s ({stats['chunks'] / max(elapsed, 1e-9):.1f} chunks/s)")
+    if stats["failed"]:
+        print(f"⚠️ {stats['failed']} chunks could not be embedded (will retry next run)")
+
+def read_chunk(hit: dict) -> tuple[str, int, int]:
+    """
+    The current source of a search hit: (code, start_line, end_line) read from disk.
+    A chunk whose content did not change keeps its id (and its stored line range) even
+    when code above it moved, so the range is checked and the chunk is re-located if needed.
+    Returns (hit code, 0, 0) when the hit has no line range or is no longer in the file.
+    """
+    body = hit["code"].split("\n", 1)[1] if hit["code"].startswith("// File: ") else hit["code"]
+    start, end = hit.get("start_line", 0), hit.get("end_line", 0)
+    if not start:
+        return (hit["code"], 0, 0)
+    try:
+        source = get_source(hit["file"])
+    except Exception:
+        return (body, 0, 0)
+    if source.lines(start - 1, end) == body:
+        return (body, start, end)
+    text = source.text()
+    offset = text.find(body)
+    if offset < 0:
+        return (body, 0, 0)
+    start = text.count("\n", 0, offset) + 1
+    return (body, start, start + end - hit["start_line"])
+
 def build_vector_db(root_dir: str):
     """
     Scans the directory and adds all C/C++ files to the database.
-    RUN THIS FUNCTION ONCE to initialize the DB.
+    Safe to run any time: only what changed since the last run is re-embedded.
     """
     print(f"🗄️ Initializing local Vector DB at: {DB_PATH}")
-    
-    # Initialize ChromaDB (Persistent means it saves to disk)
-    client = chromadb.PersistentClient(path=DB_PATH)
-    
-    # Create or load a collection (think of this as a SQL table)
-    collection = client.get_or_create_collection(name="c_codebase")
-    
-    root_path = Path(root_dir)
-    # Files we care about
-    file_extensions = ['.c', '.h', '.cpp', '.hpp']
-    
-    doc_count = 0
-    
-    print(f"🔍 Scanning {root_dir} for source files...")
-    for ext in file_extensions:
-        for file_path in root_path.rglob(f"*{ext}"):
-            # Skip hidden folders (.git) or the DB folder itself
-            if ".git" in str(file_path) or "rag_db" in str(file_path):
-                continue
-                
-            print(f"   📄 Indexing: {file_path.name}")
-            chunks = chunk_file(str(file_path))
-            
-            for i, chunk in enumerate(chunks):
-                # 1. Get the vector embedding from Ollama
-                vector = get_embedding(chunk)
-                
-                if vector:
-                    doc_id = f"{file_path.name}_chunk_{i}"
-                    
-                    # 2. Save to database
-                    collection.add(
-                        ids=[doc_id],
-                        embeddings=[vector],
-                        documents=[chunk],
-                        metadatas=[{"file": str(file_path)}]
-                    )
-                    doc_count += 1
-
-    print(f"✅ Database built! Indexed {doc_count} chunks of code.")
+    update_vector_db(root_dir)
+
+def _lexical_search(queries: list[str]) -> list[tuple[list[str], bool]]:
+    """Per query: (BM25-ranked chunk ids, confident)."""
+    if not HYBRID_SEARCH:
+        return [([], False) for _ in queries]
+    index = get_lexical_index()
+    results = []
+    for query in queries:
+        ranked, confident = index.search(query, n_results=FUSION_DEPTH)
+        results.append(([doc_id for doc_id, _ in ranked], confident))
+    return results
+
+def _fuse(lexical_ids: list[str], vector_hits: list[dict], n_results: int) -> list[dict]:
+    """Reciprocal-rank fusion of both rankings; lexical-only hits are fetched from the store by id."""
+    if not lexical_ids:
+        return vector_hits[:n_results]
+    by_id = {hit["id"]: hit for hit in vector_hits}
+    order = reciprocal_rank_fusion([lexical_ids, [hit["id"] for hit in vector_hits]])
+    wanted = order[:n_results]
+    by_id.update({hit["id"]: hit for hit in get_store().get([i for i in wanted if i not in by_id])})
+    return [by_id[doc_id] for doc_id in wanted if doc_id in by_id]
 
 def search_codebase(query: str, n_results: int = 3) -> list[dict]:
     """
     Searches the database for code related to the query.
     Expected usage: search_codebase("Init_System definition")
+    Exact identifiers are looked up in the lexical index first; when its answer is
+    clear-cut the embedding call is skipped entirely.
     """
-    # Connect to the existing DB
-    client = chromadb.PersistentClient(path=DB_PATH)
-    collection = client.get_or_create_collection(name="c_codebase")
-    
+    (lexical_ids, confident), = _lexical_search([query])
+    if confident:
+        hits = get_store().get(lexical_ids[:n_results])
+        if hits:
+            return hits
+
     # Convert query to vector
     query_vector = get_embedding(query)
     
     if not query_vector:
-        return []
+        return get_store().get(lexical_ids[:n_results])
         
-    # Perform similarity search
-    results = collection.query(
-        query_embeddings=[query_vector],
-        n_results=n_results
-    )
-    
-    # Format the results for the Agent
-    matches = []
-    if results['documents']:
-        # Chroma returns a list of lists, we grab the first (and only) query's results
-        for i in range(len(results['documents'][0])):
-            matches.append({
-                "file": results['metadatas'][0][i]['file'],
-                "code": results['documents'][0][i]
-            })
-            
-    return matches
+    # Perform similarity search: [{"id": ..., "file": ..., "code": ...}, ...]
+    with get_tracer().span("vector query", "rag", queries=1):
+        vector_hits = get_store().query([query_vector], n_results=max(n_results, FUSION_DEPTH))[0]
+    return _fuse(lexical_ids, vector_hits, n_results)
+
+def search_codebase_many(queries: list[str], n_results: int = 3) -> list[list[dict]]:
+    """
+    Same as search_codebase for several queries at once: queries the lexical index
+    settles are answered directly, the rest share one batched embedding request
+    + one batched similarity search.
+    """
+    if not queries:
+        return []
+    store = get_store()
+    lexical = _lexical_search(queries)
+    results = [[] for _ in queries]
+    open_queries = []
+    for i, (lexical_ids, confident) in enumerate(lexical):
+        if confident:
+            results[i] = store.get(lexical_ids[:n_results])
+        if not results[i]:
+            open_queries.append(i)
+    if not open_queries:
+        return results
+
+    vectors = get_embeddings([queries[i] for i in open_queries])
+    if not vectors:
+        for i in open_queries:
+            results[i] = store.get(lexical[i][0][:n_results])
+        return results
+    with get_tracer().span("vector query", "rag", queries=len(vectors)):
+        vector_hits = store.query(vectors, n_results=max(n_results, FUSION_DEPTH))
+    for i, hits in zip(open_queries, vector_hits):
+        results[i] = _fuse(lexical[i][0], hits, n_results)
+    return results
 
 # --- SELF-RUNNER ---
-# If you run `python agent/rag.py`, it will rebuild the DB.
+# If you run `python agent/rag.py`, it will bring the DB up to date.
 if __name__ == "__main__":
     # Point this to your testcode folder
     target_dir = os.path.join(os.getcwd(), "testcode")
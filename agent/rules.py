@@ -0,0 +1,257 @@
+import os
+import re
+
+from agent.context import get_source
+
+# --- CONFIGURATION ---
+# Standard headers for the libc names GCC most often reports as implicitly declared / undeclared
+LIBC_HEADERS = {
+    "stdio.h": "printf fprintf sprintf snprintf vprintf vfprintf vsnprintf puts fputs putchar fputc "
+               "getchar fgetc fgets scanf sscanf fscanf fopen fclose fread fwrite fflush fseek ftell "
+               "rewind perror remove rename tmpfile FILE EOF stdin stdout stderr",
+    "stdlib.h": "malloc calloc realloc free exit abort atexit atoi atol atof strtol strtoul strtod "
+                "abs labs qsort bsearch rand srand getenv system EXIT_SUCCESS EXIT_FAILURE",
+    "string.h": "memcpy memmove memset memcmp memchr strlen strcpy strncpy strcat strncat strcmp "
+                "strncmp strchr strrchr strstr strtok strdup strerror",
+    "ctype.h": "isalpha isdigit isalnum isspace isupper islower isxdigit ispunct toupper tolower",
+    "math.h": "sqrt pow fabs floor ceil round sin cos tan atan atan2 exp log log10 fmod",
+    "stddef.h": "NULL size_t ptrdiff_t offsetof",
+    "stdint.h": "int8_t int16_t int32_t int64_t uint8_t uint16_t uint32_t uint64_t intptr_t uintptr_t "
+                "INT32_MAX UINT32_MAX",
+    "stdbool.h": "bool true false",
+    "assert.h": "assert",
+    "errno.h": "errno EINVAL ENOMEM ERANGE",
+    "time.h": "time clock difftime time_t clock_t",
+    "unistd.h": "sleep usleep read write close",
+}
+HEADER_FOR = {name: header for header, names in LIBC_HEADERS.items() for name in names.split()}
+
+_QUOTED_RE = re.compile(r"[‘'`]([^’']+)[’']")
+_NOTE_HEADER_RE = re.compile(r"include [‘'`]<([\w./]+)>[’']")
+_INCLUDE_LINE_RE = re.compile(r"^[ \t]*#[ \t]*include\b.*$", re.MULTILINE)
+_DECL_WORDS = {"const", "static", "volatile", "register", "unsigned", "signed", "struct", "enum", "union"}
+_SIMPLE_DECL_RE = re.compile(r"\s*(?:(?:const|static|volatile|register|unsigned|signed|struct|enum|union)\s+)*"
+                             r"(?P<type>[A-Za-z_]\w*)(?:\s+|\s*\*+\s*)(?P<name>[A-Za-z_]\w*)\s*(?:\[[^\]]*\]\s*)*"
+                             r"(?:=\s*(?P<init>[^;]*))?;\s*(?://.*)?")
+_IDENT_RE = re.compile(r"[A-Za-z_]\w*")
+
+# option flag -> fixer, and (message regex, fixer) pairs tried in order
+_BY_OPTION = {}
+_BY_MESSAGE = []
+
+
+def rule(option: str = None, message: str = None):
+    """Registers a fixer for a GCC option flag and/or a message pattern."""
+    def register(fn):
+        if option:
+            _BY_OPTION[option] = fn
+        if message:
+            _BY_MESSAGE.append((re.compile(message), fn))
+        return fn
+    return register
+
+
+# --- Helpers ---
+def _line_fix(diag, content: str, lines: list[str], index: int, new_line: str):
+    """
+    A fix replacing line `index` (0-based) with new_line. The anchor grows with the lines
+    below it until it is unique in the file, so it can only land on this line.
+    """
+    for span in range(1, 6):
+        original = "".join(lines[index:index + span])
+        if content.count(original) == 1:
+            replacement = new_line + "".join(lines[index + 1:index + span])
+            return [{"file": diag.file, "original_code": original, "replacement_code": replacement}]
+        if index + span >= len(lines):
+            break
+    return None
+
+
+def _include_fix(diag, content: str, lines: list[str], header: str):
+    """Adds #include <header> after the last #include of the file (or at the very top)."""
+    if re.search(rf"#[ \t]*include[ \t]*<{re.escape(header)}>", content):
+        return None  # Already there: the diagnostic has another cause
+    includes = list(_INCLUDE_LINE_RE.finditer(content))
+    if includes:
+        last = content.count("\n", 0, includes[-1].start())
+        line = lines[last]
+        ending = "\n" if line.endswith("\n") else ""
+        return _line_fix(diag, content, lines, last, f"{line.rstrip(chr(10))}\n#include <{header}>{ending}")
+    if not lines:
+        return None
+    return _line_fix(diag, content, lines, 0, f"#include <{header}>\n{lines[0]}")
+
+
+# --- Rules ---
+@rule(option="-Wunused-variable")
+def unused_variable(diag, content: str, lines: list[str]):
+    """'unused variable x': drops a one-declarator declaration whose initializer has no side effects."""
+    names = _QUOTED_RE.findall(diag.message)
+    index = diag.line - 1
+    if not names or not 0 <= index < len(lines):
+        return None
+    m = _SIMPLE_DECL_RE.fullmatch(lines[index].rstrip("\r\n"))
+    if not m or m.group("name") != names[0]:
+        return None
+    init = m.group("init") or ""
+    if _top_level_comma(init):
+        return None  # 'int a = 1, c;': more declarators than the unused one
+    if any(ch in init for ch in "(=+-") and not re.fullmatch(r"\s*-?\s*[\w.']+\s*", init):
+        return None  # Calls / assignments / increments could matter
+    # Whatever the line declares besides the type, qualifiers and the unused name would go with it
+    declared = lines[index].split("//", 1)[0][:m.start("init") if m.group("init") is not None else None]
+    declared = re.sub(r"\[[^\]]*\]", "", declared)   # Array sizes are uses, not declarations
+    others = set(_IDENT_RE.findall(declared)) - _DECL_WORDS - {m.group("type"), names[0]}
+    if others:
+        return None
+    return _line_fix(diag, content, lines, index, "")
+
+
+def _top_level_comma(text: str) -> bool:
+    """True when `text` has a ',' outside of (), [] and {} (i.e. separates declarators)."""
+    depth = 0
+    for ch in text:
+        if ch in "([{":
+            depth += 1
+        elif ch in ")]}":
+            depth -= 1
+        elif ch == "," and depth <= 0:
+            return True
+    return False
+
+
+@rule(option="-Wunused-parameter")
+def unused_parameter(diag, content: str, lines: list[str]):
+    """'unused parameter x': adds '(void)x;' as the first statement of the function."""
+    names = _QUOTED_RE.findall(diag.message)
+    if not names:
+        return None
+    for index in range(max(0, diag.line - 1), min(len(lines), diag.line + 5)):
+        code = lines[index].split("//", 1)[0].rstrip()
+        if "{" not in code:
+            continue
+        if not code.endswith("{"):
+            return None  # One-line body: leave it to the model
+        below = lines[index + 1] if index + 1 < len(lines) else ""
+        indent = re.match(r"[ \t]*", below).group(0) if below.strip() and below.strip() != "}" else "    "
+        line = lines[index]
+        ending = "\n" if line.endswith("\n") else ""
+        return _line_fix(diag, content, lines, index, f"{line.rstrip(chr(10))}\n{indent}(void){names[0]};{ending}")
+    return None
+
+
+@rule(option="-Wimplicit-function-declaration",
+      message=r"implicit declaration of (?:built-in )?function|unknown type name|undeclared|"
+              r"incompatible implicit declaration of built-in function")
+def missing_libc_header(diag, content: str, lines: list[str]):
+    """A libc name used without its header: GCC's own 'include <x.h>' note, else the table."""
+    header = None
+    for note in diag.notes:
+        m = _NOTE_HEADER_RE.search(note.message)
+        if m:
+            header = m.group(1)
+            break
+    if header is None:
+        names = _QUOTED_RE.findall(diag.message)
+        header = HEADER_FOR.get(names[0]) if names else None
+    if header is None:
+        return None
+    return _include_fix(diag, content, lines, header)
+
+
+@rule(message=r"^expected (?:[‘'`],[’'] or )?[‘'`];[’'] (?:before|after|at end of)")
+def missing_semicolon(diag, content: str, lines: list[str]):
+    """
+    "expected ';' before ..." / "expected ',' or ';' before ...": GCC points the column just
+    past the token that needs it, or (a declaration missing its ';') at the first token of
+    the next statement, possibly lines below: then the ';' ends the previous non-blank line.
+    """
+    index = diag.line - 1
+    if not 0 <= index < len(lines) or diag.column <= 0:
+        return None
+    line = lines[index]
+    body = line.rstrip("\r\n")
+    col = min(diag.column - 1, len(body))
+    head = body[:col].rstrip()
+    if not head:
+        index -= 1
+        while index >= 0 and not lines[index].split("//", 1)[0].strip():
+            index -= 1
+        if index < 0 or "/*" in lines[index] or "*/" in lines[index]:
+            return None
+        line = lines[index]
+        body = line.rstrip("\r\n")
+        code = body.split("//", 1)[0]
+        head = code.rstrip()
+        col = len(head)
+        if head.lstrip().startswith("#"):
+            return None
+    if not head or head.endswith((";", "{", "}", ",")) or body[col:].lstrip().startswith(";"):
+        return None
+    new_line = head + ";" + body[len(head):] + line[len(body):]
+    return _line_fix(diag, content, lines, index, new_line)
+
+
+# --- Merging ---
+def _insertion(original: str, replacement: str):
+    """(offset, text) when `replacement` is `original` with text inserted at one point, else None."""
+    extra = len(replacement) - len(original)
+    if extra <= 0:
+        return None
+    prefix = 0
+    while prefix < len(original) and original[prefix] == replacement[prefix]:
+        prefix += 1
+    for offset in range(prefix, -1, -1):
+        if replacement.startswith(original[:offset]) and replacement.endswith(original[offset:]):
+            return (offset, replacement[offset:offset + extra])
+    return None
+
+
+def merge_fixes(first: dict, second: dict):
+    """
+    Two rule fixes on the same anchor (two headers after the last #include, two '(void)x;'
+    after the same '{') as one fix doing both, or None when they are not both insertions.
+    """
+    if first["replacement_code"] == second["replacement_code"]:
+        return first
+    original = first["original_code"]
+    a = _insertion(original, first["replacement_code"])
+    b = _insertion(original, second["replacement_code"])
+    if a is None or b is None:
+        return None
+    if a[0] == b[0] and b[1] in a[1]:
+        return first  # Same header / same '(void)x;' already inserted there
+    merged, last = [], 0
+    for offset, text in sorted([a, b], key=lambda ins: ins[0]):
+        merged += [original[last:offset], text]
+        last = offset
+    merged.append(original[last:])
+    return {**first, "replacement_code": "".join(merged)}
+
+
+# --- Entry point ---
+def find_rule(diag):
+    fixer = _BY_OPTION.get(diag.option)
+    if fixer is not None:
+        return fixer
+    for pattern, fixer in _BY_MESSAGE:
+        if pattern.search(diag.message):
+            return fixer
+    return None
+
+
+def rule_fixes(diag, root_dir: str):
+    """
+    Deterministic CodeFix records for one structured diagnostic, or None when no rule
+    applies (or the rule is not sure). Never calls the model.
+    """
+    if diag.line <= 0:
+        return None
+    fixer = find_rule(diag)
+    if fixer is None:
+        return None
+    try:
+        content = get_source(os.path.join(root_dir, diag.file)).text()
+    except OSError:
+        return None
+    return fixer(diag, content, content.splitlines(keepends=True))
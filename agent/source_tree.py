@@ -0,0 +1,95 @@
+import json
+import os
+from pathlib import Path
+
+# --- CONFIGURATION ---
+# What counts as a project file, for every index of the tree (RAG, symbols, include graph)
+SOURCE_EXTENSIONS = (".c", ".cc", ".cpp", ".cxx")
+HEADER_EXTENSIONS = (".h", ".hh", ".hpp", ".hxx", ".inc")
+FILE_EXTENSIONS = SOURCE_EXTENSIONS + HEADER_EXTENSIONS
+# Folders never worth indexing
+SKIP_DIRS = {".git", "rag_db", ".build_cache", "__pycache__", ".venv", "venv"}
+
+
+def iter_source_files(root_dir: str):
+    """ONE walk over the tree (pruning .git, rag_db...) yielding every C/C++ source file."""
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        # Prune in place so os.walk never descends into them
+        dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS and not d.startswith(".")]
+        for name in filenames:
+            if name.endswith(FILE_EXTENSIONS):
+                yield Path(dirpath) / name
+
+
+def stat_key(path: Path):
+    """[mtime_ns, size] of a file, or None when it can't be read."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+class FileIndex:
+    """
+    Per-file entries of a tree (rel path -> {"stat": [mtime_ns, size], ...}), persisted as
+    JSON and refreshed by mtime/size. SymbolIndex and IncludeGraph keep what they need per file.
+    """
+
+    def __init__(self, root: Path, path: Path):
+        self.root = Path(root).resolve()
+        self.path = Path(path)
+        self.files = {}
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("root") == str(self.root):
+                self.files = data.get("files", {})
+        except Exception:
+            self.files = {}
+        return self
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"root": str(self.root), "files": self.files}, f)
+        os.replace(tmp, self.path)
+
+    def _changes(self, paths: list = None) -> tuple[list, list]:
+        """
+        What a refresh has to look at: ([(rel, path, stat), ...] new or changed, [rel, ...] gone).
+        The whole tree, or just `paths` (outside the tree / not ours: ignored).
+        """
+        if paths is None:
+            current = {p.relative_to(self.root).as_posix(): p for p in iter_source_files(self.root)}
+            removed = [rel for rel in self.files if rel not in current]
+        else:
+            current, removed = {}, []
+            for p in paths:
+                rel = self.rel(p)
+                if not rel or not rel.endswith(FILE_EXTENSIONS):
+                    continue
+                if Path(p).exists():
+                    current[rel] = self.root / rel
+                elif rel in self.files:
+                    removed.append(rel)
+
+        stale = []
+        for rel, p in current.items():
+            key = stat_key(p)
+            if key is not None and self.files.get(rel, {}).get("stat") != key:
+                stale.append((rel, p, key))
+        return stale, removed
+
+    def rel(self, path) -> str:
+        """Project-relative key of a path ('' when it is outside the tree)."""
+        try:
+            return Path(path).resolve().relative_to(self.root).as_posix()
+        except ValueError:
+            return ""
+
+    def abs_path(self, rel: str) -> Path:
+        return self.root / rel
@@ -0,0 +1,188 @@
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from agent.build import BuildCancel, ObjectCache, TranslationUnit, compile_unit, link
+from agent.fixer import plan_fix_batch, write_patches
+from agent.memory import normalize_signature
+from agent.tracing import get_tracer
+from parsers.gcc import parse_log
+
+# --- CONFIGURATION ---
+# Candidate i is sampled at TEMPERATURES[i]; the first one is the usual deterministic answer.
+TEMPERATURES = [0.0, 0.3, 0.6, 0.8, 1.0]
+
+
+def _git(args: list[str], cwd: Path, stdin: str = None) -> tuple[bool, str]:
+    res = subprocess.run(["git", *args], cwd=cwd, input=stdin, capture_output=True, text=True)
+    return (res.returncode == 0, res.stdout)
+
+
+def repo_root() -> Path:
+    ok, out = _git(["rev-parse", "--show-toplevel"], Path.cwd())
+    return Path(out.strip()).resolve() if ok and out.strip() else Path.cwd().resolve()
+
+
+class Sandbox:
+    """
+    A throwaway copy of the repository that includes the current uncommitted edits:
+    a detached 'git worktree' with 'git diff HEAD' replayed on top, or a plain
+    directory copy when git is not available.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root).resolve()
+        self.path = None
+        self._worktree = False
+
+    def __enter__(self):
+        self.path = Path(tempfile.mkdtemp(prefix="ai-spec-"))
+        ok, _ = _git(["worktree", "add", "--detach", "--force", str(self.path), "HEAD"], self.root)
+        if ok:
+            self._worktree = True
+            _, diff = _git(["diff", "HEAD", "--binary"], self.root)
+            if diff.strip():
+                _git(["apply", "--whitespace=nowarn", "-"], self.path, stdin=diff)
+        else:
+            shutil.rmtree(self.path, ignore_errors=True)
+            shutil.copytree(self.root, self.path, ignore=shutil.ignore_patterns(".git", ".build_cache", "rag_db"))
+        return self
+
+    def __exit__(self, *exc):
+        if self._worktree:
+            _git(["worktree", "remove", "--force", str(self.path)], self.root)
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def map(self, path) -> Path:
+        """Real path -> the same file inside the sandbox."""
+        path = Path(path).resolve()
+        try:
+            return self.path / path.relative_to(self.root)
+        except ValueError:
+            return path  # Outside the repo (system headers...): shared
+
+    def map_text(self, text: str) -> str:
+        return text.replace(str(self.root), str(self.path))
+
+    def unmap_text(self, text: str) -> str:
+        return text.replace(str(self.path), str(self.root))
+
+
+def _diagnostic_keys(diagnostics) -> set:
+    """Line-shift-insensitive identity of a diagnostic: (file, normalized signature)."""
+    return {(d.file, normalize_signature(d.severity, d.message, d.option)[0]) for d in diagnostics}
+
+
+def _affected_units(units: list, patched: set, cache: ObjectCache) -> list[bool]:
+    """Per unit: does it compile one of the patched files (itself or through a header it read)?"""
+    affected = []
+    for unit in units:
+        headers = cache.headers_of(unit)
+        # Never compiled: we can't tell what it reads, so it is rebuilt in the sandbox
+        affected.append(headers is None or str(Path(unit.source).resolve()) in patched
+                        or any(h in patched for h in headers))
+    return affected
+
+
+def evaluate_candidate(fixes: list[dict], desc, baseline: list, root: Path, jobs: int = 1,
+                       cancel: BuildCancel = None) -> dict:
+    """
+    Applies one candidate in its own sandbox and builds it.
+    Only the TUs that read a patched file are compiled there; the others are replayed from
+    the project's own object cache (they are byte for byte the same), then everything is linked.
+    Returns {"ok": bool, "diagnostics": [...], "applied": int} where ok means: fewer diagnostics
+    than the baseline and none that the baseline did not already have.
+    """
+    with Sandbox(root) as box:
+        patches = plan_fix_batch(fixes, path_map=box.map)
+        applied = write_patches(patches)
+        if applied == 0:
+            return {"ok": False, "diagnostics": [], "applied": 0}
+        patched = {str(root / Path(p.path).relative_to(box.path)) for p in patches}
+
+        main_cache, box_cache = ObjectCache(), ObjectCache(box.path / ".build_cache")
+        affected = _affected_units(desc.units, patched, main_cache)
+        with get_tracer().span("sandbox build", "build", units=sum(affected)) as span:
+            def compile_one(pair):
+                unit, stale = pair
+                if not stale:
+                    return compile_unit(unit, main_cache, cancel=cancel)
+                moved = TranslationUnit(source=box.map(unit.source), flags=[box.map_text(f) for f in unit.flags],
+                                        compiler=unit.compiler, directory=box.map(unit.directory))
+                return compile_unit(moved, box_cache, cancel=cancel)
+
+            with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+                results = list(pool.map(compile_one, zip(desc.units, affected)))
+            span.update(compiled=sum(1 for r in results if not r[3]), cached=sum(1 for r in results if r[3]))
+        if any(ok is None for _, ok, _, _ in results):
+            return {"ok": False, "diagnostics": [], "applied": applied}   # Cancelled: another candidate won
+
+        logs = [log for _, _, log, _ in results if log]
+        if desc.output and desc.units and all(ok for _, ok, _, _ in results):
+            _, log, _ = link([obj for obj, _, _, _ in results], box.map(desc.output), desc.units[0].compiler,
+                             [box.map_text(f) for f in desc.ldflags], box_cache, box.map(desc.units[0].directory))
+            if log:
+                logs.append(log)
+        diagnostics = [d for d in parse_log(box.unmap_text("\n".join(logs))) if d.severity in ("error", "warning")]
+
+    new_keys = _diagnostic_keys(diagnostics) - _diagnostic_keys(baseline)
+    ok = len(diagnostics) < len(baseline) and not new_keys
+    return {"ok": ok, "diagnostics": diagnostics, "applied": applied}
+
+
+def generate_candidates(chain_for_temperature, inputs: dict, n: int, concurrency: int) -> list[list[dict]]:
+    """Asks the model for n candidates at different temperatures; duplicates are dropped."""
+    temperatures = (TEMPERATURES * ((n // len(TEMPERATURES)) + 1))[:n]
+
+    def ask(temperature):
+        try:
+            return chain_for_temperature(temperature).invoke(inputs).get("fixes", [])
+        except Exception as e:
+            print(f"💥 Candidate generation failed (T={temperature}): {e}")
+            return []
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        results = list(pool.map(ask, temperatures))
+
+    candidates, seen = [], set()
+    for fixes in results:
+        key = tuple((f.get("original_code", ""), f.get("replacement_code", "")) for f in fixes)
+        if fixes and key not in seen:
+            seen.add(key)
+            candidates.append(fixes)
+    return candidates
+
+
+def pick_candidate(candidates: list[list[dict]], desc, baseline: list, jobs: int = 1):
+    """
+    Verifies all candidates concurrently (one sandbox each) and returns the first one that
+    finishes with a strict improvement, or None.
+    """
+    if not candidates:
+        return None
+    root = repo_root()
+    cancels = [BuildCancel() for _ in candidates]
+    pool = ThreadPoolExecutor(max_workers=len(candidates))
+    futures = {pool.submit(evaluate_candidate, fixes, desc, baseline, root, jobs, cancels[i]): i
+               for i, fixes in enumerate(candidates)}
+    winner = None
+    for future in as_completed(futures):
+        i = futures[future]
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"   💥 Candidate {i + 1} crashed: {e}")
+            continue
+        print(f"   🧪 Candidate {i + 1}: {len(result['diagnostics'])} diagnostics "
+              f"(baseline {len(baseline)}) -> {'✅ keep' if result['ok'] else '❌ drop'}")
+        if result["ok"]:
+            winner = candidates[i]
+            break
+    # Stop the losers' compilers and wait for their worktrees to be removed: nothing of
+    # theirs may still run once the winner is applied to the real tree
+    for cancel in cancels:
+        cancel.cancel()
+    pool.shutdown(wait=True, cancel_futures=True)
+    return winner
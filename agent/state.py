@@ -11,14 +11,24 @@ class AgentState(TypedDict):
     build_success: bool
     error_lines: List[str]
     warning_lines: List[str]
+    diagnostics: List[Any]  # parsers.gcc.Diagnostic records behind error_lines/warning_lines
+    build_aborted: bool     # the build stopped after AGENT_MAX_ERRORS errors (not every TU compiled)
     
     # AI Context & Output
     code_context: str
     proposed_fixes: List[Dict[str, Any]] # Will hold our JSON fixes
     reasoning: str
     current_issue: str #to identify error or warning we are targeting
+    current_issues: List[str] # every issue in flight (batches and parallel files hold several)
+    work_items: List[Dict[str, Any]] # one entry per LLM request: issue(s), file, context, then fixes + source
+    fix_source: str # "llm", "memory" (replayed from Memory/solutions.json) or "rules" (agent/rules.py)
+    
+    # Files changed by apply_fix_node during this run (absolute paths)
+    patched_files: List[str]
+    preverify_rejected: bool # every patch of the round failed the syntax pre-check (nothing was written)
     
     # Loop control
     retry_count: int
+    progress: Dict[str, Any] # agent/progress.py: attempts per diagnostic, quarantine, stalled rounds
 
     
\ No newline at end of file
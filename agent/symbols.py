@@ -0,0 +1,330 @@
+import bisect
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from agent.context import get_source
+from agent.source_tree import HEADER_EXTENSIONS, FileIndex
+
+# --- CONFIGURATION ---
+INDEX_PATH = Path(".build_cache").resolve() / "symbols.json"
+
+# Comments and string/char literals are blanked out (newlines kept, so line numbers stay right)
+_NOISE_RE = re.compile(r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'', re.DOTALL)
+_ATTRIBUTE_RE = re.compile(r"__attribute__\s*\(\((?:[^()]|\([^()]*\))*\)\)|__declspec\s*\([^)]*\)")
+_DEFINE_RE = re.compile(r"^[ \t]*#[ \t]*define[ \t]+(\w+)", re.MULTILINE)
+_PREPROC_RE = re.compile(r"^[ \t]*#.*?(?<!\\)$", re.MULTILINE | re.DOTALL)
+_FUNC_RE = re.compile(r"\b([A-Za-z_]\w*)\s*\((?:[^()]|\([^()]*\))*\)\s*$")
+_TAG_RE = re.compile(r"\b(struct|union|enum)\s+([A-Za-z_]\w*)\s*$")
+# '(*name)(' / '(*name[4])(': the declarator of a function pointer (variable, array or typedef)
+_FUNC_PTR_RE = re.compile(r"\(\s*\*\s*([A-Za-z_]\w*)\s*(?:\[[^\]]*\]\s*)*\)\s*\(")
+_LAST_IDENT_RE = re.compile(r"([A-Za-z_]\w*)\s*(?:\[[^\]]*\]\s*)*$")
+_NOT_FUNCTIONS = {"if", "while", "for", "switch", "return", "sizeof", "defined"}
+
+
+def _blank(m: re.Match) -> str:
+    return re.sub(r"[^\n]", " ", m.group(0))
+
+
+def scan_c_source(text: str) -> list[dict]:
+    """
+    Lightweight scanner (no preprocessor, no real parser): finds the top-level
+    definitions and declarations of a C file.
+    Each symbol: {"name", "kind", "line", "signature"} where kind is one of
+    function, prototype, macro, struct, union, enum, typedef, variable.
+    """
+    symbols = []
+    newlines = [i for i, ch in enumerate(text) if ch == "\n"]
+
+    def line_of(offset: int) -> int:
+        return bisect.bisect_right(newlines, offset - 1) + 1
+
+    def signature_at(line: int) -> str:
+        start = newlines[line - 2] + 1 if line >= 2 else 0
+        end = newlines[line - 1] if line - 1 < len(newlines) else len(text)
+        return text[start:end].strip()
+
+    # Macros come from the raw text (before we blank out directives)
+    for m in _DEFINE_RE.finditer(text):
+        line = line_of(m.start(1))
+        symbols.append({"name": m.group(1), "kind": "macro", "line": line, "signature": signature_at(line)})
+
+    clean = _NOISE_RE.sub(_blank, text)
+    clean = _PREPROC_RE.sub(_blank, clean)
+
+    depth = 0
+    stmt_start = 0
+    pending_tag = None   # A 'struct X {' whose closing '}' we are waiting for
+    after_body = False   # Just closed a struct/union/enum body: 'name;' is a variable of that type
+    typedef_open = False
+    extern_blocks = 0    # extern "C" { ... } is transparent
+
+    def add(name: str, kind: str, offset: int):
+        line = line_of(offset)
+        symbols.append({"name": name, "kind": kind, "line": line, "signature": signature_at(line)})
+
+    for i, ch in enumerate(clean):
+        if ch == "{":
+            if depth == 0:
+                head = _ATTRIBUTE_RE.sub(lambda m: " " * len(m.group(0)), clean[stmt_start:i])
+                if head.strip() == "extern":
+                    extern_blocks += 1
+                    stmt_start = i + 1
+                    continue
+                typedef_open = head.lstrip().startswith("typedef")
+                tag = _TAG_RE.search(head)
+                func = _FUNC_RE.search(head)
+                if "=" in head and not typedef_open:
+                    # 'static const char *names[] = { ... };': the braces are an initializer
+                    decl = head.split("=", 1)[0]
+                    name = _FUNC_PTR_RE.search(decl) or _LAST_IDENT_RE.search(decl.rstrip())
+                    if name:
+                        add(name.group(1), "variable", stmt_start + name.start(1))
+                elif tag:
+                    pending_tag = tag
+                    add(tag.group(2), tag.group(1), stmt_start + tag.start(2))
+                elif typedef_open or re.search(r"\b(?:struct|union|enum)\s*$", head):
+                    pending_tag = True  # Anonymous struct/union/enum body
+                elif func and "=" not in head and func.group(1) not in _NOT_FUNCTIONS:
+                    add(func.group(1), "function", stmt_start + func.start(1))
+            depth += 1
+        elif ch == "}":
+            if depth == 0:
+                if extern_blocks:
+                    extern_blocks -= 1
+                stmt_start = i + 1
+                continue
+            depth -= 1
+            if depth == 0:
+                stmt_start = i + 1
+                # A function body ends the statement; a struct body is followed by '... ;'
+                after_body = pending_tag is not None
+                pending_tag = None
+        elif ch == ";" and depth == 0:
+            stmt = _ATTRIBUTE_RE.sub(lambda m: " " * len(m.group(0)), clean[stmt_start:i])
+            body = stmt.strip()
+            if typedef_open or body.startswith("typedef"):
+                ptr = _FUNC_PTR_RE.search(stmt)
+                name = ptr or _LAST_IDENT_RE.search(stmt.rstrip())
+                if name:
+                    add(name.group(1), "typedef", stmt_start + name.start(1))
+            elif after_body:
+                name = _LAST_IDENT_RE.search(stmt.rstrip())
+                if name:
+                    add(name.group(1), "variable", stmt_start + name.start(1))
+            elif body:
+                decl = stmt.split("=", 1)[0]
+                ptr = _FUNC_PTR_RE.search(decl)
+                func = _FUNC_RE.search(stmt.rstrip())
+                if ptr:
+                    add(ptr.group(1), "variable", stmt_start + ptr.start(1))   # int (*cb)(int);
+                elif func and func.group(1) not in _NOT_FUNCTIONS:
+                    add(func.group(1), "prototype", stmt_start + func.start(1))
+                elif "(" not in body:
+                    decl = body.split("=", 1)[0].rstrip()
+                    name = _LAST_IDENT_RE.search(decl)
+                    if name and not _TAG_RE.search(decl) and len(decl.split()) > 1:
+                        add(name.group(1), "variable", stmt_start + stmt.find(decl) + name.start(1))
+            typedef_open = False
+            after_body = False
+            stmt_start = i + 1
+
+    return symbols
+
+
+def top_level_spans(text: str) -> list[tuple[int, int, bool]]:
+    """
+    Splits a C file into its top-level units with the same brace matching as scan_c_source.
+    Returns [(first line, last line, has_body), ...] (1-based, inclusive) covering every
+    non-blank line: comments and blank lines above a unit belong to it, preprocessor lines
+    between units are units of their own. has_body marks functions and struct/union/enum bodies.
+    Returns [] when the braces do not balance (the caller falls back to fixed windows).
+    """
+    clean = _NOISE_RE.sub(_blank, text)
+    clean = _PREPROC_RE.sub(_blank, clean)
+    newlines = [i for i, ch in enumerate(text) if ch == "\n"]
+
+    def line_of(offset: int) -> int:
+        return bisect.bisect_right(newlines, offset - 1) + 1
+
+    ends = []            # (end offset, has_body) of every top-level unit
+    bodies = []          # [first line, last line] of every top-level { ... }
+    depth = 0
+    stmt_start = 0
+    body_is_function = False
+    in_aggregate = False  # Closed a struct/union/enum body: the unit ends at the next ';'
+    for i, ch in enumerate(clean):
+        if ch == "{":
+            if depth == 0:
+                head = clean[stmt_start:i]
+                func = _FUNC_RE.search(_ATTRIBUTE_RE.sub(lambda m: " " * len(m.group(0)), head))
+                body_is_function = bool(func) and "=" not in head and func.group(1) not in _NOT_FUNCTIONS
+                if head.strip() == "extern":
+                    stmt_start = i + 1  # extern "C" { ... } is transparent
+                    continue
+                bodies.append([line_of(i), 0])
+            depth += 1
+        elif ch == "}":
+            if depth == 0:
+                stmt_start = i + 1
+                continue
+            depth -= 1
+            if depth == 0:
+                bodies[-1][1] = line_of(i)
+                if body_is_function:
+                    ends.append((i, True))
+                    stmt_start = i + 1
+                else:
+                    in_aggregate = True
+        elif ch == ";" and depth == 0:
+            ends.append((i, in_aggregate))
+            in_aggregate = False
+            stmt_start = i + 1
+    if depth != 0:
+        return []
+
+    # Preprocessor lines outside any body (includes, macros, guards) are units too
+    body_starts = [first for first, _ in bodies]
+
+    def in_body(line: int) -> bool:
+        k = bisect.bisect_right(body_starts, line) - 1
+        return k >= 0 and line <= bodies[k][1]
+
+    directives = [line_of(m.end()) for m in _PREPROC_RE.finditer(text)]
+    directives = [line for line in directives if not in_body(line)]
+    unit_lines = sorted({(line_of(end), has_body) for end, has_body in ends}
+                        | {(line, False) for line in directives})
+
+    lines = text.split("\n")
+    spans = []
+    start = 1
+    for end, has_body in unit_lines:
+        if end < start:
+            continue
+        while start < end and not lines[start - 1].strip():
+            start += 1
+        spans.append((start, end, has_body))
+        start = end + 1
+    while start <= len(lines) and not lines[start - 1].strip():
+        start += 1
+    if start <= len(lines):
+        spans.append((start, len(lines), False))
+    return spans
+
+
+def _scan_file(path: Path) -> list[dict]:
+    try:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            return scan_c_source(f.read())
+    except OSError:
+        return []
+
+
+class SymbolIndex(FileIndex):
+    """
+    name -> every place it is defined or declared, across all C/C++ files of a tree.
+    Persisted to disk and refreshed incrementally (only files whose mtime/size changed are rescanned).
+    """
+
+    def __init__(self, root: Path, path: Path = INDEX_PATH):
+        super().__init__(root, path)   # files: rel path -> {"stat": [mtime_ns, size], "symbols": [...]}
+        self.by_name = {}
+
+    # --- Building ---
+    def refresh(self, paths: list[str] = None) -> int:
+        """
+        Rescans new/changed files (or just `paths`), drops deleted ones. Returns files rescanned.
+        A `paths` refresh patches the name table in place and is not saved: the next process
+        sees those files' new mtime and rescans them anyway.
+        """
+        stale, removed = self._changes(paths)
+        changed = removed + [rel for rel, _, _ in stale]
+        names = {sym["name"] for rel in changed for sym in self.files.get(rel, {}).get("symbols", [])}
+        for rel in removed:
+            del self.files[rel]
+        with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 2)) as pool:
+            for (rel, _, stat_key), symbols in zip(stale, pool.map(lambda s: _scan_file(s[1]), stale)):
+                self.files[rel] = {"stat": stat_key, "symbols": symbols}
+
+        if paths is None:
+            if changed or not self.by_name:
+                self._reindex()
+            if changed:
+                self.save()
+        elif changed:
+            self._reindex_files(set(changed), names)
+        return len(stale)
+
+    def _reindex(self):
+        by_name = {}
+        for rel, entry in self.files.items():
+            for sym in entry["symbols"]:
+                by_name.setdefault(sym["name"], []).append({**sym, "file": rel})
+        self.by_name = by_name
+
+    def _reindex_files(self, rels: set, old_names: set):
+        """Replaces the name table entries of just these files (`old_names`: what they used to define)."""
+        for name in old_names:
+            hits = [hit for hit in self.by_name.get(name, []) if hit["file"] not in rels]
+            if hits:
+                self.by_name[name] = hits
+            else:
+                self.by_name.pop(name, None)
+        for rel in rels:
+            for sym in self.files.get(rel, {}).get("symbols", []):
+                self.by_name.setdefault(sym["name"], []).append({**sym, "file": rel})
+
+    # --- Queries ---
+    def lookup(self, name: str) -> dict:
+        """
+        Where is `name` defined, where is it declared, and which headers export it?
+        Returns {"definitions": [...], "declarations": [...], "headers": [...]} (dict lookups only).
+        """
+        hits = self.by_name.get(name, [])
+        definitions = [h for h in hits if h["kind"] not in ("prototype",)]
+        declarations = [h for h in hits if h["kind"] == "prototype"]
+        headers = sorted({h["file"] for h in hits if h["file"].endswith(HEADER_EXTENSIONS)})
+        return {"definitions": definitions, "declarations": declarations, "headers": headers}
+
+
+_indexes = {}
+
+def get_symbol_index(root: str, paths: list[str] = None) -> SymbolIndex:
+    """
+    Process-wide index per tree: loaded from disk and brought up to date by mtime once, then
+    only `paths` (the files the agent just patched or rolled back) are rescanned.
+    """
+    root = str(Path(root).resolve())
+    index = _indexes.get(root)
+    if index is None:
+        index = SymbolIndex(Path(root)).load()
+        index.refresh()
+        _indexes[root] = index
+    elif paths:
+        index.refresh(paths)
+    return index
+
+
+def _read_lines(path: Path, start: int, count: int) -> str:
+    try:
+        return get_source(str(path)).lines(start - 1, start - 1 + count)
+    except OSError:
+        return ""
+
+
+def format_symbol_context(index: SymbolIndex, name: str, max_body_lines: int = 15) -> str:
+    """Prompt-ready text: the definition of `name` plus the header that declares it (if any)."""
+    found = index.lookup(name)
+    if not found["definitions"] and not found["declarations"]:
+        return ""
+
+    parts = [f"\n\n--- SYMBOL '{name}' ---\n"]
+    for d in found["declarations"][:2]:
+        parts.append(f"Declared in {d['file']}:{d['line']}: {d['signature']}\n")
+    for h in found["headers"][:2]:
+        parts.append(f'Exported by header: #include "{Path(h).name}"\n')
+    for d in found["definitions"][:1]:
+        parts.append(f"Defined in {d['file']}:{d['line']} ({d['kind']}):\n")
+        parts.append(_read_lines(index.abs_path(d["file"]), d["line"], max_body_lines))
+    return "".join(parts)
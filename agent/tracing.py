@@ -0,0 +1,151 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+# --- CONFIGURATION ---
+# Where each run writes <run>.jsonl (one span per line) and <run>.trace.json (chrome://tracing,
+# Perfetto). Empty = no files, the summary table is still printed.
+TRACE_DIR = os.environ.get("AGENT_TRACE_DIR", str(Path(".build_cache") / "traces"))
+# "debug" also prints the raw dumps (full model output...), "info" is the normal console
+LOG_LEVEL = os.environ.get("AGENT_LOG_LEVEL", "info").lower()
+
+
+def debug(text: str):
+    """Prints only with AGENT_LOG_LEVEL=debug."""
+    if LOG_LEVEL == "debug":
+        print(text)
+
+
+class Tracer:
+    """
+    Collects timed spans (graph nodes, builds, model calls, vector queries, file patches)
+    and plain counters (cache hits, bytes read) for one run. Thread-safe: the context
+    pool, the build workers and the speculative sandboxes all report into it.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.wall_started = time.time()
+        self.spans = []                # {"name", "cat", "start", "dur", "tid", "args"} (seconds)
+        self.counters = {}             # name -> Counter
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def _tid(self) -> int:
+        ident = threading.get_ident()
+        with self._lock:
+            return self._threads.setdefault(ident, len(self._threads) + 1)
+
+    def record(self, name: str, cat: str, duration: float, **args):
+        """Adds a span that ends now and lasted `duration` seconds (for timings reported by someone else)."""
+        end = time.perf_counter() - self.started
+        span = {"name": name, "cat": cat, "start": max(0.0, end - duration), "dur": duration,
+                "tid": self._tid(), "args": args}
+        with self._lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def span(self, name: str, cat: str = "agent", **args):
+        """Times the with-block. The yielded dict can be filled with results (tokens, bytes, hits...)."""
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.record(name, cat, time.perf_counter() - start, **args)
+
+    def count(self, name: str, **values):
+        with self._lock:
+            self.counters.setdefault(name, Counter()).update(values)
+
+    # --- Export ---
+    def export_jsonl(self, path: Path):
+        with open(path, "w", encoding="utf-8") as f:
+            for span in sorted(self.spans, key=lambda s: s["start"]):
+                f.write(json.dumps(span) + "\n")
+            for name, values in self.counters.items():
+                f.write(json.dumps({"counter": name, "values": dict(values)}) + "\n")
+
+    def export_chrome(self, path: Path):
+        """Trace-event format: complete ('X') events in microseconds, counters as 'C' events."""
+        pid = os.getpid()
+        events = [{"name": s["name"], "cat": s["cat"], "ph": "X", "ts": round(s["start"] * 1e6),
+                   "dur": round(s["dur"] * 1e6), "pid": pid, "tid": s["tid"], "args": s["args"]}
+                  for s in self.spans]
+        end = round((time.perf_counter() - self.started) * 1e6)
+        events += [{"name": name, "ph": "C", "ts": end, "pid": pid, "args": dict(values)}
+                   for name, values in self.counters.items()]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def export(self, directory: str = TRACE_DIR) -> list[Path]:
+        if not directory:
+            return []
+        out = Path(directory)
+        out.mkdir(parents=True, exist_ok=True)
+        stem = time.strftime("run-%Y%m%d-%H%M%S", time.localtime(self.wall_started))
+        paths = [out / f"{stem}.jsonl", out / f"{stem}.trace.json"]
+        self.export_jsonl(paths[0])
+        self.export_chrome(paths[1])
+        return paths
+
+    # --- Summary ---
+    def summary(self) -> str:
+        """One row per span name: calls, total/mean/max time, tokens and tokens/s when known."""
+        wall = time.perf_counter() - self.started
+        rows = {}
+        for span in self.spans:
+            row = rows.setdefault((span["cat"], span["name"]), {"calls": 0, "total": 0.0, "max": 0.0, "args": Counter()})
+            row["calls"] += 1
+            row["total"] += span["dur"]
+            row["max"] = max(row["max"], span["dur"])
+            row["args"].update({k: v for k, v in span["args"].items() if isinstance(v, (int, float))
+                                and not isinstance(v, bool)})
+
+        lines = [f"📊 Run summary ({wall:.1f}s wall)",
+                 f"   {'step':<28}{'calls':>6}{'total s':>10}{'mean s':>9}{'max s':>8}  details"]
+        for (cat, name), row in sorted(rows.items(), key=lambda item: -item[1]["total"]):
+            args = row["args"]
+            details = []
+            if args.get("prompt_tokens") or args.get("completion_tokens"):
+                details.append(f"{args['prompt_tokens']} tok in / {args['completion_tokens']} tok out")
+            if args.get("completion_tokens") and args.get("decode_s"):
+                details.append(f"{args['completion_tokens'] / args['decode_s']:.1f} tok/s")
+            for key in ("compiled", "cached", "texts", "queries", "fixes", "bytes"):
+                if args.get(key):
+                    details.append(f"{key} {args[key]}")
+            label = f"{cat}:{name}"
+            lines.append(f"   {label:<28}{row['calls']:>6}{row['total']:>10.2f}{row['total'] / row['calls']:>9.2f}"
+                         f"{row['max']:>8.2f}  {', '.join(details)}")
+        for name, values in sorted(self.counters.items()):
+            lines.append(f"   {name}: " + ", ".join(f"{k} {v}" for k, v in sorted(values.items())))
+        return "\n".join(lines)
+
+
+_tracer = Tracer()
+
+def get_tracer() -> Tracer:
+    """Process-wide tracer of the current run."""
+    return _tracer
+
+
+def ollama_usage(meta: dict) -> dict:
+    """Span args from the durations/counters Ollama returns with a chat or embed response."""
+    if not meta:
+        return {}
+    return {"prompt_tokens": meta.get("prompt_eval_count", 0), "completion_tokens": meta.get("eval_count", 0),
+            "prefill_s": meta.get("prompt_eval_duration", 0) / 1e9, "decode_s": meta.get("eval_duration", 0) / 1e9,
+            "load_s": meta.get("load_duration", 0) / 1e9}
+
+
+def traced_node(name: str, fn):
+    """Wraps a graph node so every visit shows up as one 'node' span."""
+    @functools.wraps(fn)
+    def node(state):
+        with _tracer.span(name, "node"):
+            return fn(state)
+    return node
@@ -0,0 +1,356 @@
+import json
+import os
+import sys
+import threading
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:  # Optional: without NumPy only the Chroma backend is available
+    np = None
+
+# --- CONFIGURATION ---
+# We store the database in a local folder named 'rag_db'
+DB_PATH = os.path.join(os.getcwd(), "rag_db")
+COLLECTION_NAME = "c_codebase"
+# Embedded backend: float32 matrix (memory-mapped) + sidecar metadata + documents blob
+VECTORS_PATH = os.path.join(DB_PATH, "vectors")
+# "numpy" (embedded, default when NumPy is installed) or "chroma". A tree that only has an
+# older Chroma index keeps using it until it is migrated ('python -m agent.vector_store migrate').
+_CHROMA_ONLY = os.path.exists(os.path.join(DB_PATH, "chroma.sqlite3")) and not os.path.exists(VECTORS_PATH)
+RAG_BACKEND = os.environ.get("AGENT_RAG_BACKEND", "numpy" if np is not None and not _CHROMA_ONLY else "chroma")
+# Rewrite the files once this share of rows are dead (deleted / replaced)
+COMPACT_RATIO = 0.25
+
+
+def _hit(doc_id: str, meta: dict, code: str) -> dict:
+    """One search result: {"id", "file", "code"} + the chunk's line range when it is known."""
+    hit = {"id": doc_id, "file": meta.get("file", ""), "code": code}
+    if meta.get("start_line"):
+        hit["start_line"] = meta["start_line"]
+        hit["end_line"] = meta["end_line"]
+    return hit
+
+
+class ChromaStore:
+    """The original ChromaDB collection, behind the same interface as NumpyStore."""
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        # Same manifest location as before the backends existed, so old indexes stay incremental
+        self.manifest_path = os.path.join(db_path, "manifest.json")
+        self._collection = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        with self._lock:
+            if self._collection is None:
+                import chromadb  # Heavy import: only paid when this backend is actually used
+                self._client = chromadb.PersistentClient(path=self.db_path)
+                self._collection = self._client.get_or_create_collection(name=COLLECTION_NAME)
+            return self._collection
+
+    def reset(self):
+        self._get()
+        with self._lock:
+            try:
+                self._client.delete_collection(name=COLLECTION_NAME)
+            except Exception:
+                pass
+            self._collection = self._client.get_or_create_collection(name=COLLECTION_NAME)
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self._get().upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def delete(self, ids):
+        self._get().delete(ids=ids)
+
+    def flush(self):
+        pass  # Chroma persists on every write
+
+    def count(self) -> int:
+        return self._get().count()
+
+    def query(self, vectors: list[list[float]], n_results: int = 3) -> list[list[dict]]:
+        results = self._get().query(query_embeddings=vectors, n_results=n_results)
+        matches = []
+        for ids, docs, metas in zip(results.get("ids") or [], results.get("documents") or [], results.get("metadatas") or []):
+            matches.append([_hit(doc_id, meta, doc) for doc_id, doc, meta in zip(ids, docs, metas)])
+        return matches or [[] for _ in vectors]
+
+    def get(self, ids: list[str]) -> list[dict]:
+        """Chunks by id (no embedding involved); unknown ids are left out."""
+        if not ids:
+            return []
+        found = self._get().get(ids=ids, include=["documents", "metadatas"])
+        by_id = {doc_id: _hit(doc_id, meta, doc)
+                 for doc_id, doc, meta in zip(found["ids"], found["documents"], found["metadatas"])}
+        return [by_id[doc_id] for doc_id in ids if doc_id in by_id]
+
+
+class NumpyStore:
+    """
+    Embedded vector index, loaded once per process:
+      embeddings.f32  row-major float32 matrix (L2-normalized rows), memory-mapped
+      documents.txt   UTF-8 chunk texts, appended back to back
+      meta.json       dim + per row: id, file, [offset, length] into documents.txt, [start, end] lines
+    Updates are append-only (replaced/deleted rows become dead rows); the files are
+    compacted when too many rows are dead. Top-k = one matrix product + argpartition.
+    """
+
+    def __init__(self, path: str = VECTORS_PATH):
+        if np is None:
+            raise RuntimeError("The numpy vector backend needs NumPy (pip install numpy)")
+        self.path = Path(path)
+        self.matrix_path = self.path / "embeddings.f32"
+        self.docs_path = self.path / "documents.txt"
+        self.meta_path = self.path / "meta.json"
+        self.manifest_path = str(self.path / "manifest.json")
+        self._lock = threading.RLock()
+        self._loaded = False
+
+    # --- Loading ---
+    def _load(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                with open(self.meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+            except Exception:
+                meta = {}
+            self.dim = meta.get("dim", 0)
+            self.ids = meta.get("ids", [])       # None = dead row
+            self.files = meta.get("files", [])
+            self.spans = meta.get("spans", [])
+            self.lines = meta.get("lines") or [[0, 0] for _ in self.ids]  # Older indexes had no line ranges
+            self._rows = {doc_id: i for i, doc_id in enumerate(self.ids) if doc_id is not None}
+            self._dirty = False
+            self._drop_unflushed()
+            self._map_matrix()
+            self._loaded = True
+
+    def _drop_unflushed(self):
+        """Appends from a run that died before flush() are not in meta.json: cut them off."""
+        sizes = [(self.matrix_path, len(self.ids) * self.dim * 4),
+                 (self.docs_path, max((start + length for start, length in self.spans), default=0))]
+        for path, size in sizes:
+            if path.exists() and path.stat().st_size > size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+
+    def _map_matrix(self):
+        rows = len(self.ids)
+        if rows and self.dim and self.matrix_path.exists():
+            self._matrix = np.memmap(self.matrix_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        else:
+            self._matrix = np.zeros((0, max(self.dim, 1)), dtype=np.float32)
+        self._dead = np.array([i for i, doc_id in enumerate(self.ids) if doc_id is None], dtype=np.int64)
+
+    # --- Writing ---
+    @staticmethod
+    def _normalize(vectors) -> "np.ndarray":
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix[None, :]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def reset(self):
+        with self._lock:
+            for p in (self.matrix_path, self.docs_path, self.meta_path):
+                p.unlink(missing_ok=True)
+            self._loaded = False
+            self._load()
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        if not ids:
+            return
+        self._load()
+        matrix = self._normalize(embeddings)
+        with self._lock:
+            if self.dim and matrix.shape[1] != self.dim:
+                raise ValueError(f"Embedding size {matrix.shape[1]} does not match the index ({self.dim})")
+            self.dim = matrix.shape[1]
+            self.path.mkdir(parents=True, exist_ok=True)
+            # Replaced ids: the old row dies, the new version is appended
+            for doc_id in ids:
+                row = self._rows.pop(doc_id, None)
+                if row is not None:
+                    self.ids[row] = None
+            with open(self.docs_path, "ab") as f:
+                offset = f.tell()
+                for doc_id, doc, meta in zip(ids, documents, metadatas):
+                    data = doc.encode("utf-8", errors="ignore")
+                    f.write(data)
+                    self._rows[doc_id] = len(self.ids)
+                    self.ids.append(doc_id)
+                    self.files.append(meta.get("file", ""))
+                    self.spans.append([offset, len(data)])
+                    self.lines.append([meta.get("start_line", 0), meta.get("end_line", 0)])
+                    offset += len(data)
+            with open(self.matrix_path, "ab") as f:
+                f.write(matrix.tobytes())
+            self._dirty = True
+            self._map_matrix()
+
+    def delete(self, ids):
+        self._load()
+        with self._lock:
+            for doc_id in ids:
+                row = self._rows.pop(doc_id, None)
+                if row is not None:
+                    self.ids[row] = None
+                    self._dirty = True
+            self._map_matrix()
+
+    def flush(self):
+        """Writes the metadata (and compacts the files when too many rows are dead)."""
+        self._load()
+        with self._lock:
+            if not self._dirty:
+                return
+            if len(self._dead) > COMPACT_RATIO * max(len(self.ids), 1):
+                self._compact()
+            self.path.mkdir(parents=True, exist_ok=True)
+            tmp = self.meta_path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"dim": self.dim, "ids": self.ids, "files": self.files, "spans": self.spans,
+                           "lines": self.lines}, f)
+            os.replace(tmp, self.meta_path)
+            self._dirty = False
+
+    def _compact(self):
+        alive = [i for i, doc_id in enumerate(self.ids) if doc_id is not None]
+        matrix_tmp = self.matrix_path.with_suffix(".tmp")
+        docs_tmp = self.docs_path.with_suffix(".tmp")
+        spans = []
+        with open(self.docs_path, "rb") as src, open(docs_tmp, "wb") as dst:
+            for i in alive:
+                start, length = self.spans[i]
+                src.seek(start)
+                spans.append([dst.tell(), length])
+                dst.write(src.read(length))
+        np.ascontiguousarray(self._matrix[alive]).tofile(matrix_tmp)
+        self._matrix = None  # Release the old mapping before replacing the file
+        os.replace(matrix_tmp, self.matrix_path)
+        os.replace(docs_tmp, self.docs_path)
+        self.ids = [self.ids[i] for i in alive]
+        self.files = [self.files[i] for i in alive]
+        self.lines = [self.lines[i] for i in alive]
+        self.spans = spans
+        self._rows = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        self._map_matrix()
+
+    # --- Reading ---
+    def count(self) -> int:
+        self._load()
+        return len(self._rows)
+
+    def _document(self, row: int) -> str:
+        start, length = self.spans[row]
+        with open(self.docs_path, "rb") as f:
+            f.seek(start)
+            return f.read(length).decode("utf-8", errors="ignore")
+
+    def query(self, vectors: list[list[float]], n_results: int = 3) -> list[list[dict]]:
+        """Cosine top-k for a batch of query vectors (one matrix product for all of them)."""
+        self._load()
+        with self._lock:
+            matrix, dead = self._matrix, self._dead
+            alive = len(self._rows)
+        if not alive or len(vectors) == 0:
+            return [[] for _ in vectors]
+
+        queries = self._normalize(vectors)
+        if queries.shape[1] != matrix.shape[1]:
+            print(f"⚠️ Query embedding size {queries.shape[1]} does not match the index ({matrix.shape[1]})")
+            return [[] for _ in vectors]
+        scores = queries @ matrix.T
+        if len(dead):
+            scores[:, dead] = -np.inf
+
+        k = min(n_results, alive)
+        if k < scores.shape[1]:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(scores.shape[1]), (len(queries), 1))
+        matches = []
+        for row_scores, candidates in zip(scores, top):
+            ranked = candidates[np.argsort(-row_scores[candidates])]
+            matches.append([self._hit(i) for i in ranked])
+        return matches
+
+    def get(self, ids: list[str]) -> list[dict]:
+        """Chunks by id (no embedding involved); unknown ids are left out."""
+        self._load()
+        with self._lock:
+            rows = [self._rows.get(doc_id) for doc_id in ids]
+        return [self._hit(row) for row in rows if row is not None]
+
+    def _hit(self, row: int) -> dict:
+        start, end = self.lines[row]
+        return _hit(self.ids[row], {"file": self.files[row], "start_line": start, "end_line": end}, self._document(row))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """Process-wide retrieval backend (picked by AGENT_RAG_BACKEND, opened lazily, once)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if RAG_BACKEND == "numpy" and np is not None:
+                _store = NumpyStore()
+                if not os.path.exists(_store.meta_path) and os.path.exists(os.path.join(DB_PATH, "chroma.sqlite3")):
+                    print("ℹ️ Found a Chroma index but no numpy index yet: "
+                          "run 'python -m agent.vector_store migrate' (or re-index).")
+            else:
+                if RAG_BACKEND == "numpy":
+                    print("⚠️ NumPy is not installed: falling back to the Chroma vector backend.")
+                _store = ChromaStore()
+        return _store
+
+
+def migrate_from_chroma(db_path: str = DB_PATH, target: str = VECTORS_PATH, page: int = 1024) -> int:
+    """
+    Copies every chunk (embedding + document + metadata) of the Chroma collection into
+    the numpy index, so switching backends does not need a single new embedding.
+    Returns the number of chunks copied.
+    """
+    import chromadb
+    collection = chromadb.PersistentClient(path=db_path).get_or_create_collection(name=COLLECTION_NAME)
+    store = NumpyStore(target)
+    store.reset()
+
+    total = collection.count()
+    copied = 0
+    for offset in range(0, total, page):
+        batch = collection.get(include=["embeddings", "documents", "metadatas"], limit=page, offset=offset)
+        if not batch["ids"]:
+            break
+        store.upsert(batch["ids"], batch["embeddings"], batch["documents"], batch["metadatas"])
+        copied += len(batch["ids"])
+        print(f"   📦 {copied}/{total} chunks copied")
+    store.flush()
+
+    # Same chunk ids on both sides: the incremental manifest carries over as is
+    chroma_manifest = ChromaStore(db_path).manifest_path
+    if os.path.exists(chroma_manifest):
+        with open(chroma_manifest, "r", encoding="utf-8") as src, open(store.manifest_path, "w", encoding="utf-8") as dst:
+            dst.write(src.read())
+    print(f"✅ Migrated {copied} chunks from {db_path} to {target}")
+    return copied
+
+
+# --- SELF-RUNNER ---
+# `python -m agent.vector_store migrate` imports rag_db/chroma.sqlite3 into the numpy index.
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["migrate"]:
+        migrate_from_chroma()
+    else:
+        print("Usage: python -m agent.vector_store migrate")
@@ -0,0 +1,134 @@
+import json
+import random
+import subprocess
+from pathlib import Path
+
+# --- CONFIGURATION ---
+SIZES = {"small": 10, "medium": 1_000, "large": 10_000}   # Source files per corpus
+DEFAULT_SEED = 1234
+FLAGS = ["-Wall", "-Wextra", "-std=c11", "-I."]
+RECORDINGS = "recordings.jsonl"   # Model answers the fake server replays (see bench/fake_ollama.py)
+MANIFEST = "seeded.json"          # What was seeded where
+GITIGNORE = ".build_cache/\nrag_db/\nMemory/\n*.o\n"
+
+# Seeded issue kinds. The "rules" ones are handled by agent/rules.py without the model,
+# the "llm" ones need an answer from the (fake) model.
+RULE_KINDS = ["unused_variable", "unused_parameter", "missing_semicolon", "missing_libc_header"]
+LLM_KINDS = ["missing_project_include", "pointer_from_int", "missing_return_value"]
+
+
+def _header(k: int) -> str:
+    return (f"#ifndef MOD_{k}_H\n#define MOD_{k}_H\n\n"
+            f"typedef struct {{\n    int id;\n    int value;\n}} mod_{k}_state;\n\n"
+            f"int mod_{k}_compute(int a, int b);\n"
+            f"void mod_{k}_reset(mod_{k}_state *state);\n\n"
+            f"#endif\n")
+
+
+def _source(k: int, kind: str = "") -> tuple[str, list[dict]]:
+    """One module (seeded with `kind`, if any) and the fixes that repair it."""
+    dep = k - 1 if k > 0 else None
+    includes = f'#include <stdio.h>\n#include "mod_{k}.h"\n'
+    if dep is not None and kind != "missing_project_include":
+        includes += f'#include "mod_{dep}.h"\n'
+
+    compute = [f"int mod_{k}_compute(int a, int b) {{"]
+    if kind == "missing_return_value":
+        compute += ["    if (a < 0)", "        return;"]
+    compute.append("    int total = a + b;")
+    if kind == "unused_variable":
+        compute.append(f"    int seed_{k}_unused = 7;")
+    if dep is not None:
+        compute.append(f"    total += mod_{dep}_compute(a, 1);")
+    compute += ["    return total;", "}"]
+
+    reset = [f"void mod_{k}_reset(mod_{k}_state *state) {{", f"    state->id = {k};",
+             "    state->value = 0" + ("" if kind == "missing_semicolon" else ";")]
+    if kind == "pointer_from_int":
+        reset += [f"    int *seed_{k}_ptr = state->value;", f"    *seed_{k}_ptr = 1;"]
+    reset.append("}")
+
+    extra = []
+    if kind == "unused_parameter":
+        extra = [f"int mod_{k}_scale(int value, int factor) {{", "    return value * 2;", "}"]
+    elif kind == "missing_libc_header":
+        extra = [f"size_t mod_{k}_name_length(const char *name) {{", "    return strlen(name);", "}"]
+
+    text = includes + "\n" + "\n".join(compute) + "\n\n" + "\n".join(reset) + "\n"
+    if extra:
+        text += "\n" + "\n".join(extra) + "\n"
+
+    name = f"mod_{k}.c"
+    fixes = []
+    if kind == "missing_project_include":
+        fixes = [{"file": name, "original_code": f'#include "mod_{k}.h"\n',
+                  "replacement_code": f'#include "mod_{k}.h"\n#include "mod_{dep}.h"\n'}]
+    elif kind == "pointer_from_int":
+        fixes = [{"file": name, "original_code": f"    int *seed_{k}_ptr = state->value;",
+                  "replacement_code": f"    int *seed_{k}_ptr = &state->value;"}]
+    elif kind == "missing_return_value":
+        fixes = [{"file": name, "original_code": "        return;", "replacement_code": "        return -1;"}]
+    return text, fixes
+
+
+def generate(root: Path, files: int, issues: int = 20, seed: int = DEFAULT_SEED, git: bool = True) -> dict:
+    """
+    Writes a C project of `files` modules (mod_<k>.c + mod_<k>.h, each calling the previous
+    one) with `issues` seeded errors/warnings, at most one per file, a compile_commands.json,
+    the model answers for the seeded issues that need one, and a git repo on 'main'.
+    The same (files, issues, seed) always gives the same bytes. Returns the manifest.
+    """
+    root = Path(root).resolve()
+    root.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    # Module 0 has no dependency, so it cannot lose its project #include
+    seeded_files = sorted(rng.sample(range(1, files), min(issues, files - 1))) if files > 1 else []
+    kinds = RULE_KINDS + LLM_KINDS
+    seeded = {k: kinds[i % len(kinds)] for i, k in enumerate(seeded_files)}
+
+    entries, recordings, manifest = [], [], {"files": files, "seed": seed, "issues": []}
+    for k in range(files):
+        kind = seeded.get(k, "")
+        text, fixes = _source(k, kind)
+        (root / f"mod_{k}.h").write_text(_header(k), encoding="utf-8", newline="\n")
+        (root / f"mod_{k}.c").write_text(text, encoding="utf-8", newline="\n")
+        entries.append({"directory": str(root), "arguments": ["gcc", *FLAGS, "-c", str(root / f"mod_{k}.c")],
+                        "file": str(root / f"mod_{k}.c")})
+        if kind:
+            manifest["issues"].append({"file": f"mod_{k}.c", "kind": kind,
+                                       "fixed_by": "llm" if kind in LLM_KINDS else "rules"})
+        if fixes:
+            # The fake model answers when the ERROR part of the prompt names this file
+            recordings.append({"match": rf"(?:^|[\s\\/])mod_{k}\.c:\d+", "response": json.dumps({"fixes": fixes})})
+
+    with open(root / "compile_commands.json", "w", encoding="utf-8") as f:
+        json.dump(entries, f, indent=1)
+    with open(root / RECORDINGS, "w", encoding="utf-8") as f:
+        for entry in recordings:
+            f.write(json.dumps(entry) + "\n")
+    with open(root / MANIFEST, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    (root / ".gitignore").write_text(GITIGNORE, encoding="utf-8")
+
+    if git:
+        _git(root, "init", "-q", "-b", "main")
+        _git(root, "add", "-A")
+        _git(root, "-c", "user.name=bench", "-c", "user.email=bench@localhost", "commit", "-q", "-m", "corpus")
+    return manifest
+
+
+def _git(root: Path, *args: str):
+    subprocess.run(["git", *args], cwd=root, check=True, capture_output=True)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Writes a seeded C corpus for the benchmark.")
+    parser.add_argument("root")
+    parser.add_argument("--size", choices=SIZES, default="small")
+    parser.add_argument("--issues", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    args = parser.parse_args()
+    result = generate(Path(args.root), SIZES[args.size], args.issues, args.seed)
+    print(f"📦 {result['files']} files, {len(result['issues'])} seeded issues in {args.root}")
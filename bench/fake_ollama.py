@@ -0,0 +1,261 @@
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+# --- CONFIGURATION ---
+# Latency of the fake model. The same numbers every run, so only the agent's own time changes
+# between commits.
+TTFT = 0.2              # Seconds before the first token (model load + prefill)
+TOKENS_PER_SECOND = 100 # Decode speed; 0 = the whole answer at once
+EMBED_LATENCY = 0.005   # Seconds per /api/embed(dings) request
+EMBED_DIM = 256
+CHUNK_CHARS = 4         # One streamed "token" (~4 characters, like agent/context.py estimates)
+NO_FIX = json.dumps({"fixes": []})
+
+_IDENT_RE = re.compile(r"[A-Za-z_]\w*")
+_LOCATION_RE = re.compile(r"([^\s:]+\.\w+):\d+")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def embed(text: str) -> list[float]:
+    """Deterministic stand-in for an embedding: hashed bag of identifiers, L2-normalized."""
+    vector = [0.0] * EMBED_DIM
+    for ident in _IDENT_RE.findall(text):
+        digest = hashlib.blake2b(ident.encode(), digest_size=4).digest()
+        value = int.from_bytes(digest, "little")
+        vector[value % EMBED_DIM] += 1.0 if value & 0x80000000 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def error_section(messages: list[dict]) -> str:
+    """The part of the last user message the answer depends on (after 'ERROR:'), or all of it."""
+    for message in reversed(messages or []):
+        if message.get("role") == "user":
+            content = message.get("content", "")
+            index = content.rfind("ERROR:")
+            return content[index + len("ERROR:"):] if index >= 0 else content
+    return ""
+
+
+class Recordings:
+    """
+    The replayed answers: one {"match": regex, "response": text} per line of a .jsonl file.
+    The first regex found in the error section wins; no match means an empty fix list.
+    """
+
+    def __init__(self, path: Path = None):
+        self.path = Path(path) if path else None
+        self.entries = []
+        self._lock = threading.Lock()
+        if self.path and self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries.append((re.compile(entry["match"]), entry["response"]))
+
+    def find(self, error_text: str):
+        for pattern, response in self.entries:
+            if pattern.search(error_text):
+                return response
+        return None
+
+    def add(self, error_text: str, response: str):
+        """Records a real answer, keyed on the first 'file:line' of the error (any line number)."""
+        location = _LOCATION_RE.search(error_text)
+        pattern = (rf"(?:^|[\s\\/]){re.escape(Path(location.group(1)).name)}:\d+" if location
+                   else re.escape(error_text.strip()[:200]))
+        with self._lock:
+            self.entries.append((re.compile(pattern), response))
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"match": pattern, "response": response}) + "\n")
+
+
+class FakeOllama(ThreadingHTTPServer):
+    """
+    Local stand-in for the Ollama API the agent uses (/api/chat, /api/embeddings, /api/embed,
+    /api/generate for the preload, /api/tags). Chat answers come from the recordings, with
+    Ollama's own timing fields, so the agent's TTFT/tokens-per-second logging keeps working.
+    With `upstream`, unknown prompts are sent to a real server and its answers recorded.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, recordings: Recordings = None, ttft: float = TTFT,
+                 tokens_per_second: float = TOKENS_PER_SECOND, embed_latency: float = EMBED_LATENCY,
+                 upstream: str = None):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.recordings = recordings or Recordings()
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.embed_latency = embed_latency
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.stats = {"chat": 0, "replayed": 0, "recorded": 0, "unmatched": 0, "embed_texts": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, name="fake-ollama", daemon=True)
+        thread.start()
+        return thread
+
+    def count(self, key: str, n: int = 1):
+        with self._lock:
+            self.stats[key] += n
+
+    def answer(self, payload: dict) -> str:
+        self.count("chat")
+        error_text = error_section(payload.get("messages"))
+        response = self.recordings.find(error_text)
+        if response is not None:
+            self.count("replayed")
+            return response
+        if self.upstream:
+            resp = requests.post(f"{self.upstream}/api/chat", json={**payload, "stream": False}, timeout=600)
+            resp.raise_for_status()
+            response = resp.json()["message"]["content"]
+            self.recordings.add(error_text, response)
+            self.count("recorded")
+            return response
+        self.count("unmatched")
+        return NO_FIX
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # The agent's console is noisy enough
+
+    def _payload(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        return json.loads(body) if body else {}
+
+    def _send_json(self, data: dict, status: int = 200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/api/tags":
+            self._send_json({"models": []})
+        elif self.path in ("/", ""):
+            body = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        server: FakeOllama = self.server
+        payload = self._payload()
+        route = self.path.rstrip("/")
+        model = payload.get("model", "")
+
+        if route == "/api/embeddings":
+            server.count("embed_texts")
+            time.sleep(server.embed_latency)
+            self._send_json({"embedding": embed(payload.get("prompt", ""))})
+        elif route == "/api/embed":
+            texts = payload.get("input", [])
+            texts = [texts] if isinstance(texts, str) else texts
+            server.count("embed_texts", len(texts))
+            time.sleep(server.embed_latency)
+            self._send_json({"model": model, "embeddings": [embed(t) for t in texts],
+                             "total_duration": int(server.embed_latency * 1e9), "load_duration": 0,
+                             "prompt_eval_count": sum(len(t) // CHUNK_CHARS for t in texts)})
+        elif route == "/api/generate":
+            # Only used empty, to preload the model
+            self._send_json({"model": model, "created_at": _now(), "response": "", "done": True,
+                             "done_reason": "load"})
+        elif route == "/api/chat":
+            try:
+                content = server.answer(payload)
+            except Exception as e:
+                self._send_json({"error": f"upstream failed: {e}"}, 502)
+                return
+            self._chat(payload, content)
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def _chat(self, payload: dict, content: str):
+        server: FakeOllama = self.server
+        started = time.perf_counter()
+        prompt = "".join(m.get("content", "") for m in payload.get("messages", []))
+        chunks = [content[i:i + CHUNK_CHARS] for i in range(0, len(content), CHUNK_CHARS)]
+        delay = 1.0 / server.tokens_per_second if server.tokens_per_second else 0.0
+        base = {"model": payload.get("model", ""), "created_at": _now()}
+
+        def final(decode_s: float) -> dict:
+            return {**base, "done": True, "done_reason": "stop",
+                    "total_duration": int((time.perf_counter() - started) * 1e9), "load_duration": 0,
+                    "prompt_eval_count": len(prompt) // CHUNK_CHARS, "prompt_eval_duration": int(server.ttft * 1e9),
+                    "eval_count": len(chunks), "eval_duration": int(decode_s * 1e9)}
+
+        time.sleep(server.ttft)
+        if not payload.get("stream", True):
+            time.sleep(delay * len(chunks))
+            self._send_json({**final(delay * len(chunks)), "message": {"role": "assistant", "content": content}})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        decode_started = time.perf_counter()
+        try:
+            for chunk in chunks:
+                self._write_chunk({**base, "message": {"role": "assistant", "content": chunk}, "done": False})
+                if delay:
+                    time.sleep(delay)
+            self._write_chunk({**final(time.perf_counter() - decode_started),
+                               "message": {"role": "assistant", "content": ""}})
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # The agent stopped the generation early
+
+    def _write_chunk(self, data: dict):
+        line = (json.dumps(data) + "\n").encode()
+        self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+        self.wfile.flush()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fake Ollama server replaying recorded answers.")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--recordings", type=Path, help="recordings .jsonl (replayed, and appended to with --upstream)")
+    parser.add_argument("--ttft", type=float, default=TTFT)
+    parser.add_argument("--tps", type=float, default=TOKENS_PER_SECOND)
+    parser.add_argument("--embed-latency", type=float, default=EMBED_LATENCY)
+    parser.add_argument("--upstream", help="real Ollama URL to record unknown prompts from")
+    args = parser.parse_args()
+    server = FakeOllama(args.port, Recordings(args.recordings), args.ttft, args.tps, args.embed_latency, args.upstream)
+    print(f"🎭 Fake Ollama on {server.url} ({len(server.recordings.entries)} recorded answers)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
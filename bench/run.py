@@ -0,0 +1,215 @@
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from bench.corpus import DEFAULT_SEED, FLAGS, RECORDINGS, SIZES, generate
+from bench.fake_ollama import EMBED_LATENCY, TOKENS_PER_SECOND, TTFT, FakeOllama, Recordings
+
+try:
+    import resource  # Not on Windows: peak RSS is reported as None there
+except ImportError:
+    resource = None
+
+# --- CONFIGURATION ---
+REPO_ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = REPO_ROOT / "bench" / "results"
+DEFAULT_ISSUES = 7        # One of each seeded kind (see bench/corpus.py), same for every size
+RUN_TIMEOUT = 3600        # Seconds for one agent run
+CHECK_JOBS = os.cpu_count() or 4
+
+
+def _peak_rss_mb(who) -> float:
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def child_main(result_path: str):
+    """
+    Runs inside the corpus (cwd), like 'python main.py' would, then dumps what the tracer
+    saw: per-node time, model calls, builds, plus the agent's own peak RSS.
+    """
+    sys.path.insert(0, str(REPO_ROOT))
+    import main as agent_main
+    from agent.tracing import get_tracer
+
+    started = time.perf_counter()
+    agent_main.main()
+    agent_s = time.perf_counter() - started
+
+    tracer = get_tracer()
+    nodes = defaultdict(lambda: {"calls": 0, "total_s": 0.0})
+    steps = defaultdict(lambda: {"calls": 0, "total_s": 0.0})
+    for span in tracer.spans:
+        table = nodes if span["cat"] == "node" else steps
+        table[span["name"]]["calls"] += 1
+        table[span["name"]]["total_s"] += span["dur"]
+    result = {
+        "agent_s": round(agent_s, 3),
+        "nodes": {name: {**row, "total_s": round(row["total_s"], 3)} for name, row in nodes.items()},
+        "steps": {name: {**row, "total_s": round(row["total_s"], 3)} for name, row in steps.items()},
+        "llm_calls": steps.get("ollama chat", {}).get("calls", 0),
+        "builds": steps.get("gcc build", {}).get("calls", 0),
+        "counters": {name: dict(values) for name, values in tracer.counters.items()},
+        "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF) if resource else None,
+        "peak_child_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+    }
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=1)
+
+
+def _check(root: Path, name: str) -> bool:
+    """True when the file compiles without a single error or warning."""
+    res = subprocess.run(["gcc", *FLAGS, "-fsyntax-only", name], cwd=root, capture_output=True, text=True)
+    return res.returncode == 0 and not res.stderr.strip()
+
+
+def score(root: Path, manifest: dict) -> dict:
+    """Seeded issues gone for good, and files the agent touched that it left broken."""
+    seeded = {issue["file"]: issue for issue in manifest["issues"]}
+    changed = subprocess.run(["git", "diff", "--name-only", "main", "--", "*.c", "*.h"], cwd=root,
+                             capture_output=True, text=True).stdout.split()
+    sources = sorted(set(seeded) | {name for name in changed if name.endswith(".c")})
+    with ThreadPoolExecutor(CHECK_JOBS) as pool:
+        clean = dict(zip(sources, pool.map(lambda name: _check(root, name), sources)))
+
+    by_kind = defaultdict(lambda: {"seeded": 0, "fixed": 0})
+    for name, issue in seeded.items():
+        by_kind[issue["kind"]]["seeded"] += 1
+        by_kind[issue["kind"]]["fixed"] += clean[name]
+    fixed = sum(row["fixed"] for row in by_kind.values())
+    return {"seeded": len(seeded), "fixed": fixed,
+            "fix_rate": round(fixed / len(seeded), 3) if seeded else None,
+            "by_kind": dict(by_kind),
+            "broken_files": sorted(name for name in sources if name not in seeded and not clean[name]),
+            "changed_files": len(changed)}
+
+
+def run_size(size: str, files: int, issues: int, seed: int, latency: dict, out_dir: Path, keep: bool) -> dict:
+    work = Path(tempfile.mkdtemp(prefix=f"agent-bench-{size}-"))
+    try:
+        print(f"📦 Generating the {size} corpus ({files} files, {issues} seeded issues)...")
+        started = time.perf_counter()
+        manifest = generate(work, files, issues, seed)
+        corpus_s = time.perf_counter() - started
+
+        server = FakeOllama(recordings=Recordings(work / RECORDINGS), **latency)
+        server.start()
+        result_path = work / ".build_cache" / "bench-result.json"
+        result_path.parent.mkdir(exist_ok=True)
+        env = {**os.environ, "AGENT_PROJECT_DIR": ".", "AGENT_OLLAMA_URL": server.url,
+               "AGENT_TRACE_DIR": str(out_dir / "traces" / size),
+               "PYTHONPATH": os.pathsep.join(filter(None, [str(REPO_ROOT), os.environ.get("PYTHONPATH")]))}
+        log_path = out_dir / f"{size}.log"
+        print(f"🤖 Running the agent against {server.url} (log: {log_path})...")
+        started = time.perf_counter()
+        try:
+            with open(log_path, "w", encoding="utf-8") as log:
+                proc = subprocess.run([sys.executable, "-m", "bench.run", "--child", str(result_path)], cwd=work,
+                                      env=env, stdout=log, stderr=subprocess.STDOUT, timeout=RUN_TIMEOUT)
+            returncode = proc.returncode
+        except subprocess.TimeoutExpired:
+            returncode = "timeout"
+        wall_s = time.perf_counter() - started
+        server.shutdown()
+        server.server_close()
+
+        result = {"size": size, "files": files, "seed": seed, "returncode": returncode,
+                  "wall_s": round(wall_s, 3), "corpus_s": round(corpus_s, 3), "server": server.stats}
+        if result_path.exists():
+            with open(result_path, encoding="utf-8") as f:
+                result.update(json.load(f))
+        result.update(score(work, manifest))
+        return result
+    finally:
+        if keep:
+            print(f"   📁 Corpus kept in {work}")
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+
+
+def _environment() -> dict:
+    def output(*cmd):
+        try:
+            return subprocess.run(cmd, cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+        except OSError:
+            return ""
+    return {"commit": output("git", "rev-parse", "HEAD"), "dirty": bool(output("git", "status", "--porcelain")),
+            "python": platform.python_version(), "platform": platform.platform(),
+            "gcc": output("gcc", "-dumpfullversion"), "cpus": os.cpu_count()}
+
+
+def format_table(results: list[dict], baseline: list[dict] = None) -> str:
+    before = {r["size"]: r for r in baseline or []}
+    lines = [f"{'size':<8}{'files':>7}{'wall s':>15}{'LLM':>6}{'builds':>8}{'fixed':>9}{'RSS MB':>9}  slowest nodes"]
+    for r in results:
+        nodes = sorted(r.get("nodes", {}).items(), key=lambda item: -item[1]["total_s"])[:3]
+        wall = f"{r['wall_s']:.1f}"
+        old = before.get(r["size"])
+        if old and old.get("wall_s"):
+            wall += f" ({(r['wall_s'] - old['wall_s']) / old['wall_s']:+.0%})"
+        lines.append(f"{r['size']:<8}{r['files']:>7}{wall:>15}{r.get('llm_calls', '-'):>6}{r.get('builds', '-'):>8}"
+                     f"{str(r['fixed']) + '/' + str(r['seeded']):>9}{str(r.get('peak_rss_mb')):>9}  "
+                     + ", ".join(f"{name} {row['total_s']:.1f}s" for name, row in nodes))
+    return "\n".join(lines)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Offline, reproducible benchmark of the agent (no GPU, no network).")
+    parser.add_argument("--sizes", default="small", help=f"comma-separated, from {', '.join(SIZES)}")
+    parser.add_argument("--issues", type=int, default=DEFAULT_ISSUES)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--ttft", type=float, default=TTFT, help="fake model seconds to first token")
+    parser.add_argument("--tps", type=float, default=TOKENS_PER_SECOND, help="fake model tokens/s (0 = instant)")
+    parser.add_argument("--embed-latency", type=float, default=EMBED_LATENCY)
+    parser.add_argument("--output", type=Path, help="results .json (default bench/results/<commit>-<time>.json)")
+    parser.add_argument("--compare", type=Path, help="an earlier results .json to diff the wall time against")
+    parser.add_argument("--keep", action="store_true", help="keep the generated corpora")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child_main(args.child)
+        return
+
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    unknown = [s for s in sizes if s not in SIZES]
+    if unknown:
+        parser.error(f"unknown size(s): {', '.join(unknown)}")
+
+    environment = _environment()
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    output = args.output or RESULTS_DIR / f"{environment['commit'][:10] or 'nocommit'}-{stamp}.json"
+    out_dir = output.parent / output.stem
+    out_dir.mkdir(parents=True, exist_ok=True)
+    latency = {"ttft": args.ttft, "tokens_per_second": args.tps, "embed_latency": args.embed_latency}
+
+    results = [run_size(size, SIZES[size], args.issues, args.seed, latency, out_dir, args.keep) for size in sizes]
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"environment": environment, "latency": latency, "issues": args.issues, "results": results}, f, indent=1)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print("\n📊 Benchmark results")
+    print(format_table(results, baseline))
+    print(f"   🧾 Results written to {output}")
+    if any(r["returncode"] != 0 for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
 import sys
 from agent.graph import app
 from agent.nodes import check_workspace_node
+from agent.llm import MODEL
+from agent.ollama_session import start_preload
+from agent.rag import EMBED_MODEL
+from agent.tracing import get_tracer
 
 def main():
     print("🚀 LangGraph Agent Starting...")
@@ -23,13 +27,22 @@ def main():
         "code_context": ""
     }
 
-    # 3. Run the Graph!
+    # 3. Warm up the models while the first build runs (they stay pinned for the whole session)
+    start_preload([MODEL], [EMBED_MODEL])
+
+    # 4. Run the Graph!
     # The graph handles all the looping, logic, and state updates.
     try:
         app.invoke(initial_state)
         print("\n✅ Agent finished execution.")
     except Exception as e:
         print(f"\n💥 Critical Agent Error: {e}")
+    finally:
+        # 5. Where did the time go? (graph nodes, GCC, model calls, embeddings, vector queries, patches)
+        tracer = get_tracer()
+        print(tracer.summary())
+        for path in tracer.export():
+            print(f"   🧾 Trace written to {path}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,4 +1,8 @@
+import json
 import re
+import sys
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator
 
 ERROR_PATTERNS = [
     r"error:",
@@ -16,15 +20,22 @@ WARNING_PATTERNS = [
     r"unused (variable|parameter|function)",
 ]
 
+# Compiled ONCE: one combined alternation per category instead of one re.search per pattern
+ERROR_RE = re.compile("|".join(f"(?:{p})" for p in ERROR_PATTERNS), re.IGNORECASE)
+WARNING_RE = re.compile("|".join(f"(?:{p})" for p in WARNING_PATTERNS), re.IGNORECASE)
+
+
 def extract_gcc_errors(log_text: str, max_lines=200):
     lines = log_text.splitlines()
     matched = []
 
     for line in lines:
-        if any(re.search(p, line, re.IGNORECASE) for p in ERROR_PATTERNS):
+        if ERROR_RE.search(line):
             matched.append(line)
+            if len(matched) >= max_lines:
+                break
 
-    return matched[:max_lines]
+    return matched
 
 
 def extract_gcc_issues(log_text: str, max_lines=200):
@@ -36,13 +47,323 @@ def extract_gcc_issues(log_text: str, max_lines=200):
     warnings = []
 
     for line in log_text.splitlines():
-        if any(re.search(p, line, re.IGNORECASE) for p in ERROR_PATTERNS):
+        if ERROR_RE.search(line):
             errors.append(line)
 
-        elif any(re.search(p, line, re.IGNORECASE) for p in WARNING_PATTERNS):
+        elif WARNING_RE.search(line):
             warnings.append(line)
 
         if len(errors) + len(warnings) >= max_lines:
             break
 
     return errors, warnings
+
+
+# --- STRUCTURED DIAGNOSTIC ENGINE ---
+
+@dataclass(slots=True)
+class Diagnostic:
+    file: str
+    line: int
+    column: int
+    severity: str                 # "error" | "warning" | "note"
+    message: str
+    option: str = ""              # e.g. "-Wunused-variable" (from "[-Wunused-variable]" or "[-Werror=...]")
+    function: str = ""            # From "file: In function 'main':"
+    raw: str = ""                 # The original log line (used as the agent's issue text)
+    notes: list = field(default_factory=list)          # Attached 'note:' Diagnostics
+    include_chain: list = field(default_factory=list)  # ["a.c:1", ...] from "In file included from"
+    cascade_count: int = 0        # Follow-up errors collapsed into this root cause
+
+    def to_line(self) -> str:
+        """GCC-style one-line rendering: 'file:line:col: severity: message [-Wopt]'."""
+        location = f"{self.file}:{self.line}:{self.column}" if self.column else f"{self.file}:{self.line}"
+        option = f" [{self.option}]" if self.option else ""
+        return f"{location}: {self.severity}: {self.message}{option}"
+
+    def to_dict(self) -> dict:
+        return {
+            "file": self.file,
+            "line": self.line,
+            "column": self.column,
+            "severity": self.severity,
+            "message": self.message,
+            "option": self.option,
+            "function": self.function,
+            "notes": [n.to_dict() for n in self.notes],
+            "include_chain": list(self.include_chain),
+            "cascade_count": self.cascade_count,
+        }
+
+
+# One precompiled pattern for every kind of line we care about.
+# Each alternative is wrapped in an outer named group; it closes last, so m.lastgroup tells us which one matched.
+_PATH = r"(?:[A-Za-z]:)?[^:\n]+"  # No backtracking over ':' (optional Windows drive letter)
+_LINE_RE = re.compile(
+    # 1. "file.c:10:5: error: message [-Wflag]" (column optional, 'fatal error' counts as error)
+    rf"(?P<diag>(?P<file>{_PATH}):(?P<line>\d+):(?:(?P<column>\d+):)? ?(?P<severity>fatal error|error|warning|note): "
+    r"(?P<message>.*?)(?: \[(?P<option>-W[^\]]+|enabled by default)\])?$)"
+    # 2. "In file included from a.c:1:" / "                 from b.h:3,"
+    rf"|(?P<included>(?:In file included|\s+) from (?P<inc_file>{_PATH}):(?P<inc_line>\d+)(?::\d+)?[:,]$)"
+    # 3. "file.c: In function 'main':" (GCC uses typographic quotes in UTF-8 locales)
+    rf"|(?P<function>{_PATH}: In (?:member |static member )?(?:function|constructor|destructor) [‘'`](?P<fn_name>.+?)[’']:$)"
+    # 4. "file.c: At top level:"
+    rf"|(?P<toplevel>{_PATH}: At top level:$)"
+    # 5. "test.c:(.text+0x1e): undefined reference to `add_numbers'" (or "test.c:15: ...")
+    r"|(?P<linker>(?P<ld_file>[^:\s]+):(?:(?P<ld_line>\d+)|\([^)]*\)): (?P<ld_message>(?:undefined reference to|multiple definition of) .*)$)"
+    # 6. "collect2: error: ld returned 1 exit status", "/usr/bin/ld: cannot find -lfoo", "cc1: warning: ..."
+    r"|(?P<tool>(?P<tool_name>collect2|cc1|cc1plus|lto-wrapper|[^:\s]*ld(?:\.exe)?): "
+    r"(?:(?P<tool_sev>fatal error|error|warning|note): )?(?P<tool_message>.*)$)"
+)
+
+# Messages that usually leave the parser confused for a few lines
+_SYNTAX_ROOT_RE = re.compile(r"^(?:expected |stray |missing terminating|unterminated )|\bbefore\b")
+_QUOTED_RE = re.compile(r"[‘'`]([^’']+)[’']")
+
+# Upper bound of remembered (file, line, message) keys used for de-duplication
+MAX_SEEN = 200_000
+
+
+def _normalize_option(option: str) -> str:
+    if not option or option == "enabled by default":
+        return ""
+    if option.startswith("-Werror="):
+        return "-W" + option[len("-Werror="):]
+    return option
+
+
+def _from_match(m: re.Match, function: str, raw: str) -> Diagnostic:
+    severity = m.group("severity")
+    return Diagnostic(
+        file=sys.intern(m.group("file")),
+        line=int(m.group("line")),
+        column=int(m.group("column") or 0),
+        severity="error" if severity == "fatal error" else severity,
+        message=m.group("message"),
+        option=_normalize_option(m.group("option") or ""),
+        function=function,
+        raw=raw,
+    )
+
+
+def parse_diagnostic_line(line: str):
+    """
+    Parses a single compiler output line into a Diagnostic, or None.
+    Cheap enough to be called on every line while the compiler is still running.
+    (Notes and include chains need the surrounding lines: use DiagnosticStream for those.)
+    """
+    raw = line.strip()
+    m = _LINE_RE.match(raw)
+    if m is None:
+        return None
+    if m.lastgroup == "diag":
+        return _from_match(m, "", raw)
+    if m.lastgroup == "linker":
+        return Diagnostic(file=m.group("ld_file"), line=int(m.group("ld_line") or 0), column=0,
+                          severity="error", message=m.group("ld_message"), raw=raw)
+    return None
+
+
+def _from_json(item: dict) -> Diagnostic:
+    """Converts one entry of GCC's -fdiagnostics-format=json output."""
+    caret = {}
+    for loc in item.get("locations", []):
+        caret = loc.get("caret", {})
+        break
+    kind = item.get("kind", "error")
+    diag = Diagnostic(
+        file=sys.intern(caret.get("file", "")),
+        line=int(caret.get("line", 0)),
+        column=int(caret.get("column", 0)),
+        severity="error" if kind == "fatal error" else kind,
+        message=item.get("message", ""),
+        option=_normalize_option(item.get("option", "")),
+    )
+    diag.raw = diag.to_line()
+    diag.notes = [_from_json(child) for child in item.get("children", [])]
+    return diag
+
+
+def parse_gcc_json(text: str) -> list[Diagnostic]:
+    """Parses the JSON array(s) GCC prints with -fdiagnostics-format=json (one array per TU)."""
+    diags = []
+    for chunk in text.splitlines():
+        chunk = chunk.strip()
+        if not chunk.startswith("["):
+            continue
+        try:
+            items = json.loads(chunk)
+        except ValueError:
+            continue
+        diags.extend(_from_json(item) for item in items if isinstance(item, dict))
+    return diags
+
+
+class DiagnosticStream:
+    """
+    Incremental parser: feed() one line at a time, get finished Diagnostics back.
+    A diagnostic is 'finished' when the next non-note diagnostic starts (notes belong to it),
+    so memory stays bounded by a single pending diagnostic + the current include chain.
+    """
+
+    def __init__(self):
+        self._pending = None
+        self._include_chain = []
+        self._function = ""
+
+    def feed(self, line: str) -> list[Diagnostic]:
+        line = line.rstrip("\r\n")
+        if not line:
+            return []
+
+        first = line[0]
+        # Fast path: source echo / caret lines ("   12 |   int x;", "      |   ^~~")
+        if first == " " or first == "\t":
+            if "from " not in line:
+                return []
+        elif first == "[":
+            # A whole TU in -fdiagnostics-format=json
+            diags = parse_gcc_json(line)
+            if diags:
+                return self._emit() + diags
+            return []
+
+        m = _LINE_RE.match(line)
+        if m is None:
+            return []
+        kind = m.lastgroup
+
+        if kind == "diag":
+            diag = _from_match(m, self._function, line.strip())
+            if diag.severity == "note":
+                if self._pending is not None:
+                    self._pending.notes.append(diag)
+                return []
+            diag.include_chain = self._include_chain
+            self._include_chain = []
+            out = self._emit()
+            self._pending = diag
+            return out
+
+        if kind == "included":
+            if line.startswith("In file included"):
+                self._include_chain = []
+            self._include_chain.append(f"{m.group('inc_file')}:{m.group('inc_line')}")
+            return []
+
+        if kind == "function":
+            self._function = m.group("fn_name")
+            return []
+
+        if kind == "toplevel":
+            self._function = ""
+            return []
+
+        if kind == "linker":
+            diag = Diagnostic(file=sys.intern(m.group("ld_file")), line=int(m.group("ld_line") or 0), column=0,
+                              severity="error", message=m.group("ld_message"), function=self._function,
+                              raw=line.strip())
+            out = self._emit()
+            self._pending = diag
+            return out
+
+        if kind == "tool":
+            message = m.group("tool_message")
+            in_function = re.match(r"^.+?: in function [‘'`](.+?)[’']:$", message)
+            if in_function:
+                # "/usr/bin/ld: test.o: in function `main':" -> context for the next linker error
+                self._function = in_function.group(1)
+                return []
+            severity = m.group("tool_sev") or "error"
+            if severity == "note":
+                return []
+            diag = Diagnostic(file=m.group("tool_name"), line=0, column=0,
+                              severity="error" if severity == "fatal error" else severity,
+                              message=message, raw=line.strip())
+            out = self._emit()
+            self._pending = diag
+            return out
+
+        return []
+
+    def _emit(self) -> list[Diagnostic]:
+        if self._pending is None:
+            return []
+        diag, self._pending = self._pending, None
+        return [diag]
+
+    def flush(self) -> list[Diagnostic]:
+        """Returns the last pending diagnostic (call when the log ends)."""
+        self._function = ""
+        return self._emit()
+
+
+def iter_diagnostics(lines: Iterable[str]) -> Iterator[Diagnostic]:
+    """Streams Diagnostics out of any iterable of log lines (a list, an open file, a pipe...)."""
+    stream = DiagnosticStream()
+    for line in lines:
+        yield from stream.feed(line)
+    yield from stream.flush()
+
+
+def collapse_cascades(diags: Iterable[Diagnostic], window: int = 3) -> Iterator[Diagnostic]:
+    """
+    Drops follow-up noise so each root cause shows up once:
+    - exact duplicates (the same header diagnostic repeated for every TU that includes it)
+    - errors within `window` lines after a syntax error in the same file
+    - later errors about an identifier already reported as undeclared in the same function
+    - linker summaries ('collect2: ld returned 1 exit status') after a real linker error
+    Collapsed diagnostics increment the root's cascade_count.
+    """
+    seen = set()
+    root = None
+    undeclared = {}  # (file, function) -> set of identifiers already reported
+
+    for diag in diags:
+        key = (diag.file, diag.line, diag.column, diag.severity, diag.message)
+        if key in seen:
+            continue
+        if len(seen) >= MAX_SEEN:
+            seen.clear()
+        seen.add(key)
+
+        if diag.severity != "error":
+            yield diag
+            continue
+
+        if root is not None:
+            # Linker summary lines carry no information of their own
+            if diag.line == 0 and ("ld returned" in diag.message or "treated as errors" in diag.message):
+                root.cascade_count += 1
+                continue
+
+            # The parser is still confused after a syntax error
+            if (root.file == diag.file and 0 <= diag.line - root.line <= window
+                    and _SYNTAX_ROOT_RE.search(root.message)):
+                root.cascade_count += 1
+                continue
+
+        idents = _QUOTED_RE.findall(diag.message)
+        scope = (diag.file, diag.function)
+        if idents and idents[0] in undeclared.get(scope, ()):
+            if root is not None:
+                root.cascade_count += 1
+            continue
+        if "undeclared" in diag.message and idents:
+            undeclared.setdefault(scope, set()).add(idents[0])
+
+        root = diag
+        yield diag
+
+
+def parse_log(source, collapse: bool = True) -> Iterator[Diagnostic]:
+    """
+    One entry point for any log: a string, an iterable of lines, or an open file object.
+    Lines are consumed lazily, so a 100+ MB log file never has to be loaded in memory.
+    Usage:
+        with open("build.log", encoding="utf-8", errors="replace") as f:
+            for diag in parse_log(f): ...
+    """
+    lines = source.splitlines() if isinstance(source, str) else source
+    diags = iter_diagnostics(lines)
+    return collapse_cascades(diags) if collapse else diags